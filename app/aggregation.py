@@ -0,0 +1,328 @@
+from __future__ import annotations
+import heapq
+from dataclasses import dataclass
+
+from app.consts import AGGREGATION_MAX_GROUPS, AGGREGATION_SPILL_PARTITIONS
+from app.filtering import (
+    ColumnType,
+    sqlite_order_key,
+    text_to_number,
+    text_to_real,
+)
+
+from typing import (
+    List,
+    Optional,
+    Iterator,
+    Iterable,
+    Tuple,
+    Dict,
+    BinaryIO,
+    Callable,
+    Sequence,
+)
+
+SUPPORTED_AGGREGATES = ("COUNT", "SUM", "AVG", "MIN", "MAX")
+
+
+@dataclass(frozen=True)
+class Aggregate:
+    function: str  # upper-cased, one of SUPPORTED_AGGREGATES
+    column: Optional[str]  # None for COUNT(*)
+
+    def __str__(self) -> str:
+        return f"{self.function}({self.column or '*'})"
+
+
+@dataclass
+class AggregateOutput:
+    """
+    How to produce one output column of an aggregated row: an aggregate over the
+    decoded row position, or the value of a bare column (function is None)
+    """
+
+    function: Optional[str]
+    position: int  # position of the argument in decoded rows, -1 for COUNT(*)
+    # column of the argument, MIN and MAX compare text with its collating sequence
+    column_type: ColumnType = ColumnType()
+
+    @property
+    def order_key(self) -> Callable[[any], Tuple[int, any]]:
+        return self.column_type.key_order.order_key
+
+
+def to_number(value: any) -> any:
+    """
+    Numeric value of a column for SUM and AVG: text reading as a number is that number
+    (see text_to_number), other text and blobs are read as the real their numeric
+    prefix reads as (see text_to_real), 0.0 without one.
+    """
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, bytes):
+        return text_to_real(value.decode("utf-8", errors="replace"))
+
+    number = text_to_number(value)
+    return text_to_real(value) if type(number) is str else number
+
+
+class Accumulator:
+    def add(self, value: any):
+        raise NotImplementedError
+
+    def result(self) -> any:
+        raise NotImplementedError
+
+
+class CountAccumulator(Accumulator):
+    def __init__(self, counts_nulls: bool):
+        self.counts_nulls = counts_nulls
+        self.count = 0
+
+    def add(self, value: any):
+        if self.counts_nulls or value is not None:
+            self.count += 1
+
+    def result(self) -> int:
+        return self.count
+
+
+class SumAccumulator(Accumulator):
+    """
+    SUM is NULL over no value, an integer if every value read as a number was one (see
+    to_number) and a float otherwise. Like SQLite, an integer SUM that doesn't fit in
+    64 bits is an error, float ones never overflow.
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.count = 0
+        self.is_integer = True
+
+    def add(self, value: any):
+        if value is None:
+            return
+
+        number = to_number(value)
+        if type(number) is int and self.is_integer:
+            self.total += number
+        else:
+            self.is_integer = False
+            self.total = float(self.total) + float(number)
+        self.count += 1
+
+    def result(self) -> any:
+        if self.is_integer and not -(2**63) <= self.total < 2**63:
+            raise OverflowError("integer overflow")
+
+        return self.total if self.count else None
+
+
+class AvgAccumulator(SumAccumulator):
+    def result(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+
+class ExtremumAccumulator(Accumulator):
+    """
+    MIN or MAX, ignoring NULLs and comparing values with "order_key": across storage
+    classes like SQLite, text with the collating sequence of the column (see
+    IndexKeyOrder). The first of equal extrema is kept.
+    """
+
+    def __init__(
+        self,
+        is_max: bool,
+        order_key: Callable[[any], Tuple[int, any]] = sqlite_order_key,
+    ):
+        self.is_max = is_max
+        self.order_key = order_key
+        self.value = None
+        self.value_key = None
+
+    def add(self, value: any) -> bool:
+        """
+        Returns True when the value became the new extremum
+        """
+        if value is None:
+            return False
+
+        value_key = self.order_key(value)
+        if (
+            self.value_key is None
+            or (self.is_max and value_key > self.value_key)
+            or (not self.is_max and value_key < self.value_key)
+        ):
+            self.value, self.value_key = value, value_key
+            return True
+
+        return False
+
+    def result(self) -> any:
+        return self.value
+
+
+def make_accumulator(output: AggregateOutput) -> Accumulator:
+    match output.function:
+        case "COUNT":
+            # COUNT(*) has no argument and counts every row
+            return CountAccumulator(counts_nulls=output.position < 0)
+        case "SUM":
+            return SumAccumulator()
+        case "AVG":
+            return AvgAccumulator()
+        case "MIN" | "MAX":
+            return ExtremumAccumulator(output.function == "MAX", output.order_key)
+        case _:
+            raise TypeError(f"Aggregate '{output.function}' is not yet supported")
+
+
+class GroupState:
+    """
+    Accumulators of one group. Bare columns take their value from the row holding the
+    extremum when the query has a single MIN or MAX, else from the first row of the
+    group, as SQLite does.
+    """
+
+    def __init__(self, outputs: List[AggregateOutput]):
+        self.accumulators = [
+            make_accumulator(output) if output.function else None for output in outputs
+        ]
+        extrema = [
+            accumulator
+            for accumulator in self.accumulators
+            if isinstance(accumulator, ExtremumAccumulator)
+        ]
+        self.bare_row_source = extrema[0] if len(extrema) == 1 else None
+        self.bare_row = None
+
+    def add(self, row: Tuple[any, ...], outputs: List[AggregateOutput]):
+        take_bare_row = self.bare_row_source is None and self.bare_row is None
+        for accumulator, output in zip(self.accumulators, outputs):
+            if accumulator is None:
+                continue
+            value = row[output.position] if output.position >= 0 else None
+            improved = accumulator.add(value)
+            if accumulator is self.bare_row_source and improved:
+                take_bare_row = True
+
+        if take_bare_row:
+            self.bare_row = row
+
+    def result(self, outputs: List[AggregateOutput]) -> Tuple[any, ...]:
+        return tuple(
+            accumulator.result()
+            if accumulator is not None
+            else (self.bare_row[output.position] if self.bare_row is not None else None)
+            for accumulator, output in zip(self.accumulators, outputs)
+        )
+
+
+def aggregate_rows(
+    rows: Iterable[Tuple[any, ...]],
+    group_positions: List[int],
+    outputs: List[AggregateOutput],
+    group_types: Sequence[ColumnType] = (),
+    max_groups: int = AGGREGATION_MAX_GROUPS,
+) -> Iterator[Tuple[any, ...]]:
+    """
+    Hash aggregation of the rows, grouped by the values at "group_positions".
+    Yields one row per group laid out as "outputs", in group key order (like SQLite).
+    Without group positions, a single row is yielded even if there were no rows.
+
+    Group keys are the order keys of the values (see IndexKeyOrder), text compared
+    with the collating sequence of its column in "group_types" (BINARY by default):
+    values equal under it fall in the same group, whose bare columns come from its
+    first row.
+
+    At most "max_groups" groups are kept in memory: rows of new groups past that are
+    spilled to temporary files, partitioned by the hash of their group key, and each
+    partition is aggregated on its own once the input is exhausted.
+    """
+    order_keys = [
+        column_type.key_order.order_key
+        for column_type in group_types or [ColumnType()] * len(group_positions)
+    ]
+    for _, result in _aggregate_partition(
+        rows, list(zip(group_positions, order_keys)), outputs, max_groups, 0
+    ):
+        yield result
+
+
+def _aggregate_partition(
+    rows: Iterable[Tuple[any, ...]],
+    group_columns: List[Tuple[int, Callable[[any], Tuple[int, any]]]],
+    outputs: List[AggregateOutput],
+    max_groups: int,
+    depth: int,
+) -> Iterator[Tuple[Tuple[any, ...], Tuple[any, ...]]]:
+    """
+    Yields (group key, aggregated row) pairs in group key order, "group_columns"
+    being the position and order key function of each grouped column
+    """
+    groups: Dict[Tuple[any, ...], GroupState] = {}
+    if not group_columns:
+        groups[()] = GroupState(outputs)
+
+    spill_files: List[Optional[BinaryIO]] = [None] * AGGREGATION_SPILL_PARTITIONS
+    for row in rows:
+        key = tuple(order_key(row[position]) for position, order_key in group_columns)
+        state = groups.get(key)
+        if state is None:
+            if len(groups) >= max_groups:
+                # salted with the depth so a partition doesn't land in a single partition again
+                partition = hash((depth, key)) % AGGREGATION_SPILL_PARTITIONS
+                if spill_files[partition] is None:
+                    # pickle and tempfile are slow to import, they are only loaded
+                    # once spilling (rows are only pickled to a file created here)
+                    import pickle
+                    import tempfile
+
+                    spill_files[partition] = tempfile.TemporaryFile()
+                pickle.dump(row, spill_files[partition], pickle.HIGHEST_PROTOCOL)
+                continue
+
+            state = groups[key] = GroupState(outputs)
+        state.add(row, outputs)
+
+    in_memory = sorted(
+        ((key, state.result(outputs)) for key, state in groups.items()),
+        key=lambda group: group[0],
+    )
+    groups.clear()
+    if not any(spill_files):
+        yield from in_memory
+        return
+
+    # Aggregate each partition to a file of sorted results, then merge them all
+    result_files = []
+    for spill_file in filter(None, spill_files):
+        spill_file.seek(0)
+        result_file = tempfile.TemporaryFile()
+        for group in _aggregate_partition(
+            read_pickled(spill_file), group_columns, outputs, max_groups, depth + 1
+        ):
+            pickle.dump(group, result_file, pickle.HIGHEST_PROTOCOL)
+        spill_file.close()
+        result_file.seek(0)
+        result_files.append(result_file)
+
+    try:
+        yield from heapq.merge(
+            in_memory,
+            *(read_pickled(result_file) for result_file in result_files),
+            key=lambda group: group[0],
+        )
+    finally:
+        for result_file in result_files:
+            result_file.close()
+
+
+def read_pickled(file: BinaryIO) -> Iterator[any]:
+    import pickle
+
+    while True:
+        try:
+            yield pickle.load(file)
+        except EOFError:
+            return
@@ -0,0 +1,195 @@
+"""
+Runs a file of commands against a database, one per line (a trailing ";" is allowed,
+blank lines and "--" comments are skipped). Queries that scan the same table share
+a single pass over its leaf pages.
+
+    python3 -m app.batch databases/companies.db queries.sql
+    cat queries.sql | python3 -m app.batch databases/companies.db
+
+The output of each command is written in input order followed by an empty line,
+or to "<output-dir>/<n>.txt" for the n-th command.
+"""
+from __future__ import annotations
+import argparse
+import os
+import sys
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+from app.catalog import Catalog
+from app.commands import is_plain_query, iter_command_output
+from app.pager import Pager
+from app.pages import load_page_at_location
+from app.queries import (
+    Query,
+    format_row,
+    get_table_leaf_pages,
+    project_row,
+)
+
+from typing import List, Optional, Dict, Tuple, TextIO, Callable
+
+
+@dataclass
+class ScanConsumer:
+    """
+    A query fed the rows of a scan shared with other queries. Rows are decoded once
+    with the columns of every query sharing the scan, laid out as "shared_columns".
+    """
+
+    query: Query
+    projected_positions: List[int]  # positions of the query's columns in shared rows
+    row_filter: Optional[Callable[[Tuple[any, ...]], bool]]
+    remaining: Optional[int]  # rows the LIMIT still allows, None without a LIMIT
+    rows: List[List[any]] = field(default_factory=list)
+
+    @staticmethod
+    def for_query(query: Query, shared_columns: List[str]) -> ScanConsumer:
+        return ScanConsumer(
+            query,
+            [shared_columns.index(column) for column in query.requested_column_names],
+            query.value_filter.bind(shared_columns.index) if query.value_filter else None,
+            query.limit,
+        )
+
+    @property
+    def is_done(self) -> bool:
+        return self.remaining == 0
+
+    def feed(self, row: Tuple[any, ...]):
+        if self.is_done:
+            return
+        if self.row_filter and not self.row_filter(row):
+            return
+
+        self.rows.append(project_row(row, self.projected_positions))
+        if self.remaining is not None:
+            self.remaining -= 1
+
+
+def run_shared_scan(
+    pager: Pager, catalog: Catalog, table_name: str, queries: List[Query]
+) -> List[List[List[any]]]:
+    """
+    Answers queries fully scanning the same table with a single pass over its
+    leaf pages. Returns the rows of each query, in the order of "queries".
+    """
+    table = catalog.table(table_name)
+    shared_columns = list(
+        dict.fromkeys(
+            column for query in queries for column in query.decoded_column_names()
+        )
+    )
+    column_ordinals = table.resolve_column_ordinals(shared_columns)
+    real_columns = table.real_ordinals
+    defaults = table.default_ordinals
+
+    consumers = [ScanConsumer.for_query(query, shared_columns) for query in queries]
+    active = [consumer for consumer in consumers if not consumer.is_done]
+    for page in get_table_leaf_pages(pager, catalog, table_name, None):
+        if not active:
+            # every query reached its LIMIT
+            break
+
+        for row in page.iter_records(pager, column_ordinals, real_columns, defaults):
+            for consumer in active:
+                consumer.feed(row)
+
+        active = [consumer for consumer in active if not consumer.is_done]
+
+    return [consumer.rows for consumer in consumers]
+
+
+def read_commands(commands_file: TextIO) -> List[str]:
+    commands = []
+    for line in commands_file:
+        command = line.strip().rstrip(";").strip()
+        if command and not command.startswith("--"):
+            commands.append(command)
+
+    return commands
+
+
+def run_batch(pager: Pager, catalog: Catalog, commands: List[str]) -> List[List[str]]:
+    """
+    Returns the output lines of each command. Full table scans are grouped by table
+    and answered by a shared scan, everything else runs on its own.
+    """
+    outputs: Dict[int, List[str]] = {}
+    scans_by_table: Dict[str, List[Tuple[int, Query]]] = defaultdict(list)
+    for position, command in enumerate(commands):
+        if not is_plain_query(command):
+            continue
+        try:
+            query = Query.parse_query(command).prepare(catalog, pager.text_encoding)
+            if query.is_full_table_scan(catalog):
+                scans_by_table[query.table_name].append((position, query))
+        except Exception as error:
+            outputs[position] = [f"Error: {error}"]
+
+    for table_name, scans in scans_by_table.items():
+        if len(scans) < 2:
+            continue
+
+        positions, queries = zip(*scans)
+        try:
+            query_rows = run_shared_scan(pager, catalog, table_name, list(queries))
+        except Exception as error:
+            outputs.update((position, [f"Error: {error}"]) for position in positions)
+            continue
+
+        for position, rows in zip(positions, query_rows):
+            outputs[position] = [format_row(row) for row in rows]
+
+    for position, command in enumerate(commands):
+        if position in outputs:
+            continue
+        try:
+            outputs[position] = list(iter_command_output(pager, catalog, command))
+        except Exception as error:
+            outputs[position] = [f"Error: {error}"]
+
+    return [outputs[position] for position in range(len(commands))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("database_file_path")
+    parser.add_argument(
+        "commands_file", nargs="?", help="file of commands, stdin is read otherwise"
+    )
+    parser.add_argument("--output-dir", help="write each command output to its own file")
+    parser.add_argument(
+        "--stats", action="store_true", help="print page cache statistics to stderr"
+    )
+    args = parser.parse_args()
+
+    if args.commands_file:
+        with open(args.commands_file) as commands_file:
+            commands = read_commands(commands_file)
+    else:
+        commands = read_commands(sys.stdin)
+
+    with Pager(args.database_file_path) as pager:
+        catalog = Catalog.from_schema(
+            load_page_at_location(pager, 0).read_sqlite_schema(pager)
+        )
+        outputs = run_batch(pager, catalog, commands)
+
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+        for position, lines in enumerate(outputs):
+            text = "".join(f"{line}\n" for line in lines)
+            if args.output_dir:
+                output_path = os.path.join(args.output_dir, f"{position + 1}.txt")
+                with open(output_path, "w") as output_file:
+                    output_file.write(text)
+            else:
+                sys.stdout.write(text + "\n")
+
+        if args.stats:
+            print(f"Page cache: {pager.page_cache.stats}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
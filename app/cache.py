@@ -0,0 +1,91 @@
+from __future__ import annotations
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from typing import Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from app.pages import Page
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"hits={self.hits} misses={self.misses} evictions={self.evictions}"
+            f" hit_ratio={self.hit_ratio:.2%}"
+        )
+
+
+class PageCache:
+    """
+    Bounded LRU cache of parsed pages, keyed by their 0-based page index.
+
+    Pages hold a view over the mapped file plus whatever was decoded from it
+    (header, cell pointer array, interior pointers or index records), so each
+    entry is accounted as one page worth of bytes when sizing by "max_bytes".
+
+    Safe to share between threads, e.g. by the query server.
+    """
+
+    capacity: int
+    stats: CacheStats
+
+    def __init__(
+        self,
+        page_size: int,
+        max_pages: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+    ):
+        limits = []
+        if max_pages is not None:
+            limits.append(max_pages)
+        if max_bytes is not None:
+            limits.append(max_bytes // page_size)
+
+        if not limits:
+            raise ValueError("Page cache needs either max_pages or max_bytes")
+
+        self.capacity = max(min(limits), 0)
+        self.stats = CacheStats()
+        self._pages: OrderedDict[int, Page] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, page_idx: int) -> Optional[Page]:
+        with self._lock:
+            page = self._pages.get(page_idx)
+            if page is None:
+                self.stats.misses += 1
+                return None
+
+            self._pages.move_to_end(page_idx)
+            self.stats.hits += 1
+            return page
+
+    def put(self, page_idx: int, page: Page):
+        if self.capacity == 0:
+            return
+
+        with self._lock:
+            self._pages[page_idx] = page
+            self._pages.move_to_end(page_idx)
+            if len(self._pages) > self.capacity:
+                self._pages.popitem(last=False)
+                self.stats.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+
+    def __len__(self) -> int:
+        return len(self._pages)
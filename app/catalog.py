@@ -0,0 +1,515 @@
+from __future__ import annotations
+import re
+from dataclasses import dataclass, field
+
+from app.consts import (
+    ROW_ID_ORDINAL,
+    BUILTIN_COLLATIONS,
+    DEFAULT_COLLATION,
+    AFFINITY_TYPE_SUBSTRINGS,
+)
+from app.filtering import NUMERIC_AFFINITIES, apply_affinity, text_to_number
+from app.rows import Schema
+from app.tokenizer import Token, tokenize
+
+from typing import List, Dict, FrozenSet, Optional
+
+# Clauses that start a table constraint instead of a column definition
+# https://www.sqlite.org/syntax/table-constraint.html
+TABLE_CONSTRAINT_KEYWORDS = ("CONSTRAINT", "PRIMARY", "UNIQUE", "CHECK", "FOREIGN")
+# Clauses that end the type name of a column definition
+# https://www.sqlite.org/syntax/column-constraint.html
+COLUMN_CONSTRAINT_KEYWORDS = (
+    "CONSTRAINT",
+    "PRIMARY",
+    "NOT",
+    "NULL",
+    "UNIQUE",
+    "CHECK",
+    "DEFAULT",
+    "COLLATE",
+    "REFERENCES",
+    "GENERATED",
+    "AS",
+)
+
+
+@dataclass
+class TableDefinition:
+    columns: List[str]
+    row_id_alias: Optional[str]
+    # columns of each UNIQUE and (non row id) PRIMARY KEY constraint, in declaration
+    # order. The N-th one is backed by the sqlite_autoindex_<table>_<N> index.
+    unique_keys: List[List[str]]
+    # collating sequence declared by the columns having a COLLATE clause
+    collations: Dict[str, str] = field(default_factory=dict)
+    # type affinity of every column, from its declared type, e.g. "REAL"
+    affinities: Dict[str, str] = field(default_factory=dict)
+    # value of the columns having a non NULL constant DEFAULT, see parse_default_value
+    defaults: Dict[str, any] = field(default_factory=dict)
+
+
+@dataclass
+class IndexDefinition:
+    columns: List[str]  # indexed columns, in key order
+    # collating sequence declared for each column in the index, None when it has none
+    collations: List[Optional[str]]
+    descending: List[bool]
+    is_partial: bool
+
+
+@dataclass
+class IndexInfo:
+    name: str
+    table_name: str
+    rootpage: int
+    columns: List[str]  # indexed columns, in key order
+    is_partial: bool = False  # indexes with a WHERE clause don't hold every row
+    # collating sequence ordering the text keys of each column, e.g. "NOCASE"
+    collations: List[str] = field(default_factory=list)
+    descending: List[bool] = field(default_factory=list)  # columns sorted DESC
+
+    def __post_init__(self):
+        self.collations = self.collations or [DEFAULT_COLLATION] * len(self.columns)
+        self.descending = self.descending or [False] * len(self.columns)
+
+    @property
+    def is_searchable(self) -> bool:
+        """
+        Whether keys can be searched by their leading column, which needs the order of
+        the b-tree to be known: ascending, with a built-in collating sequence
+        """
+        return self.collations[0] in BUILTIN_COLLATIONS and not self.descending[0]
+
+    def sorts_in_order(self, collations: List[str]) -> bool:
+        """
+        Whether the first indexed columns, one per collating sequence, are sorted like
+        rows ordered by them: ascending and comparing text with those collating
+        sequences. Collations past the indexed columns (the row id) aren't checked.
+        """
+        return all(
+            collation == expected and not is_descending
+            for collation, is_descending, expected in zip(
+                self.collations, self.descending, collations
+            )
+        )
+
+
+@dataclass
+class TableInfo:
+    name: str
+    rootpage: int
+    columns: List[str]
+    row_id_alias: Optional[str]  # column declared as INTEGER PRIMARY KEY
+    sql: str
+    indexes: List[IndexInfo] = field(default_factory=list)
+    # type affinity of every column, see column_affinity
+    affinities: Dict[str, str] = field(default_factory=dict)
+    # collating sequence declared by the columns having a COLLATE clause
+    collations: Dict[str, str] = field(default_factory=dict)
+    # value of the columns having a non NULL constant DEFAULT, see parse_default_value
+    defaults: Dict[str, any] = field(default_factory=dict)
+
+    @property
+    def real_ordinals(self) -> FrozenSet[int]:
+        """
+        Ordinals of the REAL affinity columns, whose integral values are stored as
+        integers but read back as floats
+        """
+        return frozenset(
+            ordinal
+            for ordinal, column in enumerate(self.columns)
+            if self.affinities.get(column) == "REAL"
+        )
+
+    @property
+    def default_ordinals(self) -> Dict[int, any]:
+        """
+        Default value of the columns having one, by ordinal. Records written before
+        ALTER TABLE ADD COLUMN end before the added columns, which read as their default.
+        """
+        return {
+            ordinal: self.defaults[column]
+            for ordinal, column in enumerate(self.columns)
+            if column in self.defaults and column != self.row_id_alias
+        }
+
+    def real_key_positions(self, index: IndexInfo) -> FrozenSet[int]:
+        """
+        Positions of the REAL affinity columns in the keys of the index, see real_ordinals
+        """
+        return frozenset(
+            position
+            for position, column in enumerate(index.columns)
+            if self.affinities.get(column) == "REAL"
+        )
+
+    def resolve_column_ordinals(self, column_names: List[str]) -> List[int]:
+        """
+        Maps column names to their position in the table records, the row id alias
+        being read from the table b-tree key (ROW_ID_ORDINAL)
+        """
+        ordinals = []
+        for column_name in column_names:
+            if column_name not in self.columns:
+                raise ValueError(
+                    f"Unknown column '{column_name}', table has {self.columns}"
+                )
+            if column_name == self.row_id_alias:
+                ordinals.append(ROW_ID_ORDINAL)
+            else:
+                ordinals.append(self.columns.index(column_name))
+
+        return ordinals
+
+
+class Catalog:
+    """
+    Tables and indexes of the database, parsed once from the sqlite_schema table.
+
+    Indexes are attached to their table with their ordered column list, whatever
+    their name, including the sqlite_autoindex_* ones backing UNIQUE and
+    PRIMARY KEY constraints (which have no SQL of their own).
+    """
+
+    schema: List[Schema]
+    tables: Dict[str, TableInfo]
+
+    def __init__(self, schema: List[Schema], tables: Dict[str, TableInfo]):
+        self.schema = schema
+        self.tables = tables
+
+    @staticmethod
+    def from_schema(sqlite_schema: List[Schema]) -> Catalog:
+        tables = {}
+        unique_keys = {}
+        for schema in sqlite_schema:
+            if schema.table_type != "table":
+                continue
+
+            sql = normalize_schema_sql(schema.sql)
+            definition = parse_create_table(sql)
+            tables[schema.name] = TableInfo(
+                name=schema.name,
+                rootpage=schema.rootpage,
+                columns=definition.columns,
+                row_id_alias=definition.row_id_alias,
+                sql=sql,
+                affinities=definition.affinities,
+                collations=definition.collations,
+                defaults=definition.defaults,
+            )
+            unique_keys[schema.name] = definition.unique_keys
+
+        for schema in sqlite_schema:
+            if schema.table_type != "index" or schema.table_name not in tables:
+                continue
+
+            table = tables[schema.table_name]
+            if schema.sql is not None:
+                index = parse_create_index(normalize_schema_sql(schema.sql))
+            else:
+                columns = get_autoindex_columns(unique_keys[table.name], schema.name)
+                index = IndexDefinition(
+                    columns, [None] * len(columns), [False] * len(columns), False
+                )
+
+            if index.columns:
+                # columns without a COLLATE clause in the index use the one of the table
+                collations = [
+                    collation or table.collations.get(column, DEFAULT_COLLATION)
+                    for column, collation in zip(index.columns, index.collations)
+                ]
+                table.indexes.append(
+                    IndexInfo(
+                        schema.name,
+                        table.name,
+                        schema.rootpage,
+                        index.columns,
+                        index.is_partial,
+                        collations,
+                        index.descending,
+                    )
+                )
+
+        return Catalog(sqlite_schema, tables)
+
+    def table(self, table_name: str) -> TableInfo:
+        if table_name not in self.tables:
+            raise ValueError(
+                f"No such table '{table_name}', database has {list(self.tables)}"
+            )
+
+        return self.tables[table_name]
+
+    def find_index(
+        self, table_name: str, column: str, collation: Optional[str] = None
+    ) -> Optional[IndexInfo]:
+        """
+        Returns an index whose leading column is the given one, if any, sorting its text
+        with "collation" when given. Narrower indexes are preferred as more of their
+        keys fit in a page.
+        """
+        candidates = [
+            index
+            for index in self.table(table_name).indexes
+            if not index.is_partial
+            and index.is_searchable
+            and index.columns[0] == column
+            and collation in (None, index.collations[0])
+        ]
+
+        return min(candidates, key=lambda index: len(index.columns), default=None)
+
+
+def normalize_schema_sql(sql: str) -> str:
+    return sql.replace("\r", " ")
+
+
+def split_definitions(tokens: List[Token]) -> List[List[Token]]:
+    """
+    Splits the tokens inside the first parenthesis of a CREATE statement on the
+    commas outside of nested parenthesis (e.g. "varchar(10)", "UNIQUE (a, b)")
+    """
+    start = next(
+        (i for i, token in enumerate(tokens) if token.kind == "punctuation" and token.value == "("),
+        None,
+    )
+    if start is None:
+        raise ValueError("Could not find definitions in creation query")
+
+    definitions = [[]]
+    depth = 0
+    for token in tokens[start + 1 :]:
+        if token.kind == "punctuation" and token.value == "(":
+            depth += 1
+        elif token.kind == "punctuation" and token.value == ")":
+            if depth == 0:
+                break
+            depth -= 1
+        elif token.kind == "punctuation" and token.value == "," and depth == 0:
+            definitions.append([])
+            continue
+        definitions[-1].append(token)
+
+    return [definition for definition in definitions if definition]
+
+
+def keyword_position(definition: List[Token], *keywords: str) -> int:
+    """
+    Position of the first occurrence of the keywords (in sequence), -1 if absent
+    """
+    for position in range(len(definition) - len(keywords) + 1):
+        if all(
+            definition[position + offset].upper == keyword
+            for offset, keyword in enumerate(keywords)
+        ):
+            return position
+
+    return -1
+
+
+def parse_create_table(sql_creation_query: str) -> TableDefinition:
+    """
+    Creation query will look like
+
+    '''CREATE TABLE apples
+    (
+        id integer primary key autoincrement,
+        name text,
+        color text
+    )'''
+
+    Each column definition starts with the column name, its type being the following
+    names up to the first column constraint. Table constraints (PRIMARY KEY (...),
+    UNIQUE (...), ...) start with their keyword.
+
+    The row id alias is the column declared as INTEGER PRIMARY KEY, either in its
+    definition or as a single column PRIMARY KEY table constraint.
+    SQLite stores it as the row id of the table b-tree, see https://www.sqlite.org/lang_createtable.html#rowid
+    """
+    columns = []
+    column_types = {}
+    collations = {}
+    default_clauses = {}
+    row_id_alias = None
+    # (is primary key, is table constraint, key columns) of the UNIQUE and
+    # PRIMARY KEY constraints, in declaration order
+    key_constraints = []
+    for definition in split_definitions(tokenize(sql_creation_query)):
+        if definition[0].upper in TABLE_CONSTRAINT_KEYWORDS:
+            is_primary_key = keyword_position(definition, "PRIMARY", "KEY") != -1
+            if is_primary_key or keyword_position(definition, "UNIQUE") != -1:
+                key_columns = [key[0].value for key in split_definitions(definition)]
+                key_constraints.append((is_primary_key, True, key_columns))
+            continue
+
+        column = definition[0].value
+        columns.append(column)
+        type_end = 1
+        while (
+            type_end < len(definition)
+            and definition[type_end].is_identifier
+            and definition[type_end].upper not in COLUMN_CONSTRAINT_KEYWORDS
+        ):
+            type_end += 1
+        column_types[column] = " ".join(token.upper for token in definition[1:type_end])
+        collate = keyword_position(definition, "COLLATE")
+        if collate != -1 and collate + 1 < len(definition):
+            collations[column] = definition[collate + 1].value.upper()
+        default = keyword_position(definition, "DEFAULT")
+        if default != -1:
+            default_clauses[column] = definition[default + 1 :]
+
+        primary_key = keyword_position(definition, "PRIMARY", "KEY")
+        if primary_key != -1:
+            is_descending = keyword_position(definition[primary_key:], "DESC") == 2
+            if column_types[column] == "INTEGER" and not is_descending and row_id_alias is None:
+                row_id_alias = column
+            else:
+                key_constraints.append((True, False, [column]))
+        if keyword_position(definition, "UNIQUE") != -1:
+            key_constraints.append((False, False, [column]))
+
+    unique_keys = []
+    for is_primary_key, is_table_constraint, key_columns in key_constraints:
+        if (
+            is_primary_key
+            and is_table_constraint
+            and row_id_alias is None
+            and len(key_columns) == 1
+            and column_types.get(key_columns[0]) == "INTEGER"
+        ):
+            row_id_alias = key_columns[0]
+        elif not (is_primary_key and key_columns == [row_id_alias]):
+            # a PRIMARY KEY on the row id alias is the table b-tree itself
+            unique_keys.append(key_columns)
+
+    affinities = {
+        column: column_affinity(column_type)
+        for column, column_type in column_types.items()
+    }
+    defaults = {
+        column: parse_default_value(tokens, affinities[column])
+        for column, tokens in default_clauses.items()
+    }
+    return TableDefinition(
+        columns,
+        row_id_alias,
+        unique_keys,
+        collations,
+        affinities,
+        {column: value for column, value in defaults.items() if value is not None},
+    )
+
+
+def parse_default_value(tokens: List[Token], affinity: str) -> any:
+    """
+    Value of a column DEFAULT clause, given the tokens following the keyword: a
+    literal, optionally signed or parenthesized, stored with the column affinity.
+    Number literals stored as TEXT keep their spelling ("-2.50"). None for NULL and
+    for expressions, which ALTER TABLE ADD COLUMN doesn't accept anyway.
+    See https://www.sqlite.org/lang_altertable.html#alter_table_add_column
+    """
+    is_parenthesized = (
+        bool(tokens) and tokens[0].kind == "punctuation" and tokens[0].value == "("
+    )
+    position = 1 if is_parenthesized else 0
+    sign = ""
+    if position < len(tokens) and tokens[position].kind == "punctuation":
+        if tokens[position].value not in ("-", "+"):
+            return None
+        sign = "-" if tokens[position].value == "-" else ""
+        position += 1
+    if position >= len(tokens):
+        return None
+
+    literal = tokens[position]
+    is_blob = position + 1 < len(tokens) and tokens[position + 1].kind == "string"
+    if literal.upper == "X" and is_blob and not sign:
+        position += 1
+        value = bytes.fromhex(tokens[position].value)
+    elif literal.kind == "number":
+        if affinity == "TEXT":
+            value = sign + literal.value
+        else:
+            value = text_to_number(sign + literal.value)
+    elif literal.kind == "string" and not sign:
+        value = apply_affinity(literal.value, affinity)
+    elif literal.upper in ("TRUE", "FALSE") and not sign:
+        value = apply_affinity(int(literal.upper == "TRUE"), affinity)
+    else:
+        return None
+
+    following = tokens[position + 1] if position + 1 < len(tokens) else None
+    if is_parenthesized:
+        if following is None or following.value != ")":
+            return None
+    elif following is not None and following.upper not in COLUMN_CONSTRAINT_KEYWORDS:
+        return None
+
+    if affinity == "REAL" and type(value) is int:
+        return float(value)
+    if (
+        affinity in NUMERIC_AFFINITIES
+        and type(value) is float
+        and value.is_integer()
+        and -(2**63) <= value < 2**63
+    ):
+        return int(value)
+
+    return value
+
+
+def column_affinity(declared_type: str) -> str:
+    """
+    Type affinity of a column declared with the given (upper case) type
+    """
+    if not declared_type:
+        return "BLOB"
+    for substring, affinity in AFFINITY_TYPE_SUBSTRINGS:
+        if substring in declared_type:
+            return affinity
+
+    return "NUMERIC"
+
+
+def parse_create_index(sql_creation_query: str) -> IndexDefinition:
+    """
+    CREATE [UNIQUE] INDEX <name> ON <table> (<column> [COLLATE x] [ASC|DESC], ...) [WHERE ...]
+
+    Indexes on expressions have no column list, as their keys are not column values.
+    """
+    tokens = tokenize(sql_creation_query)
+    is_partial = keyword_position(tokens, "WHERE") != -1
+    index = IndexDefinition([], [], [], is_partial)
+    for definition in split_definitions(tokens):
+        if len(definition) > 1 and definition[1].upper not in ("COLLATE", "ASC", "DESC"):
+            return IndexDefinition([], [], [], is_partial)
+
+        collate = keyword_position(definition, "COLLATE")
+        index.columns.append(definition[0].value)
+        index.collations.append(
+            definition[collate + 1].value.upper()
+            if 0 < collate < len(definition) - 1
+            else None
+        )
+        index.descending.append(definition[-1].upper == "DESC")
+
+    return index
+
+
+def get_autoindex_columns(unique_keys: List[List[str]], index_name: str) -> List[str]:
+    """
+    sqlite_autoindex_<table>_<N> is the index backing the N-th UNIQUE or (non row id)
+    PRIMARY KEY constraint of the table, in declaration order
+    """
+    match = re.search(r"_(\d+)$", index_name)
+    if not match:
+        return []
+    position = int(match.group(1)) - 1
+
+    if position >= len(unique_keys):
+        return []
+
+    return unique_keys[position]
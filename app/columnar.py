@@ -0,0 +1,486 @@
+"""
+Columnar decoding of table leaf pages into NumPy arrays, for scans aggregating many rows.
+
+Records are decoded a batch of leaf pages at a time, every step working on whole
+arrays: cell pointers are read as one array per page, varints (payload size, row id,
+record header) are decoded for every cell at once, and the offset of each column is
+found by adding up the sizes of the preceding ones. Fixed-width values are then
+gathered from the mapped file and converted in bulk, e.g. 4-byte integers by viewing
+the gathered bytes as big-endian int32.
+
+NumPy is an optional dependency: this module imports it, so it must only be
+imported once app.queries.is_numpy_installed() returned True.
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+
+import numpy as np
+
+from app.aggregation import (
+    AggregateOutput,
+    CountAccumulator,
+    ExtremumAccumulator,
+    SumAccumulator,
+    make_accumulator,
+)
+from app.consts import (
+    COLUMNAR_BATCH_PAGES,
+    DB_FILE_HEADER_SIZE,
+    LEAF_PAGE_HEADER_SIZE,
+    ROW_ID_ORDINAL,
+)
+from app.filtering import (
+    RowFilter,
+    ValueFilter,
+    AndFilter,
+    OrFilter,
+    NotFilter,
+)
+from app.overflow import CellPayload
+from app.pager import Pager
+from app.profiling import count_page_read, count_records_decoded
+from app.reading import SERIAL_TYPE_SIZES, page_start, read_column_value
+
+from typing import AbstractSet, Dict, List, Mapping, Optional, Iterator, Sequence, Tuple
+
+MAX_VARINT_SIZE = 9
+SERIAL_TYPE_SIZE_ARRAY = np.array(SERIAL_TYPE_SIZES, dtype=np.int64)
+# Big-endian integer types of the fixed-width serial types that have one
+SERIAL_TYPE_DTYPES = {1: ">i1", 2: ">i2", 4: ">i4", 6: ">i8"}
+
+
+@dataclass
+class Column:
+    """
+    Values of one column for the rows of a batch. Columns of integers or of reals are
+    held in int64/float64 arrays (0 where NULL), other ones in an object array of
+    text, blobs and numbers (None where NULL).
+    """
+
+    values: np.ndarray
+    nulls: np.ndarray  # True where the value is NULL
+
+    @property
+    def is_numeric(self) -> bool:
+        return self.values.dtype != object
+
+    def set(self, position: int, value: any):
+        """
+        Stores a value decoded separately, widening the array type if it doesn't fit
+        """
+        value_type = float if self.values.dtype == np.float64 else int
+        if self.is_numeric and value is not None and not isinstance(value, value_type):
+            # see decode_column, integers and reals are only mixed as objects
+            self.values = self.values.astype(object)
+            self.values[self.nulls] = None
+
+        self.nulls[position] = value is None
+        self.values[position] = 0 if value is None and self.is_numeric else value
+
+    def fill(self, positions: np.ndarray, value: any):
+        """
+        Stores the same value at every position where "positions" is True, see set
+        """
+        indices = np.flatnonzero(positions)
+        if not len(indices):
+            return
+
+        self.set(int(indices[0]), value)
+        self.nulls[indices] = value is None
+        self.values[indices] = 0 if value is None and self.is_numeric else value
+
+    def to_list(self) -> List[any]:
+        """
+        The values as python objects, None for NULLs
+        """
+        if not self.is_numeric:
+            return self.values.tolist()
+
+        return [
+            None if is_null else value
+            for value, is_null in zip(self.values.tolist(), self.nulls.tolist())
+        ]
+
+
+def read_varints(
+    data: np.ndarray, offsets: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Decodes the varint starting at each offset, returns their values and byte lengths
+    """
+    positions = offsets[:, None] + np.arange(MAX_VARINT_SIZE)
+    window = data[np.minimum(positions, len(data) - 1)].astype(np.int64)
+
+    # a varint ends at its first byte without the high bit, or after 9 bytes
+    continues = window[:, : MAX_VARINT_SIZE - 1] >= 0x80
+    lengths = np.where(
+        continues.all(axis=1), MAX_VARINT_SIZE, np.argmin(continues, axis=1) + 1
+    )
+
+    values = np.zeros(len(offsets), dtype=np.int64)
+    for i in range(MAX_VARINT_SIZE):
+        is_part = i < lengths
+        if not is_part.any():
+            break
+        if i < MAX_VARINT_SIZE - 1:
+            shifted = (values << 7) | (window[:, i] & 0x7F)
+        else:
+            # the 9th byte contributes all of its 8 bits
+            shifted = (values << 8) | window[:, i]
+        values = np.where(is_part, shifted, values)
+
+    return values, lengths
+
+
+def serial_type_sizes(serial_types: np.ndarray) -> np.ndarray:
+    return np.where(
+        serial_types >= 12,
+        (serial_types - 12) // 2,
+        SERIAL_TYPE_SIZE_ARRAY[np.clip(serial_types, 0, 11)],
+    )
+
+
+def read_cell_offsets(pager: Pager, data: np.ndarray, page_idx: int) -> np.ndarray:
+    """
+    File offsets of the cells of a table leaf page, read from its cell pointer array
+    """
+    start = page_start(page_idx, pager.page_size)
+    header_start = start + (DB_FILE_HEADER_SIZE if page_idx == 0 else 0)
+    cell_count = int(data[header_start + 3]) << 8 | int(data[header_start + 4])
+    pointers_start = header_start + LEAF_PAGE_HEADER_SIZE
+    pointers = data[pointers_start : pointers_start + 2 * cell_count].view(">u2")
+
+    return pointers.astype(np.int64) + start
+
+
+def iter_column_batches(
+    pager: Pager,
+    leaf_page_indices: Sequence[int],
+    column_ordinals: List[int],
+    real_columns: AbstractSet[int] = frozenset(),
+    defaults: Optional[Mapping[int, any]] = None,
+    batch_pages: int = COLUMNAR_BATCH_PAGES,
+) -> Iterator[List[Column]]:
+    """
+    Decodes the rows of the given table leaf pages, "batch_pages" pages at a time.
+    Yields one Column per ordinal for each batch (see read_table_record for ordinals),
+    the integers of "real_columns" being read as reals (see apply_real_affinity) and
+    the columns past the end of a record as their "defaults" (see apply_column_defaults).
+
+    Cells whose payload spilled to overflow pages are decoded one by one.
+    """
+    data = np.frombuffer(pager.buffer, dtype=np.uint8)
+    # Table leaf cells hold up to usable size - 35 payload bytes, see local_payload_size
+    max_local = pager.usable_size - 35
+
+    for batch_start in range(0, len(leaf_page_indices), batch_pages):
+        pages = leaf_page_indices[batch_start : batch_start + batch_pages]
+        cell_offsets = np.concatenate(
+            [read_cell_offsets(pager, data, page_idx) for page_idx in pages]
+            or [np.zeros(0, dtype=np.int64)]
+        )
+
+        for _ in pages:
+            count_page_read("table leaf", pager.page_size)
+        count_records_decoded(len(cell_offsets))
+
+        payload_sizes, lengths = read_varints(data, cell_offsets)
+        row_ids, row_id_lengths = read_varints(data, cell_offsets + lengths)
+        payload_starts = cell_offsets + lengths + row_id_lengths
+        overflows = payload_sizes > max_local
+
+        located = locate_columns(data, payload_starts, column_ordinals, ~overflows)
+        columns = []
+        for ordinal in column_ordinals:
+            if ordinal == ROW_ID_ORDINAL:
+                columns.append(Column(row_ids, np.zeros(len(row_ids), dtype=bool)))
+                continue
+            serial_types, offsets, is_past_end = located[ordinal]
+            column = decode_column(
+                pager.buffer,
+                data,
+                serial_types,
+                offsets,
+                pager.text_encoding,
+                ordinal in real_columns,
+            )
+            if defaults and ordinal in defaults:
+                column.fill(is_past_end, defaults[ordinal])
+            columns.append(column)
+
+        # spilled payloads are assembled and decoded on their own, as a batch of one
+        for position in np.flatnonzero(overflows).tolist():
+            page_offset = int(cell_offsets[position]) // pager.page_size * pager.page_size
+            payload = CellPayload.from_cell(
+                pager,
+                pager.buffer[page_offset : page_offset + pager.page_size],
+                int(payload_starts[position]) - page_offset,
+                int(payload_sizes[position]),
+                is_index=False,
+            ).assemble(pager)
+            payload_data = np.frombuffer(payload, dtype=np.uint8)
+            located = locate_columns(
+                payload_data, np.zeros(1, dtype=np.int64), column_ordinals
+            )
+            for column, ordinal in zip(columns, column_ordinals):
+                if ordinal == ROW_ID_ORDINAL:
+                    continue
+                serial_types, offsets, is_past_end = located[ordinal]
+                if defaults and ordinal in defaults and is_past_end[0]:
+                    column.set(position, defaults[ordinal])
+                    continue
+                decoded = decode_column(
+                    payload,
+                    payload_data,
+                    serial_types,
+                    offsets,
+                    pager.text_encoding,
+                    ordinal in real_columns,
+                )
+                column.set(position, decoded.to_list()[0])
+
+        yield columns
+
+
+def locate_columns(
+    data: np.ndarray,
+    payload_starts: np.ndarray,
+    column_ordinals: List[int],
+    is_readable: Optional[np.ndarray] = None,
+) -> Dict[int, Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Walks the headers of the records starting at "payload_starts", returns the serial
+    types and offsets of the values of each requested column, by ordinal, along with
+    whether each record ends before the column (it then reads as NULL).
+    Records not "is_readable" (their header isn't all in data) read as NULLs.
+    """
+    last_ordinal = max(
+        (ordinal for ordinal in column_ordinals if ordinal >= 0), default=-1
+    )
+    header_sizes, lengths = read_varints(data, payload_starts)
+    header_positions = payload_starts + lengths
+    header_ends = payload_starts + header_sizes
+    column_offsets = header_ends.copy()
+
+    located = {}
+    for ordinal in range(last_ordinal + 1):
+        # records written before a column was added are shorter, it reads as NULL
+        in_header = header_positions < header_ends
+        is_past_end = ~in_header
+        if is_readable is not None:
+            in_header &= is_readable
+            is_past_end &= is_readable
+        serial_types, lengths = read_varints(data, header_positions)
+        serial_types = np.where(in_header, serial_types, 0)
+        if ordinal in column_ordinals:
+            located[ordinal] = (serial_types, column_offsets.copy(), is_past_end)
+        header_positions = header_positions + np.where(in_header, lengths, 0)
+        column_offsets = column_offsets + serial_type_sizes(serial_types)
+
+    return located
+
+
+def decode_column(
+    buffer: memoryview,
+    data: np.ndarray,
+    serial_types: np.ndarray,
+    offsets: np.ndarray,
+    text_encoding: str = "utf-8",
+    is_real_affinity: bool = False,
+) -> Column:
+    """
+    Decodes the values of the given serial types located at the given offsets of
+    "buffer", "data" being the same bytes as an array. Integers of REAL affinity
+    columns are decoded as reals.
+    """
+    nulls = serial_types == 0
+    is_real = serial_types == 7
+    is_integer = (serial_types >= 1) & (serial_types <= 9) & ~is_real
+    integers = np.zeros(len(serial_types), dtype=np.int64)
+    reals = np.zeros(len(serial_types), dtype=np.float64)
+
+    for serial_type in (1, 2, 3, 4, 5, 6, 7):
+        positions = np.flatnonzero(serial_types == serial_type)
+        if not len(positions):
+            continue
+        size = SERIAL_TYPE_SIZES[serial_type]
+        gathered = data[offsets[positions, None] + np.arange(size)]
+        if serial_type == 7:
+            reals[positions] = gathered.view(">f8")[:, 0]
+        elif serial_type in SERIAL_TYPE_DTYPES:
+            integers[positions] = gathered.view(SERIAL_TYPE_DTYPES[serial_type])[:, 0]
+        else:
+            # 24 and 48 bit integers: sign extended to 32 and 64 bits before the view
+            padding = 4 - size if size < 4 else 8 - size
+            sign = np.where(gathered[:, :1] >= 0x80, 0xFF, 0).astype(np.uint8)
+            extended = np.hstack([np.repeat(sign, padding, axis=1), gathered])
+            integers[positions] = extended.view(">i4" if size < 4 else ">i8")[:, 0]
+    integers[serial_types == 9] = 1
+    if is_real_affinity:
+        reals[is_integer] = integers[is_integer]
+        is_real |= is_integer
+        is_integer = np.zeros(len(serial_types), dtype=bool)
+
+    is_variable = serial_types >= 12
+    has_reals = bool(is_real.any())
+    if not is_variable.any() and not (has_reals and is_integer.any()):
+        return Column(reals if has_reals else integers, nulls)
+
+    # mixing integers and reals in one array would round integers, use objects
+    values = np.full(len(serial_types), None, dtype=object)
+    values[is_integer] = integers[is_integer].tolist()
+    values[is_real] = reals[is_real].tolist()
+    for position in np.flatnonzero(is_variable).tolist():
+        values[position] = read_column_value(
+            buffer, int(offsets[position]), int(serial_types[position]), text_encoding
+        )
+
+    return Column(values, nulls)
+
+
+def filter_mask(column: Column, value_filter: ValueFilter) -> np.ndarray:
+    """
+    Rows of the batch satisfying the filter. Numeric columns compared against numbers
+    are filtered in bulk, other ones (and operators NumPy can't apply, like LIKE)
+    value by value.
+    """
+    if value_filter.is_null_test:
+        return column.nulls.copy() if value_filter.operator_str == "IS NULL" else ~column.nulls
+    if value_filter.operator is None and value_filter.operator_str not in (
+        "BETWEEN",
+        "IN",
+    ):
+        return match_values(column, value_filter)
+
+    # constants converted by the affinity of the column, see ValueFilter.compared_value
+    thresholds = (
+        value_filter.compared_value
+        if value_filter.operator_str in ("BETWEEN", "IN")
+        else (value_filter.compared_value,)
+    )
+    is_numeric_comparison = column.is_numeric and all(
+        isinstance(threshold, (int, float)) and not isinstance(threshold, bool)
+        for threshold in thresholds
+    )
+    if not is_numeric_comparison:
+        return match_values(column, value_filter)
+
+    values = column.values
+    match value_filter.operator_str:
+        case "BETWEEN":
+            mask = (values >= thresholds[0]) & (values <= thresholds[1])
+        case "IN":
+            mask = np.isin(values, thresholds)
+        case _:
+            mask = value_filter.operator(values, thresholds[0])
+
+    return mask & ~column.nulls
+
+
+def match_values(column: Column, value_filter: ValueFilter) -> np.ndarray:
+    """
+    Rows of the batch satisfying the filter, evaluated value by value
+    """
+    return np.fromiter(
+        map(value_filter.compile_matcher(), column.to_list()),
+        dtype=bool,
+        count=len(column.nulls),
+    )
+
+
+def filter_masks(
+    columns: List[Column], positions: Dict[str, int], value_filter: RowFilter
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Rows of the batch for which the filter is true, and rows for which it is false,
+    the columns of the filter being at "positions". Rows in neither mask have an
+    unknown result (comparisons with NULL), see RowFilter.
+    """
+    if isinstance(value_filter, (AndFilter, OrFilter)):
+        masks = [
+            filter_masks(columns, positions, operand) for operand in value_filter.operands
+        ]
+        trues, falses = [mask[0] for mask in masks], [mask[1] for mask in masks]
+        if isinstance(value_filter, AndFilter):
+            return np.logical_and.reduce(trues), np.logical_or.reduce(falses)
+        return np.logical_or.reduce(trues), np.logical_and.reduce(falses)
+
+    if isinstance(value_filter, NotFilter):
+        true, false = filter_masks(columns, positions, value_filter.operand)
+        return false, true
+
+    column = columns[positions[value_filter.column]]
+    if value_filter.has_null_constant:
+        # unknown for the values it doesn't match, see ValueFilter.truth
+        truths = [value_filter.truth(value) for value in column.to_list()]
+        return (
+            np.array([truth is True for truth in truths], dtype=bool),
+            np.array([truth is False for truth in truths], dtype=bool),
+        )
+
+    true = filter_mask(column, value_filter)
+    if value_filter.is_null_test:
+        return true, ~true
+
+    return true, ~true & ~column.nulls
+
+
+def exact_sum(values: np.ndarray) -> any:
+    """
+    Sum of the values, integers adding up past 64 bits (where NumPy would wrap around)
+    being summed as python ints
+    """
+    if values.dtype == np.int64 and len(values):
+        # bounds as python ints: np.abs wraps INT64_MIN around to itself
+        bound = max(-int(values.min()), int(values.max()))
+        if bound * len(values) >= 2**63:
+            return sum(values.tolist())
+
+    return values.sum().item()
+
+
+def aggregate_batches(
+    batches: Iterator[List[Column]],
+    outputs: List[AggregateOutput],
+    filter_positions: Optional[Dict[str, int]] = None,
+    value_filter: Optional[RowFilter] = None,
+) -> List[any]:
+    """
+    Folds the batches into one aggregated row laid out as "outputs", every output
+    being an aggregate (no bare column). Numeric columns are reduced with NumPy and
+    the partial results added to the accumulators of the row based aggregation,
+    so results are the same whichever way rows were read.
+    """
+    accumulators = [make_accumulator(output) for output in outputs]
+    for columns in batches:
+        selected = None
+        if value_filter is not None:
+            selected = filter_masks(columns, filter_positions, value_filter)[0]
+
+        for accumulator, output in zip(accumulators, outputs):
+            if output.position < 0:
+                # COUNT(*)
+                accumulator.count += (
+                    len(columns[0].nulls) if selected is None else int(selected.sum())
+                )
+                continue
+
+            column = columns[output.position]
+            present = ~column.nulls if selected is None else selected & ~column.nulls
+            if not column.is_numeric:
+                for value in column.values[present].tolist():
+                    accumulator.add(value)
+                continue
+
+            values = column.values[present]
+            if isinstance(accumulator, CountAccumulator):
+                accumulator.count += len(values)
+            elif isinstance(accumulator, SumAccumulator):
+                if len(values):
+                    accumulator.total += exact_sum(values)
+                    accumulator.count += len(values)
+            elif isinstance(accumulator, ExtremumAccumulator) and len(values):
+                extremum = values.max() if accumulator.is_max else values.min()
+                accumulator.add(extremum.item())
+
+    return [accumulator.result() for accumulator in accumulators]
@@ -0,0 +1,56 @@
+from app.catalog import Catalog
+from app.pager import Pager
+from app.pages import load_page_at_location
+from app.profiling import QueryProfile, profile_stage
+from app.queries import Query, format_row
+
+from typing import Iterator
+
+
+def iter_command_output(
+    pager: Pager, catalog: Catalog, command: str, workers: int = 1
+) -> Iterator[str]:
+    """
+    Yields the output lines of a command: ".dbinfo", ".tables" or a SELECT query,
+    whose rows are formatted by format_row. "EXPLAIN <query>" runs the query and
+    yields its profile instead of its rows, ".profile <query>" yields both.
+    """
+    if command == ".dbinfo":
+        # The first page in an sqlite db is a special node that contains the schema of the db
+        first_page = load_page_at_location(pager, 0)
+        yield f"database page size: {pager.page_size}"
+        yield f"number of tables:  {first_page.cell_count}"
+    elif command == ".tables":
+        yield f"table names: {' '.join(catalog.tables)}"
+    elif command[:8].upper() == "EXPLAIN ":
+        yield from iter_profiled_output(pager, catalog, command[8:], workers, False)
+    elif command.startswith(".profile "):
+        yield from iter_profiled_output(pager, catalog, command[9:], workers, True)
+    else:
+        query = Query.parse_query(command)
+        for row in query.iter_results(pager, catalog, workers):
+            yield format_row(row)
+
+
+def is_plain_query(command: str) -> bool:
+    """
+    Whether the command is a query whose rows are its output, as opposed to a dot
+    command or an EXPLAIN, see iter_command_output
+    """
+    return not command.startswith(".") and command[:8].upper() != "EXPLAIN "
+
+
+def iter_profiled_output(
+    pager: Pager, catalog: Catalog, command: str, workers: int, show_rows: bool
+) -> Iterator[str]:
+    """
+    Runs the query under a QueryProfile, yields its rows when "show_rows" is set,
+    then one line per stage of the plan with its counters
+    """
+    query = Query.parse_query(command)
+    with QueryProfile() as profile:
+        for row in profile_stage("QUERY", query.iter_results(pager, catalog, workers)):
+            if show_rows:
+                yield format_row(row)
+
+    yield from profile.format()
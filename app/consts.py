@@ -4,4 +4,43 @@ INTERIOR_PAGE_HEADER_SIZE = 12
 IS_FIRST_BIT_ZERO_MASK = 0b10000000
 LAST_SEVEN_BITS_MASK = 0b01111111
 SQLITE_SEQUENCE_TABLE_NAME = "sqlite_sequence"
-TABLE_CREATION_REGEX = r"\((.*?)\)"
+PAGE_SIZE_OFFSET = 16
+MAX_PAGE_SIZE = 65536
+DEFAULT_PAGE_CACHE_PAGES = 2000
+RESERVED_SPACE_OFFSET = 20
+FILE_CHANGE_COUNTER_OFFSET = 24
+TEXT_ENCODING_OFFSET = 56
+# Codecs of the database text encodings, see https://www.sqlite.org/fileformat.html#text_encoding
+TEXT_ENCODINGS = {1: "utf-8", 2: "utf-16-le", 3: "utf-16-be"}
+# Collating sequences built into SQLite, see https://www.sqlite.org/datatype3.html#collation
+# Indexes using another one (registered by an application) have an unknown order
+BUILTIN_COLLATIONS = ("BINARY", "NOCASE", "RTRIM")
+DEFAULT_COLLATION = "BINARY"
+# Type affinities picked from the declared column type by the first substring found,
+# in this order. Other types have NUMERIC affinity, no type BLOB affinity.
+# See https://www.sqlite.org/datatype3.html#determination_of_column_affinity
+AFFINITY_TYPE_SUBSTRINGS = (
+    ("INT", "INTEGER"),
+    ("CHAR", "TEXT"),
+    ("CLOB", "TEXT"),
+    ("TEXT", "TEXT"),
+    ("BLOB", "BLOB"),
+    ("REAL", "REAL"),
+    ("FLOA", "REAL"),
+    ("DOUB", "REAL"),
+)
+OVERFLOW_POINTER_SIZE = 4
+# Pseudo column ordinal standing for the row id (the table b-tree key) when decoding records
+ROW_ID_ORDINAL = -1
+PARALLEL_CHUNKS_PER_WORKER = 4
+SERVER_PENDING_PER_THREAD = 4
+AGGREGATION_MAX_GROUPS = 100_000
+AGGREGATION_SPILL_PARTITIONS = 16
+JOIN_PROBE_BATCH = 1024
+SORT_MAX_ROWS = 100_000
+ROW_FETCH_BATCH = 1024
+QUERY_CACHE_SIZE = 256
+COLUMNAR_BATCH_PAGES = 64
+# Tables with fewer leaf pages are aggregated row by row, importing numpy costs more
+COLUMNAR_MIN_LEAF_PAGES = 256
+EXPORT_BATCH_ROWS = 10_000
@@ -0,0 +1,421 @@
+"""
+Exports a table or the result of a SELECT query to a file, without going through
+the "|" separated text output.
+
+    python3 -m app.export databases/companies.db companies companies.csv
+    python3 -m app.export databases/companies.db \
+        "SELECT id, name FROM companies WHERE country = 'eritrea'" eritrea.parquet
+
+The format is taken from the output file extension (or --format): CSV with a header
+line, JSON lines (one object per row), or Arrow IPC and Parquet when pyarrow is
+installed. Rows are streamed and written in batches of --batch-size rows, so memory
+stays bounded whatever the size of the result. With --workers, full table scans
+are decoded in parallel like for app.main.
+"""
+from __future__ import annotations
+import argparse
+import csv
+import itertools
+import json
+import math
+import os
+import sys
+
+from app.aggregation import Aggregate
+from app.catalog import Catalog
+from app.consts import EXPORT_BATCH_ROWS
+from app.pager import Pager
+from app.pages import load_page_at_location
+from app.queries import Query, format_value
+
+from typing import List, Iterator, Iterable, Optional, Sequence, TextIO
+
+EXPORT_FORMATS = {
+    ".csv": "csv",
+    ".jsonl": "jsonl",
+    ".ndjson": "jsonl",
+    ".arrow": "arrow",
+    ".parquet": "parquet",
+}
+# Arrow types of the exported columns, from the narrowest to the widest: a column
+# holding values of several kinds gets the widest of them, numbers being written
+# to string columns as text and everything to binary columns as UTF-8 text
+ARROW_TYPE_ORDER = ("int64", "float64", "string", "binary")
+# Arrow type of the values of each Python type
+ARROW_VALUE_TYPES = {int: "int64", float: "float64", str: "string", bytes: "binary"}
+# Arrow type the columns of each type affinity start from
+ARROW_AFFINITY_TYPES = {"INTEGER": "int64", "REAL": "float64", "TEXT": "string"}
+
+
+def to_export_value(value: any) -> any:
+    """
+    Blobs are written as their bytes in upper case hexadecimal, like SQLite's hex()
+    returns them (text formats can't hold arbitrary bytes), other values as they are
+    """
+    if isinstance(value, bytes):
+        return value.hex().upper()
+
+    return value
+
+
+def to_json_value(value: any) -> any:
+    """
+    See to_export_value. JSON has no NaN nor infinities: NaN is written as null and
+    infinities as the strings "Infinity" and "-Infinity"
+    """
+    if type(value) is float and not math.isfinite(value):
+        return None if math.isnan(value) else ("Infinity" if value > 0 else "-Infinity")
+
+    return to_export_value(value)
+
+
+class ExportWriter:
+    def write_batch(self, rows: List[Sequence[any]]):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def abort(self):
+        """
+        Called instead of close when the export failed
+        """
+
+
+class TextExportWriter(ExportWriter):
+    """
+    Writes to a text file, opened at "output_path" or None for stdout. A failed export
+    removes the file, a truncated one would pass for the whole result.
+    """
+
+    def __init__(
+        self, output_file: TextIO, column_names: List[str], output_path: str = None
+    ):
+        self.output_file = output_file
+        self.column_names = column_names
+        self.output_path = output_path
+
+    def close(self):
+        self.output_file.flush()
+
+    def abort(self):
+        if self.output_path is None:
+            return
+        self.output_file.close()
+        if os.path.exists(self.output_path):
+            os.remove(self.output_path)
+
+
+class CsvExportWriter(TextExportWriter):
+    """
+    Comma separated values, NULLs written as empty fields
+    """
+
+    def __init__(
+        self, output_file: TextIO, column_names: List[str], output_path: str = None
+    ):
+        super().__init__(output_file, column_names, output_path)
+        self.writer = csv.writer(output_file)
+        self.writer.writerow(column_names)
+
+    def write_batch(self, rows: List[Sequence[any]]):
+        self.writer.writerows([[to_export_value(value) for value in row] for row in rows])
+
+
+class JsonLinesExportWriter(TextExportWriter):
+    """
+    One JSON object per line, keyed by column name, see to_json_value
+    """
+
+    def write_batch(self, rows: List[Sequence[any]]):
+        self.output_file.writelines(
+            json.dumps(
+                dict(zip(self.column_names, map(to_json_value, row))), allow_nan=False
+            )
+            + "\n"
+            for row in rows
+        )
+
+
+class ArrowExportWriter(ExportWriter):
+    """
+    Arrow IPC file or Parquet file, each batch of rows written as one record batch
+    (one row group for Parquet).
+
+    Column types start from the affinity of the exported column (see
+    ARROW_AFFINITY_TYPES) and are widened to fit the values of the first batch, see
+    ARROW_TYPE_ORDER. Values are converted without loss or the export fails, the
+    partial file being deleted: a wider value in a later batch, or an integer of a
+    float64 column beyond the integers a double holds exactly (2**53).
+    """
+
+    def __init__(
+        self,
+        output_path: str,
+        column_names: List[str],
+        export_format: str,
+        column_affinities: Optional[List[Optional[str]]] = None,
+    ):
+        try:
+            # pyarrow is optional, it is only needed by these two formats
+            import pyarrow
+        except ImportError:
+            raise RuntimeError(
+                f"Exporting to {export_format} needs pyarrow (pip install pyarrow)"
+            ) from None
+
+        self.pa = pyarrow
+        self.output_path = output_path
+        self.column_names = column_names
+        self.export_format = export_format
+        self.column_affinities = column_affinities or [None] * len(column_names)
+        self.column_types = None  # ARROW_TYPE_ORDER names, once the file is open
+        self.schema = None
+        self.writer = None
+
+    def write_batch(self, rows: List[Sequence[any]]):
+        columns = [
+            [row[position] for row in rows]
+            for position in range(len(self.column_names))
+        ]
+        if self.writer is None:
+            self._open(columns)
+
+        arrays = [
+            self.pa.array(self._convert(values, name, column_type), type=field.type)
+            for values, name, column_type, field in zip(
+                columns, self.column_names, self.column_types, self.schema
+            )
+        ]
+        self.writer.write_batch(self.pa.record_batch(arrays, schema=self.schema))
+
+    def _open(self, columns: List[List[any]]):
+        self.column_types = [
+            self._infer_type(values, affinity)
+            for values, affinity in zip(columns, self.column_affinities)
+        ]
+        self.schema = self.pa.schema(
+            [
+                (name, getattr(self.pa, column_type)())
+                for name, column_type in zip(self.column_names, self.column_types)
+            ]
+        )
+        if self.export_format == "parquet":
+            import pyarrow.parquet
+
+            self.writer = pyarrow.parquet.ParquetWriter(self.output_path, self.schema)
+        else:
+            self.writer = self.pa.ipc.new_file(self.output_path, self.schema)
+
+    @staticmethod
+    def _infer_type(values: List[any], affinity: Optional[str]) -> str:
+        """
+        The widest of the type of the column affinity and the types of the values
+        """
+        value_types = {
+            ARROW_VALUE_TYPES[type(value)] for value in values if value is not None
+        }
+        if affinity in ARROW_AFFINITY_TYPES:
+            value_types.add(ARROW_AFFINITY_TYPES[affinity])
+
+        return max(value_types, key=ARROW_TYPE_ORDER.index, default="string")
+
+    @staticmethod
+    def _convert(values: List[any], column_name: str, column_type: str) -> List[any]:
+        """
+        The values as the column type, raising ValueError for a value of a wider type
+        or an integer that has no exact float64 value
+        """
+        converted = []
+        for value in values:
+            value_type = None if value is None else ARROW_VALUE_TYPES[type(value)]
+            if value_type is None or value_type == column_type:
+                converted.append(value)
+            elif ARROW_TYPE_ORDER.index(value_type) > ARROW_TYPE_ORDER.index(
+                column_type
+            ):
+                raise ValueError(
+                    f"Column {column_name!r} was exported as {column_type} from the "
+                    f"first rows but holds {value!r}, export to csv or jsonl instead"
+                )
+            elif column_type == "float64":
+                if float(value) != value:
+                    raise ValueError(
+                        f"Column {column_name!r} was exported as float64 but holds "
+                        f"{value!r}, which isn't exactly a float64, export to csv or "
+                        "jsonl instead"
+                    )
+                converted.append(float(value))
+            elif column_type == "string":
+                converted.append(format_value(value))
+            else:
+                converted.append(format_value(value).encode("utf-8"))
+
+        return converted
+
+    def close(self):
+        if self.writer is None:
+            # no rows, the file still gets the columns
+            self._open([[] for _ in self.column_names])
+        self.writer.close()
+
+    def abort(self):
+        # a truncated file would pass for the whole result, it is removed
+        if self.writer is not None:
+            self.writer.close()
+        if os.path.exists(self.output_path):
+            os.remove(self.output_path)
+
+
+def get_column_names(query: Query) -> List[str]:
+    return [str(item) for item in query.select_list]
+
+
+def get_column_affinities(catalog: Catalog, query: Query) -> List[Optional[str]]:
+    """
+    Type affinity of each exported column, None for aggregates other than COUNT whose
+    type is only known from their values
+    """
+    affinities = []
+    for item in query.select_list:
+        if isinstance(item, Aggregate):
+            affinities.append("INTEGER" if item.function == "COUNT" else None)
+            continue
+        found = query.find_column(catalog, item)
+        affinities.append(found[0].affinities.get(found[1]) if found else None)
+
+    return affinities
+
+
+def parse_export_source(catalog: Catalog, source: str) -> Query:
+    """
+    The query whose result is exported: "source" is a SELECT query, or a table name
+    whose every column is exported in row id order
+    """
+    if source.lstrip()[:6].upper() == "SELECT":
+        return Query.parse_query(source).expand_star(catalog)
+
+    table = catalog.table(source)
+    return Query(table.name, None, list(table.columns))
+
+
+def iter_batches(
+    rows: Iterable[Sequence[any]], batch_size: int
+) -> Iterator[List[Sequence[any]]]:
+    rows = iter(rows)
+    while batch := list(itertools.islice(rows, batch_size)):
+        yield batch
+
+
+def export_query(
+    pager: Pager,
+    catalog: Catalog,
+    query: Query,
+    writer: ExportWriter,
+    workers: int = 1,
+    batch_size: int = EXPORT_BATCH_ROWS,
+) -> int:
+    """
+    Streams the query results to the writer in batches of "batch_size" rows,
+    returns the number of exported rows
+    """
+    exported = 0
+    try:
+        for batch in iter_batches(
+            query.iter_results(pager, catalog, workers), batch_size
+        ):
+            writer.write_batch(batch)
+            exported += len(batch)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+
+    return exported
+
+
+def get_export_format(output_path: str, export_format: str = None) -> str:
+    if export_format is not None:
+        return export_format
+
+    extension = os.path.splitext(output_path)[1].lower()
+    if extension not in EXPORT_FORMATS:
+        raise ValueError(
+            f"Can't tell the format of {output_path!r} from its extension, use --format"
+        )
+
+    return EXPORT_FORMATS[extension]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("database_file_path")
+    parser.add_argument("source", help="a table name or a SELECT query")
+    parser.add_argument("output_path", help='output file, "-" for stdout (csv and jsonl)')
+    parser.add_argument("--format", choices=sorted(set(EXPORT_FORMATS.values())))
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_ROWS)
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes used for full table scans",
+    )
+    parser.add_argument(
+        "--stats", action="store_true", help="print page cache statistics to stderr"
+    )
+    args = parser.parse_args()
+
+    export_format = get_export_format(args.output_path, args.format)
+    with Pager(args.database_file_path) as pager:
+        catalog = Catalog.from_schema(
+            load_page_at_location(pager, 0).read_sqlite_schema(pager)
+        )
+        query = parse_export_source(catalog, args.source)
+        column_names = get_column_names(query)
+
+        if export_format in ("arrow", "parquet"):
+            writer = ArrowExportWriter(
+                args.output_path,
+                column_names,
+                export_format,
+                get_column_affinities(catalog, query),
+            )
+            exported = export_query(
+                pager, catalog, query, writer, args.workers, args.batch_size
+            )
+        else:
+            writer_class = (
+                CsvExportWriter if export_format == "csv" else JsonLinesExportWriter
+            )
+            is_stdout = args.output_path == "-"
+            # newline="" lets the csv module write its own line endings
+            output_file = (
+                sys.stdout if is_stdout else open(args.output_path, "w", newline="")
+            )
+            try:
+                exported = export_query(
+                    pager,
+                    catalog,
+                    query,
+                    writer_class(
+                        output_file,
+                        column_names,
+                        None if is_stdout else args.output_path,
+                    ),
+                    args.workers,
+                    args.batch_size,
+                )
+            finally:
+                if not is_stdout:
+                    output_file.close()
+
+        print(f"Exported {exported} rows", file=sys.stderr)
+        if args.stats:
+            print(f"Page cache: {pager.page_cache.stats}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,676 @@
+from __future__ import annotations
 import operator
+import re
+import string
+from dataclasses import dataclass
+from functools import partial
 
+from app.consts import DEFAULT_COLLATION
 
-class ValueFilter:
+from typing import Optional, Tuple, List, Dict, Iterator, Sequence, Callable, Union
+
+# Largest code point, appended to a LIKE prefix to bound the keys starting with it
+MAX_CHARACTER = "\U0010ffff"
+# Text read as a number by numeric affinities: an integer or real literal, surrounded
+# by optional whitespace
+NUMERIC_TEXT = re.compile(
+    r"[ \t\n\f\r\v]*[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?[ \t\n\f\r\v]*", re.ASCII
+)
+# The part of a text read when casting it to a number: its longest numeric prefix
+NUMERIC_PREFIX = re.compile(
+    r"[ \t\n\f\r\v]*[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?", re.ASCII
+)
+NUMERIC_AFFINITIES = ("INTEGER", "REAL", "NUMERIC")
+NUMBER_TYPES = (int, float)
+
+
+def sqlite_order_key(value: any) -> Tuple[int, any]:
+    """
+    Sort key following SQLite's ordering across storage classes:
+    NULL < INTEGER/REAL < TEXT < BLOB. See https://www.sqlite.org/datatype3.html#sort_order
+    """
+    if value is None:
+        return (0, 0)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    return (3, bytes(value))
+
+
+def apply_affinity(constant: any, affinity: str) -> any:
+    """
+    Converts a query constant compared with a column of the given affinity, like SQLite
+    does before comparing: numeric affinities read text looking like a number as that
+    number, TEXT affinity renders numbers as text and BLOB affinity (columns declared
+    without a type) leaves constants as they are.
+    See https://www.sqlite.org/datatype3.html#type_conversions_prior_to_comparison
+    """
+    if affinity in NUMERIC_AFFINITIES and type(constant) is str:
+        return text_to_number(constant)
+    if affinity == "TEXT" and type(constant) in (int, float):
+        return number_to_text(constant)
+
+    return constant
+
+
+def operand_affinity(affinity: str, other_affinity: str) -> str:
+    """
+    Affinity applied to the values of a column compared with another column, given
+    both affinities: numeric when only the other one is numeric, none (BLOB)
+    otherwise. Columns declared without a type still have an affinity (BLOB), TEXT
+    affinity is only applied to operands having none, such as expressions.
+    See https://www.sqlite.org/datatype3.html#type_conversions_prior_to_comparison
+    """
+    if other_affinity in NUMERIC_AFFINITIES and affinity not in NUMERIC_AFFINITIES:
+        return "NUMERIC"
+
+    return "BLOB"
+
+
+def text_to_number(text: str) -> any:
+    """
+    The number the text reads as, or the text itself when it isn't one. Integers
+    past 64 bits are read as reals.
+    """
+    if NUMERIC_TEXT.fullmatch(text) is None:
+        return text
+
+    try:
+        number = int(text)
+        if -(2**63) <= number < 2**63:
+            return number
+    except ValueError:
+        pass
+
+    return float(text)
+
+
+def text_to_real(text: str) -> float:
+    """
+    The real the longest numeric prefix of the text reads as, 0.0 without one, as
+    SQLite casts text to REAL
+    """
+    prefix = NUMERIC_PREFIX.match(text)
+    return float(prefix.group()) if prefix else 0.0
+
+
+def number_to_text(number: Union[int, float]) -> str:
+    return real_to_text(number) if type(number) is float else str(number)
+
+
+def real_to_text(value: float) -> str:
+    """
+    A real rendered like SQLite does, with 15 significant digits and always a
+    decimal point
+    """
+    rendered = f"{value:.15g}"
+    if rendered in ("inf", "-inf"):
+        return rendered.replace("inf", "Inf")
+    mantissa, _, exponent = rendered.partition("e")
+    if mantissa.lstrip("-").isdigit():
+        mantissa += ".0"
+
+    return f"{mantissa}e{exponent}" if exponent else mantissa
+
+
+ASCII_UPPER = str.maketrans(string.ascii_lowercase, string.ascii_uppercase)
+ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def ascii_upper(text: str) -> str:
+    """
+    Upper-cases ASCII letters only, like the case folding of SQLite's LIKE and NOCASE
+    """
+    return text.translate(ASCII_UPPER)
+
+
+def ascii_lower(text: str) -> str:
+    return text.translate(ASCII_LOWER)
+
+
+def rtrim(text: str) -> str:
+    """
+    Text without its trailing spaces, as the RTRIM collating sequence compares it
+    """
+    return text.rstrip(" ")
+
+
+def compile_like_pattern(pattern: str) -> re.Pattern:
+    """
+    "%" matches any sequence of characters and "_" any single one, ASCII letters
+    matching regardless of their case
+    """
+    parts = []
+    for char in pattern:
+        if char == "%":
+            parts.append(".*")
+        elif char == "_":
+            parts.append(".")
+        else:
+            parts.append(re.escape(char))
+
+    return re.compile("".join(parts), re.DOTALL | re.IGNORECASE | re.ASCII)
+
+
+def like_prefix(pattern: str) -> str:
+    """
+    The characters of a LIKE pattern before its first wildcard
+    """
+    return re.split("[%_]", pattern, maxsplit=1)[0]
+
+
+def to_like_text(value: any, text_encoding: str = "utf-8") -> str:
+    """
+    LIKE compares the text of its operand, numbers and blobs are converted to text,
+    blobs read in the database text encoding
+    """
+    if isinstance(value, bytes):
+        return value.decode(text_encoding, errors="replace")
+    if isinstance(value, str):
+        return value
+
+    return number_to_text(value)
+
+
+def compile_comparison(
+    compare: Callable[[any, any], bool],
+    constant: any,
+    text_key: Optional[Callable[[str], any]] = None,
+) -> Callable[[any], bool]:
+    """
+    Function comparing values with a constant that isn't NULL, in the order of
+    sqlite_order_key, text going through text_key first (see IndexKeyOrder). Values
+    of another storage class than the constant are all either before or after it.
+    """
+    constant_class = sqlite_order_key(constant)[0]
+    # the result for numbers, text and blobs not of the class of the constant
+    numbers, texts, blobs = (compare(rank, constant_class) for rank in (1, 2, 3))
+
+    if constant_class == 1:
+        if compare is operator.eq:
+            return lambda value: value == constant
+        return lambda value: (
+            compare(value, constant)
+            if type(value) in NUMBER_TYPES
+            else value is not None and (texts if type(value) is str else blobs)
+        )
+
+    if constant_class == 2:
+        if text_key is None:
+            # code points order like UTF-8 bytes do
+            if compare is operator.eq:
+                return lambda value: value == constant
+            return lambda value: (
+                compare(value, constant)
+                if type(value) is str
+                else value is not None and (blobs if type(value) is bytes else numbers)
+            )
+        key = text_key(constant)
+        return lambda value: (
+            compare(text_key(value), key)
+            if type(value) is str
+            else value is not None and (blobs if type(value) is bytes else numbers)
+        )
+
+    if compare is operator.eq:
+        return lambda value: value == constant
+    return lambda value: (
+        compare(value, constant)
+        if type(value) is bytes
+        else value is not None and (texts if type(value) is str else numbers)
+    )
+
+
+def all_of(
+    matchers: List[Callable[[Sequence[any]], bool]]
+) -> Callable[[Sequence[any]], bool]:
+    """
+    Row matcher true when every matcher is, chained two by two so that a row costs
+    one call per matcher tried
+    """
+    matches = matchers[0]
+    for next_matches in matchers[1:]:
+        matches = (lambda first, second: lambda row: first(row) and second(row))(
+            matches, next_matches
+        )
+    return matches
+
+
+def any_of(
+    matchers: List[Callable[[Sequence[any]], bool]]
+) -> Callable[[Sequence[any]], bool]:
+    matches = matchers[0]
+    for next_matches in matchers[1:]:
+        matches = (lambda first, second: lambda row: first(row) or second(row))(
+            matches, next_matches
+        )
+    return matches
+
+
+def sql_literal(value: any) -> str:
+    if value is None:
+        return "NULL"
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+
+    return str(value)
+
+
+@dataclass
+class KeyRange:
+    """
+    Range of index keys satisfying a filter. A None bound leaves that side open, NULLs
+    are never in a range. Bounds are query constants converted by the affinity of the
+    column (see ValueFilter.compared_value).
+
+    The bounds apply to the leading column of the keys, or to the column following
+    "prefix" when it is set: the values the leading columns of the keys are equal to.
+    """
+
+    lower: any
+    lower_inclusive: bool
+    upper: any
+    upper_inclusive: bool
+    prefix: Tuple[any, ...] = ()
+
+
+def encode_text_key(text: str, text_encoding: str) -> bytes:
+    if text.endswith(MAX_CHARACTER):
+        # upper bound of the keys starting with a LIKE prefix (see like_key_ranges),
+        # MAX_CHARACTER encoded in UTF-16 sorts before some other characters
+        return text[:-1].encode(text_encoding) + b"\xff" * 8
+
+    return text.encode(text_encoding)
+
+
+@dataclass(frozen=True)
+class SearchRange:
+    """
+    Range of index keys in the order of the b-tree. Bounds are key prefixes, holding
+    the order key of each of the leading columns they bound (see
+    IndexKeyOrder.order_key), and are compared with the same leading columns of the
+    keys (see IndexOrder.key_prefix). A column bound (storage class,) alone sorts
+    before every value of that storage class.
+    """
+
+    lower: Tuple[Tuple[any, ...], ...]
+    lower_inclusive: bool
+    upper: Tuple[Tuple[any, ...], ...]
+    upper_inclusive: bool
+
+    @property
+    def width(self) -> int:
+        """
+        Number of leading key columns the bounds apply to
+        """
+        return len(self.lower)
+
+    def is_below(self, key_prefix: Tuple[Tuple[any, ...], ...]) -> bool:
+        return key_prefix < self.lower or (
+            key_prefix == self.lower and not self.lower_inclusive
+        )
+
+    def is_above(self, key_prefix: Tuple[Tuple[any, ...], ...]) -> bool:
+        return key_prefix > self.upper or (
+            key_prefix == self.upper and not self.upper_inclusive
+        )
+
+
+class IndexKeyOrder:
+    """
+    Order of the values of a column, which is the order of the keys of an index b-tree
+    on it: by storage class (NULL < INTEGER/REAL < TEXT < BLOB), then by value, text
+    being compared with the collating sequence of the column: BINARY compares the
+    encoded bytes, NOCASE folds ASCII letters to lower case and RTRIM ignores trailing
+    spaces. See https://www.sqlite.org/datatype3.html#collation
+    """
+
+    def __init__(
+        self, collation: str = DEFAULT_COLLATION, text_encoding: str = "utf-8"
+    ):
+        # module functions rather than lambdas: filters are sent to worker processes
+        if collation == "NOCASE":
+            self.text_key = ascii_lower
+        elif collation == "RTRIM":
+            self.text_key = rtrim
+        elif text_encoding != "utf-8":
+            # code points sort like UTF-8 bytes, not like UTF-16 ones
+            self.text_key = partial(encode_text_key, text_encoding=text_encoding)
+        else:
+            self.text_key = None
+
+    def order_key(self, value: any) -> Tuple[int, any]:
+        if type(value) is str and self.text_key is not None:
+            return (2, self.text_key(value))
+
+        return sqlite_order_key(value)
+
+
+class IndexOrder:
+    """
+    Order of the keys of an index b-tree: by their first column, then by the next one
+    and so on, each column sorted in its IndexKeyOrder
+    """
+
+    def __init__(self, collations: Sequence[str], text_encoding: str = "utf-8"):
+        self.column_orders = [
+            IndexKeyOrder(collation, text_encoding) for collation in collations
+        ]
+
+    def key_prefix(
+        self, width: int
+    ) -> Callable[[Sequence[any]], Tuple[Tuple[int, any], ...]]:
+        """
+        Function giving the order keys of the first "width" columns of an index key,
+        what SearchRange bounds are compared with
+        """
+        if width == 1:
+            order_key = self.column_orders[0].order_key
+            return lambda key: (order_key(key[0]),)
+
+        order_keys = [order.order_key for order in self.column_orders[:width]]
+        return lambda key: tuple(
+            order_key(value) for order_key, value in zip(order_keys, key)
+        )
+
+    def search_ranges(self, key_ranges: List[KeyRange]) -> List[SearchRange]:
+        """
+        The ranges of index keys to walk for the key ranges, in index order and each
+        once. Open bounds reach the first number or the last blob, NULLs are never in
+        a range.
+        """
+        search_ranges = set()
+        for key_range in key_ranges:
+            prefix = tuple(
+                order.order_key(value)
+                for order, value in zip(self.column_orders, key_range.prefix)
+            )
+            order_key = self.column_orders[len(prefix)].order_key
+            lower, lower_inclusive = (1,), True
+            if key_range.lower is not None:
+                lower = order_key(key_range.lower)
+                lower_inclusive = key_range.lower_inclusive
+            upper, upper_inclusive = (4,), False
+            if key_range.upper is not None:
+                upper = order_key(key_range.upper)
+                upper_inclusive = key_range.upper_inclusive
+            search_ranges.add(
+                SearchRange(
+                    prefix + (lower,), lower_inclusive, prefix + (upper,), upper_inclusive
+                )
+            )
+
+        return sorted(search_ranges, key=lambda bounds: (bounds.lower, bounds.upper))
+
+
+@dataclass(frozen=True)
+class ColumnType:
+    """
+    How the values of a column are compared with query constants: the constants are
+    converted by the affinity of the column (see apply_affinity), then values are
+    ordered like IndexKeyOrder does, with the collating sequence of the column.
+    See https://www.sqlite.org/datatype3.html#comparisons
+    """
+
+    affinity: str = "BLOB"  # constants are left as they are
+    collation: str = DEFAULT_COLLATION
+    text_encoding: str = "utf-8"  # of the database, BINARY compares encoded text
+
+    @property
+    def key_order(self) -> IndexKeyOrder:
+        return IndexKeyOrder(self.collation, self.text_encoding)
+
+
+class RowFilter:
+    """
+    A WHERE condition, evaluated against decoded rows: a comparison of a column with
+    constants (ValueFilter) or AND, OR and NOT of other conditions.
+
+    Conditions evaluate to True, False or None (unknown) like SQL does: comparisons
+    with NULL are unknown, NOT keeps them unknown, and only rows for which the
+    condition is True are selected.
+    """
+
+    @property
+    def columns(self) -> List[str]:
+        """
+        The columns the condition reads, each once, in order of appearance
+        """
+        return list(dict.fromkeys(leaf.column for leaf in self.iter_value_filters()))
+
+    def iter_value_filters(self) -> Iterator[ValueFilter]:
+        raise NotImplementedError
+
+    def evaluate(self, row: Sequence[any], positions: Dict[str, int]) -> Optional[bool]:
+        """
+        Truth value of the condition for a row, its columns being found at "positions"
+        """
+        raise NotImplementedError
+
+    def matches_row(self, row: Sequence[any], positions: Dict[str, int]) -> bool:
+        return self.evaluate(row, positions) is True
+
+    def locate(self, position_of: Callable[[str], int]) -> Dict[str, int]:
+        """
+        Positions of the columns of the condition in rows, found by "position_of"
+        """
+        return {column: position_of(column) for column in self.columns}
+
+    def bind(
+        self, position_of: Callable[[str], int]
+    ) -> Callable[[Sequence[any]], bool]:
+        """
+        Function telling whether a row, whose columns are found by "position_of",
+        satisfies the condition. Compiled once per query: the column positions and
+        the constants are resolved ahead of the rows.
+        """
+        positions = self.locate(position_of)
+        return lambda row: self.evaluate(row, positions) is True
+
+    def bind_truth(
+        self, position_of: Callable[[str], int]
+    ) -> Callable[[Sequence[any]], Optional[bool]]:
+        """
+        Like bind, for the truth value of the condition (see evaluate)
+        """
+        positions = self.locate(position_of)
+        return lambda row: self.evaluate(row, positions)
+
+    def conjuncts(self) -> List[RowFilter]:
+        """
+        The conditions that must all hold for this one to hold
+        """
+        return [self]
+
+    def rename_columns(self, rename: Callable[[str], str]) -> RowFilter:
+        """
+        Copy of the condition with its columns renamed, e.g. unqualified
+        """
+        raise NotImplementedError
+
+    def with_column_types(self, column_type: Callable[[str], ColumnType]) -> RowFilter:
+        """
+        Copy of the condition comparing each column as "column_type" describes it.
+        Conditions not given types compare constants as they are, text with BINARY.
+        """
+        raise NotImplementedError
+
+
+class AndFilter(RowFilter):
+    operands: List[RowFilter]
+
+    def __init__(self, operands: List[RowFilter]):
+        self.operands = operands
+
+    def __str__(self) -> str:
+        return " AND ".join(
+            f"({operand})" if isinstance(operand, OrFilter) else str(operand)
+            for operand in self.operands
+        )
+
+    def iter_value_filters(self) -> Iterator[ValueFilter]:
+        for operand in self.operands:
+            yield from operand.iter_value_filters()
+
+    def evaluate(self, row: Sequence[any], positions: Dict[str, int]) -> Optional[bool]:
+        result = True
+        for operand in self.operands:
+            truth = operand.evaluate(row, positions)
+            if truth is False:
+                return False
+            if truth is None:
+                result = None
+
+        return result
+
+    def bind(
+        self, position_of: Callable[[str], int]
+    ) -> Callable[[Sequence[any]], bool]:
+        # unknown operands make the AND unknown or false, never true: plain
+        # matchers are enough
+        return all_of([operand.bind(position_of) for operand in self.operands])
+
+    def conjuncts(self) -> List[RowFilter]:
+        return [
+            conjunct for operand in self.operands for conjunct in operand.conjuncts()
+        ]
+
+    def rename_columns(self, rename: Callable[[str], str]) -> RowFilter:
+        return AndFilter([operand.rename_columns(rename) for operand in self.operands])
+
+    def with_column_types(self, column_type: Callable[[str], ColumnType]) -> RowFilter:
+        return AndFilter(
+            [operand.with_column_types(column_type) for operand in self.operands]
+        )
+
+
+class OrFilter(RowFilter):
+    operands: List[RowFilter]
+
+    def __init__(self, operands: List[RowFilter]):
+        self.operands = operands
+
+    def __str__(self) -> str:
+        return " OR ".join(str(operand) for operand in self.operands)
+
+    def iter_value_filters(self) -> Iterator[ValueFilter]:
+        for operand in self.operands:
+            yield from operand.iter_value_filters()
+
+    def evaluate(self, row: Sequence[any], positions: Dict[str, int]) -> Optional[bool]:
+        result = False
+        for operand in self.operands:
+            truth = operand.evaluate(row, positions)
+            if truth is True:
+                return True
+            if truth is None:
+                result = None
+
+        return result
+
+    def bind(
+        self, position_of: Callable[[str], int]
+    ) -> Callable[[Sequence[any]], bool]:
+        return any_of([operand.bind(position_of) for operand in self.operands])
+
+    def rename_columns(self, rename: Callable[[str], str]) -> RowFilter:
+        return OrFilter([operand.rename_columns(rename) for operand in self.operands])
+
+    def with_column_types(self, column_type: Callable[[str], ColumnType]) -> RowFilter:
+        return OrFilter(
+            [operand.with_column_types(column_type) for operand in self.operands]
+        )
+
+
+class NotFilter(RowFilter):
+    operand: RowFilter
+
+    def __init__(self, operand: RowFilter):
+        self.operand = operand
+
+    def __str__(self) -> str:
+        return f"NOT ({self.operand})"
+
+    def iter_value_filters(self) -> Iterator[ValueFilter]:
+        return self.operand.iter_value_filters()
+
+    def evaluate(self, row: Sequence[any], positions: Dict[str, int]) -> Optional[bool]:
+        truth = self.operand.evaluate(row, positions)
+        return None if truth is None else not truth
+
+    def bind(
+        self, position_of: Callable[[str], int]
+    ) -> Callable[[Sequence[any]], bool]:
+        # true only when the operand is false, not when it is unknown
+        truth = self.operand.bind_truth(position_of)
+        return lambda row: truth(row) is False
+
+    def rename_columns(self, rename: Callable[[str], str]) -> RowFilter:
+        return NotFilter(self.operand.rename_columns(rename))
+
+    def with_column_types(self, column_type: Callable[[str], ColumnType]) -> RowFilter:
+        return NotFilter(self.operand.with_column_types(column_type))
+
+
+def combine_conjuncts(conjuncts: List[RowFilter]) -> Optional[RowFilter]:
+    """
+    The condition holding when all the given ones hold, None if there are none
+    """
+    if not conjuncts:
+        return None
+
+    return conjuncts[0] if len(conjuncts) == 1 else AndFilter(conjuncts)
+
+
+class ValueFilter(RowFilter):
     column: str
+    operator_str: str
     operator: any  # some operation exported by the operator module
+    # (lower, upper) tuple for BETWEEN, tuple of candidates for IN, the pattern for
+    # LIKE and None for IS [NOT] NULL
     value: any
+    column_type: ColumnType
+    # the value converted by the affinity of the column, what values are compared with
+    # (LIKE patterns aren't converted)
+    compared_value: any
 
-    def __init__(self, column: str, operator: str, threshold: any):
+    def __init__(
+        self,
+        column: str,
+        operator: str,
+        threshold: any,
+        column_type: ColumnType = ColumnType(),
+    ):
         self.column = column
-        self.operator = ValueFilter._string_to_operator(operator)
+        self.operator_str = operator.upper()
+        self.operator = ValueFilter._string_to_operator(self.operator_str)
         self.value = threshold
+        self.column_type = column_type
+        self.key_order = IndexKeyOrder(column_type.collation, column_type.text_encoding)
+        if self.operator_str in ("BETWEEN", "IN"):
+            self.compared_value = tuple(
+                apply_affinity(value, column_type.affinity) for value in threshold
+            )
+        elif self.operator_str == "LIKE":
+            self.compared_value = threshold
+            self.like_regex = compile_like_pattern(threshold)
+        else:
+            self.compared_value = apply_affinity(threshold, column_type.affinity)
+
+    def __str__(self) -> str:
+        match self.operator_str:
+            case "BETWEEN":
+                lower, upper = self.value
+                bounds = f"{sql_literal(lower)} AND {sql_literal(upper)}"
+                return f"{self.column} BETWEEN {bounds}"
+            case "IN":
+                candidates = ", ".join(sql_literal(value) for value in self.value)
+                return f"{self.column} IN ({candidates})"
+            case "IS NULL" | "IS NOT NULL":
+                return f"{self.column} {self.operator_str}"
+            case _:
+                return f"{self.column} {self.operator_str} {sql_literal(self.value)}"
 
     def __call__(self, row) -> bool:
         if self.column not in row:
@@ -17,24 +678,242 @@ class ValueFilter:
                 f"Expected column '{self.column}' in row but only found {row.keys}"
             )
 
-        value = row[self.column]
-        if not value:
-            return False
+        return self.matches(row[self.column])
 
-        value = value.decode("utf8")
-        if type(value) is not type(self.value):
-            raise TypeError(
-                "Type of given value is not the same as threshold: ",
-                type(value),
-                type(self.value),
-            )
+    def iter_value_filters(self) -> Iterator[ValueFilter]:
+        yield self
+
+    def evaluate(self, row: Sequence[any], positions: Dict[str, int]) -> Optional[bool]:
+        return self.truth(row[positions[self.column]])
+
+    def rename_columns(self, rename: Callable[[str], str]) -> RowFilter:
+        return ValueFilter(
+            rename(self.column), self.operator_str, self.value, self.column_type
+        )
+
+    def with_column_types(self, column_type: Callable[[str], ColumnType]) -> RowFilter:
+        return ValueFilter(
+            self.column, self.operator_str, self.value, column_type(self.column)
+        )
+
+    def bind(
+        self, position_of: Callable[[str], int]
+    ) -> Callable[[Sequence[any]], bool]:
+        position = position_of(self.column)
+        if self.operator_str == "IS NULL":
+            return lambda row: row[position] is None
+        if self.operator_str == "IS NOT NULL":
+            return lambda row: row[position] is not None
+        matches = self.compile_matcher()
+        return lambda row: matches(row[position])
+
+    def bind_truth(
+        self, position_of: Callable[[str], int]
+    ) -> Callable[[Sequence[any]], Optional[bool]]:
+        position = position_of(self.column)
+        if self.is_null_test:
+            return self.bind(position_of)
+        if self.has_null_constant:
+            return lambda row: self.truth(row[position])
+
+        matches = self.compile_matcher()
+
+        def truth(row: Sequence[any]) -> Optional[bool]:
+            value = row[position]
+            return None if value is None else matches(value)
 
-        return self.operator(value.strip().lower(), self.value.strip().lower())
+        return truth
+
+    def compile_matcher(self) -> Callable[[any], bool]:
+        """
+        Function doing what matches() does, specialized once for the operator and for
+        the constants converted by the affinity of the column: values of another
+        storage class than a constant compare the same way whatever they are, values
+        of its class are compared directly (text through the collation of the column,
+        unless it is BINARY on UTF-8 text, which orders like str does)
+        """
+        text_key = self.key_order.text_key
+        match self.operator_str:
+            case "IS NULL":
+                return lambda value: value is None
+            case "IS NOT NULL":
+                return lambda value: value is not None
+            case "LIKE":
+                fullmatch = self.like_regex.fullmatch
+                text_encoding = self.column_type.text_encoding
+                return lambda value: (
+                    value is not None
+                    and fullmatch(to_like_text(value, text_encoding)) is not None
+                )
+            case "IN":
+                candidates = set(self.compared_value) - {None}
+                if text_key is None:
+                    # equal values are of the same storage class, 1 == 1.0 included
+                    candidates = frozenset(candidates)
+                    return lambda value: value in candidates
+                order_key = self.key_order.order_key
+                keys = frozenset(map(order_key, candidates))
+                return lambda value: value is not None and order_key(value) in keys
+            case "BETWEEN":
+                lower, upper = self.compared_value
+                if lower is None or upper is None:
+                    return self.matches
+                above = compile_comparison(operator.ge, lower, text_key)
+                below = compile_comparison(operator.le, upper, text_key)
+                return lambda value: above(value) and below(value)
+
+        if self.compared_value is None:
+            return self.matches
+        return compile_comparison(self.operator, self.compared_value, text_key)
+
+    def truth(self, value: any) -> Optional[bool]:
+        """
+        Truth value of the filter for a column value, None when it is unknown
+        (comparisons with NULL)
+        """
+        match self.operator_str:
+            case "IS NULL":
+                return value is None
+            case "IS NOT NULL":
+                return value is not None
+        if value is None:
+            return None
+
+        match self.operator_str:
+            case "BETWEEN":
+                lower, upper = self.compared_value
+                truths = (
+                    self._compare(operator.ge, value, lower),
+                    self._compare(operator.le, value, upper),
+                )
+                return False if False in truths else None if None in truths else True
+            case "IN":
+                if any(
+                    self._compare(operator.eq, value, candidate)
+                    for candidate in self.compared_value
+                ):
+                    return True
+                # x IN (..., NULL) is unknown rather than false when x matches nothing
+                return None if None in self.compared_value else False
+            case "LIKE":
+                like_text = to_like_text(value, self.column_type.text_encoding)
+                return self.like_regex.fullmatch(like_text) is not None
+
+        return self._compare(self.operator, value, self.compared_value)
+
+    @property
+    def is_equality(self) -> bool:
+        """
+        Whether the filter only holds for values equal to a constant that isn't NULL,
+        which leaves the following columns of an index on the column sorted
+        """
+        return self.operator_str in ("=", "==") and self.compared_value is not None
+
+    @property
+    def is_null_test(self) -> bool:
+        return self.operator_str in ("IS NULL", "IS NOT NULL")
+
+    @property
+    def has_null_constant(self) -> bool:
+        """
+        Whether the filter compares with NULL, which makes it unknown rather than false
+        for values it doesn't match
+        """
+        if self.operator_str in ("BETWEEN", "IN"):
+            return None in self.value
+
+        return self.value is None and not self.is_null_test
+
+    def matches(self, value: any) -> bool:
+        """
+        Checks a single column value against the filter, for rows that are not keyed by column name
+        """
+        return self.truth(value) is True
+
+    def key_ranges(self) -> Optional[List[KeyRange]]:
+        """
+        The ranges of keys an index on the filtered column must be walked over,
+        or None if an index can't narrow down the rows (e.g. "!=")
+        """
+        value = self.compared_value
+        if self.has_null_constant and self.operator_str != "IN":
+            # comparisons with NULL are never true
+            return []
+        match self.operator_str:
+            case "=" | "==":
+                return [KeyRange(value, True, value, True)]
+            case "<":
+                return [KeyRange(None, False, value, False)]
+            case "<=":
+                return [KeyRange(None, False, value, True)]
+            case ">":
+                return [KeyRange(value, False, None, False)]
+            case ">=":
+                return [KeyRange(value, True, None, False)]
+            case "BETWEEN":
+                lower, upper = value
+                return [KeyRange(lower, True, upper, True)]
+            case "IN":
+                # one point range per distinct candidate, in key order
+                candidates = sorted(set(value) - {None}, key=self.key_order.order_key)
+                return [KeyRange(value, True, value, True) for value in candidates]
+            case "LIKE":
+                return like_key_ranges(value)
+            case _:
+                return None
+
+    def _compare(self, comparison, value: any, constant: any) -> Optional[bool]:
+        """
+        Compares a value with a constant converted by the affinity of the column, in
+        the order of the column (see IndexKeyOrder). Unknown if the constant is NULL.
+        """
+        if constant is None:
+            return None
+
+        order_key = self.key_order.order_key
+        return comparison(order_key(value), order_key(constant))
 
     @staticmethod
     def _string_to_operator(operator_str: str):
         match operator_str:
-            case "=":
+            case "=" | "==":
                 return operator.eq
+            case "!=" | "<>":
+                return operator.ne
+            case "<":
+                return operator.lt
+            case "<=":
+                return operator.le
+            case ">":
+                return operator.gt
+            case ">=":
+                return operator.ge
+            case "BETWEEN" | "IN" | "LIKE" | "IS NULL" | "IS NOT NULL":
+                # matched by matches() itself, e.g. against each bound or candidate
+                return None
             case _:
                 raise TypeError(f"Operator '{operator_str}' is not yet supported")
+
+
+def like_key_ranges(pattern: str) -> Optional[List[KeyRange]]:
+    """
+    Index keys that may match a LIKE pattern: the text keys starting with its prefix
+    in any case (from all upper case to all lower case), then the same range of blobs.
+    The range also holds keys not matching, the pattern must still be checked.
+    None when the pattern starts with a wildcard, or when its prefix could also start
+    the text of a number (see number_to_text): numbers are indexed apart from text,
+    by value.
+    """
+    prefix = like_prefix(pattern)
+    if not prefix or prefix[0] in "0123456789-.":
+        return None
+    if "inf".startswith(ascii_lower(prefix)):
+        return None
+
+    lower, upper = ascii_upper(prefix), ascii_lower(prefix) + MAX_CHARACTER
+
+    return [
+        KeyRange(lower, True, upper, True),
+        KeyRange(lower.encode(), True, upper.encode(), True),
+    ]
+
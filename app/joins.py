@@ -0,0 +1,218 @@
+from __future__ import annotations
+from collections import defaultdict
+from dataclasses import dataclass
+from itertools import islice
+
+from app.catalog import Catalog, TableInfo
+from app.consts import JOIN_PROBE_BATCH
+from app.filtering import (
+    ColumnType,
+    IndexKeyOrder,
+    RowFilter,
+    ValueFilter,
+    apply_affinity,
+)
+from app.pager import Pager
+from app.pages import load_page_at_location
+
+from typing import List, Optional, Iterator, Iterable, Tuple, Dict, Callable
+
+JOIN_KINDS = {
+    "JOIN": "INNER",
+    "INNER JOIN": "INNER",
+    "LEFT JOIN": "LEFT",
+    "LEFT OUTER JOIN": "LEFT",
+}
+
+
+@dataclass
+class Join:
+    """
+    <table> [INNER | LEFT [OUTER]] JOIN <table_name> [<alias>] ON <column> = <column>
+    """
+
+    kind: str  # "INNER" or "LEFT"
+    table_name: str
+    alias: Optional[str]
+    on_columns: Tuple[str, str]  # column references compared by the ON clause, as written
+
+
+@dataclass
+class JoinSide:
+    """
+    One of the joined tables, decoded as tuples laid out as "columns"
+    """
+
+    table: TableInfo
+    columns: List[str]
+    join_column: str
+    value_filter: Optional[RowFilter]  # applied to the rows of this table only
+    # how join values are compared with the other side: the affinity applied to them
+    # (see operand_affinity) and the collating sequence of the ON comparison
+    join_type: ColumnType = ColumnType()
+
+    def __post_init__(self):
+        self.key_order = IndexKeyOrder(
+            self.join_type.collation, self.join_type.text_encoding
+        )
+
+    @property
+    def join_position(self) -> int:
+        return self.columns.index(self.join_column)
+
+    def join_value(self, value: any) -> any:
+        return apply_affinity(value, self.join_type.affinity)
+
+    def join_keys(self) -> Callable[[Tuple[any, ...]], any]:
+        """
+        Function giving the key a row is joined on, equal to the key of the rows of the
+        other side it matches: the order key of its converted join value (see
+        IndexKeyOrder.order_key), None for NULL which matches nothing
+        """
+        position, affinity = self.join_position, self.join_type.affinity
+        order_key = self.key_order.order_key
+
+        def join_key(row: Tuple[any, ...]) -> any:
+            value = row[position]
+            return None if value is None else order_key(apply_affinity(value, affinity))
+
+        return join_key
+
+
+def split_column_reference(reference: str) -> Tuple[Optional[str], str]:
+    """
+    "alias.column" -> ("alias", "column"), "column" -> (None, "column")
+    """
+    qualifier, _, column = reference.rpartition(".")
+    return qualifier or None, column
+
+
+def can_probe(catalog: Catalog, side: JoinSide) -> bool:
+    """
+    True if rows of the side can be looked up by their join value, through the row id
+    b-tree or an index led by the join column sorting text with the collating sequence
+    of the join. Values converted before being compared can't be looked up as stored.
+    """
+    if side.join_type.affinity != "BLOB":
+        return False
+    if side.join_column == side.table.row_id_alias:
+        return True
+
+    index = catalog.find_index(
+        side.table.name, side.join_column, side.join_type.collation
+    )
+    return index is not None
+
+
+def hash_join(
+    probe_rows: Iterable[Tuple[any, ...]],
+    probe_key: Callable[[Tuple[any, ...]], any],
+    build_rows: Iterable[Tuple[any, ...]],
+    build_key: Callable[[Tuple[any, ...]], any],
+    keep_unmatched: bool,
+) -> Iterator[Tuple[Tuple[any, ...], Optional[Tuple[any, ...]]]]:
+    """
+    Loads the build rows in a hash table keyed by their join key (see
+    JoinSide.join_keys), then streams the probe rows against it. Yields (probe row,
+    build row) pairs, in probe row order.
+    With "keep_unmatched", probe rows without a match are yielded with None (LEFT JOIN).
+    """
+    build_table: Dict[any, List[Tuple[any, ...]]] = defaultdict(list)
+    for row in build_rows:
+        key = build_key(row)
+        if key is not None:
+            build_table[key].append(row)
+
+    for row in probe_rows:
+        key = probe_key(row)
+        matches = build_table.get(key) if key is not None else None
+        if matches:
+            for match in matches:
+                yield row, match
+        elif keep_unmatched:
+            yield row, None
+
+
+def index_nested_loop_join(
+    pager: Pager,
+    catalog: Catalog,
+    outer_rows: Iterable[Tuple[any, ...]],
+    outer: JoinSide,
+    inner: JoinSide,
+    keep_unmatched: bool,
+) -> Iterator[Tuple[Tuple[any, ...], Optional[Tuple[any, ...]]]]:
+    """
+    For each outer row, looks the matching inner rows up through the row id b-tree of the
+    inner table or an index on its join column. Yields (outer row, inner row) pairs
+    in outer row order, see hash_join for "keep_unmatched".
+
+    Outer rows are taken in batches of JOIN_PROBE_BATCH, whose distinct keys are
+    looked up in key order so every page on the way is visited once per batch.
+    """
+    outer_rows = iter(outer_rows)
+    outer_position, outer_key = outer.join_position, outer.join_keys()
+    while batch := list(islice(outer_rows, JOIN_PROBE_BATCH)):
+        values = {outer.join_value(row[outer_position]) for row in batch}
+        values.discard(None)
+        inner_rows = lookup_inner_rows(pager, catalog, inner, values)
+
+        for row in batch:
+            key = outer_key(row)
+            matches = inner_rows.get(key) if key is not None else None
+            if matches:
+                for match in matches:
+                    yield row, match
+            elif keep_unmatched:
+                yield row, None
+
+
+def lookup_inner_rows(
+    pager: Pager, catalog: Catalog, inner: JoinSide, values: Iterable[any]
+) -> Dict[any, List[Tuple[any, ...]]]:
+    """
+    Returns the inner rows whose join value equals one of the (converted) outer join
+    values and satisfying the inner filter, grouped by join key (see
+    JoinSide.join_keys)
+    """
+    table = inner.table
+    values = list(values)
+    if inner.join_column == table.row_id_alias:
+        # integer primary key: the value is the row id itself, 2.0 matching row 2
+        row_ids = {
+            int(value)
+            for value in values
+            if type(value) is int or (type(value) is float and value.is_integer())
+        }
+    elif values:
+        join_type = inner.join_type
+        index = catalog.find_index(table.name, inner.join_column, join_type.collation)
+        index_page = load_page_at_location(pager, index.rootpage - 1)
+        key_filter = ValueFilter(inner.join_column, "IN", tuple(values), join_type)
+        row_ids = {
+            index_key[-1]
+            for index_key in index_page.iter_filter_compliant_keys(
+                pager, key_filter.key_ranges(), index.collations
+            )
+        }
+    else:
+        row_ids = set()
+
+    column_ordinals = table.resolve_column_ordinals(inner.columns)
+    table_page = load_page_at_location(pager, table.rootpage - 1)
+    row_filter = inner.value_filter.bind(inner.columns.index) if inner.value_filter else None
+
+    inner_key = inner.join_keys()
+    inner_rows: Dict[any, List[Tuple[any, ...]]] = defaultdict(list)
+    for page in table_page.iter_table_leaf_pages(pager, sorted(row_ids)):
+        for _, row in page.iter_records_by_row_id(
+            pager,
+            row_ids,
+            column_ordinals,
+            table.real_ordinals,
+            table.default_ordinals,
+        ):
+            if row_filter and not row_filter(row):
+                continue
+            inner_rows[inner_key(row)].append(row)
+
+    return inner_rows
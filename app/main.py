@@ -1,36 +1,39 @@
+import argparse
 import sys
-from app.pages import Page
-from app.queries import Query
+from app.catalog import Catalog
+from app.commands import iter_command_output
+from app.pager import Pager
+from app.pages import load_page_at_location
 
-database_file_path = sys.argv[1]
-command = sys.argv[2]
+parser = argparse.ArgumentParser(description="Read-only SQLite database viewer")
+parser.add_argument("database_file_path")
+parser.add_argument("command", help='".dbinfo", ".tables" or a SELECT query')
+parser.add_argument(
+    "-j",
+    "--workers",
+    type=int,
+    default=1,
+    help="number of processes used for full table scans",
+)
+parser.add_argument(
+    "--stats", action="store_true", help="print page cache statistics to stderr"
+)
+args = parser.parse_args()
 
-with open(database_file_path, "rb") as database_file:
+database_file_path = args.database_file_path
+command = args.command
+
+with Pager(database_file_path) as pager:
     # You can use print statements as follows for debugging, they'll be visible when running tests.
     print("Logs from your program will appear here!", file=sys.stderr)
 
-    # Skip the first 16 bytes of the header, its the sqlite version
-    # 0 - means to seek from the start of the file
-    database_file.seek(16, 0)
-    page_size = int.from_bytes(database_file.read(2), byteorder="big")
-
-    # we will read the first full page, seek back to the start of the file
-    database_file.seek(0, 0)
-    first_page_bytes = bytearray(database_file.read(page_size))
-    first_page = Page.from_file(database_file, 0, is_first_page=True)
-
     # The first page in an sqlite db is a special node that contains the schema of the db
-    sqlite_schema = first_page.read_sqlite_schema(database_file)
+    # Its header comes right after the 100 byte database header
+    first_page = load_page_at_location(pager, 0)
+    catalog = Catalog.from_schema(first_page.read_sqlite_schema(pager))
 
-    database_file.seek(0)
+    for line in iter_command_output(pager, catalog, command, args.workers):
+        print(line)
 
-    if command == ".dbinfo":
-        print(f"database page size: {page_size}")
-        print(f"number of tables:  {first_page.cell_count}")
-    elif command == ".tables":
-        print(
-            f"table names: {' '.join([schema.table_name for schema in sqlite_schema])}"
-        )
-    else:
-        query = Query.parse_query(command)
-        query.execute(database_file, sqlite_schema, page_size)
+    if args.stats:
+        print(f"Page cache: {pager.page_cache.stats}", file=sys.stderr)
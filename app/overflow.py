@@ -0,0 +1,164 @@
+from __future__ import annotations
+from dataclasses import dataclass
+
+from app.consts import OVERFLOW_POINTER_SIZE, ROW_ID_ORDINAL
+from app.pager import Pager
+from app.profiling import count_page_read
+from app.reading import (
+    local_payload_size,
+    read_varint,
+    read_record_header,
+    read_column_value,
+    read_table_record,
+    apply_real_affinity,
+    apply_column_defaults,
+    locate_record_columns,
+    serial_type_size,
+)
+
+from typing import List, Optional, Sequence, AbstractSet, Mapping
+
+
+@dataclass
+class CellPayload:
+    """
+    Payload of a b-tree cell. When it does not fit in its page, only the first
+    "len(local)" bytes are stored in the cell, followed by the number of the first
+    overflow page. Each overflow page starts with the number of the next one (0 for the last)
+    and uses the rest of its usable space for the continuation of the payload.
+    """
+
+    local: memoryview  # bytes of the payload stored in the cell itself
+    size: int  # full payload size, as declared in the cell
+    first_overflow_page: Optional[int]  # 1-based page number, None if nothing spilled
+
+    @staticmethod
+    def from_cell(
+        pager: Pager, page_buffer: memoryview, offset: int, size: int, is_index: bool
+    ) -> CellPayload:
+        """
+        Builds the payload of the cell whose payload bytes start at "offset".
+        """
+        local_size = local_payload_size(size, pager.usable_size, is_index)
+        local = page_buffer[offset : offset + local_size]
+
+        first_overflow_page = None
+        if local_size < size:
+            pointer_offset = offset + local_size
+            first_overflow_page = int.from_bytes(
+                page_buffer[pointer_offset : pointer_offset + OVERFLOW_POINTER_SIZE],
+                "big",
+            )
+
+        return CellPayload(local, size, first_overflow_page)
+
+    @property
+    def overflows(self) -> bool:
+        return self.first_overflow_page is not None
+
+    def assemble(self, pager: Pager) -> memoryview:
+        """
+        Returns the full payload. Spilled payloads are gathered in a single pass over
+        the overflow chain, each chunk copied once into a buffer allocated upfront.
+        """
+        if not self.overflows:
+            return self.local
+
+        payload = bytearray(self.size)
+        written = len(self.local)
+        payload[:written] = self.local
+
+        chunk_capacity = pager.usable_size - OVERFLOW_POINTER_SIZE
+        page_number = self.first_overflow_page
+        while written < self.size:
+            if page_number == 0:
+                raise ValueError(
+                    f"Overflow chain ended after {written} of {self.size} payload bytes"
+                )
+
+            overflow_page = pager.page(page_number - 1)
+            count_page_read("overflow", pager.page_size)
+            page_number = int.from_bytes(overflow_page[:OVERFLOW_POINTER_SIZE], "big")
+
+            chunk_size = min(chunk_capacity, self.size - written)
+            payload[written : written + chunk_size] = overflow_page[
+                OVERFLOW_POINTER_SIZE : OVERFLOW_POINTER_SIZE + chunk_size
+            ]
+            written += chunk_size
+
+        return memoryview(payload)
+
+
+def read_payload_record(
+    pager: Pager,
+    payload: CellPayload,
+    row_id: int = None,
+    columns: Optional[Sequence[int]] = None,
+    real_columns: AbstractSet[int] = frozenset(),
+    defaults: Optional[Mapping[int, any]] = None,
+) -> List[any]:
+    """
+    Decodes the record held by the payload, see read_table_record for "columns",
+    apply_real_affinity for "real_columns" and apply_column_defaults for "defaults".
+
+    Only the requested columns are looked at, so the overflow chain is followed
+    only if one of them spilled out of the cell.
+    """
+    record = _read_payload_columns(pager, payload, row_id, columns, defaults)
+    return apply_real_affinity(record, columns, real_columns)
+
+
+def _read_payload_columns(
+    pager: Pager,
+    payload: CellPayload,
+    row_id: Optional[int],
+    columns: Optional[Sequence[int]],
+    defaults: Optional[Mapping[int, any]],
+) -> List[any]:
+    text_encoding = pager.text_encoding
+    if not payload.overflows:
+        return read_table_record(
+            payload.local, 0, row_id, columns, text_encoding, defaults
+        )
+
+    if columns is None:
+        return read_table_record(
+            payload.assemble(pager), 0, text_encoding=text_encoding
+        )
+
+    header_size, _ = read_varint(payload.local, 0)
+    if header_size > len(payload.local):
+        # the header itself spilled, nothing can be read without the chain
+        return read_table_record(
+            payload.assemble(pager), 0, row_id, columns, text_encoding, defaults
+        )
+
+    serial_types, _ = read_record_header(payload.local, 0)
+
+    local_size = len(payload.local)
+    full_payload = None
+    record_columns = []
+    for ordinal, (column_offset, serial_type) in zip(
+        columns, locate_record_columns(serial_types, header_size, columns)
+    ):
+        # See read_table_record for the INTEGER PRIMARY KEY handling
+        if ordinal == ROW_ID_ORDINAL:
+            record_columns.append(row_id)
+        elif column_offset + serial_type_size(serial_type) <= local_size:
+            record_columns.append(
+                read_column_value(
+                    payload.local, column_offset, serial_type, text_encoding
+                )
+            )
+        else:
+            if full_payload is None:
+                full_payload = payload.assemble(pager)
+            record_columns.append(
+                read_column_value(
+                    full_payload, column_offset, serial_type, text_encoding
+                )
+            )
+
+    return apply_column_defaults(
+        tuple(record_columns), columns, len(serial_types), defaults
+    )
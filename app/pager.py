@@ -0,0 +1,136 @@
+from __future__ import annotations
+import mmap
+import os
+
+from app.consts import (
+    PAGE_SIZE_OFFSET,
+    MAX_PAGE_SIZE,
+    DEFAULT_PAGE_CACHE_PAGES,
+    RESERVED_SPACE_OFFSET,
+    FILE_CHANGE_COUNTER_OFFSET,
+    TEXT_ENCODING_OFFSET,
+    TEXT_ENCODINGS,
+)
+from app.reading import page_start
+from app.cache import PageCache
+
+from typing import Optional, Iterable
+
+
+class Pager:
+    """
+    Owns the open database file and exposes its pages as zero-copy memoryviews
+    of a read-only memory map, so page and record decoding read offsets straight
+    out of the mapped buffer instead of doing a seek() + read() per field.
+
+    Parsed pages are kept in an LRU "page_cache" shared by every query run against
+    this pager, bounded by "cache_pages" and/or "cache_bytes".
+    """
+
+    database_file_path: str
+    page_size: int
+    page_count: int
+    usable_size: int  # page size minus the per page reserved region
+    file_change_counter: int  # value of the header counter when the file was mapped
+    text_encoding: str  # python codec of the text values, e.g. "utf-8"
+    buffer: memoryview
+    page_cache: PageCache
+
+    def __init__(
+        self,
+        database_file_path: str,
+        cache_pages: Optional[int] = DEFAULT_PAGE_CACHE_PAGES,
+        cache_bytes: Optional[int] = None,
+    ):
+        self.database_file_path = database_file_path
+        self._file = open(database_file_path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buffer = memoryview(self._mmap)
+
+        # https://www.sqlite.org/fileformat.html#page_size
+        # The value 1 represents a page size of 65536 bytes
+        page_size = int.from_bytes(
+            self.buffer[PAGE_SIZE_OFFSET : PAGE_SIZE_OFFSET + 2], "big"
+        )
+        self.page_size = MAX_PAGE_SIZE if page_size == 1 else page_size
+        self.page_count = len(self.buffer) // self.page_size
+        self.usable_size = self.page_size - self.buffer[RESERVED_SPACE_OFFSET]
+        self.file_change_counter = int.from_bytes(
+            self.buffer[FILE_CHANGE_COUNTER_OFFSET : FILE_CHANGE_COUNTER_OFFSET + 4],
+            "big",
+        )
+        # a database that was never written to has no encoding yet, it defaults to UTF-8
+        text_encoding = int.from_bytes(
+            self.buffer[TEXT_ENCODING_OFFSET : TEXT_ENCODING_OFFSET + 4], "big"
+        )
+        self.text_encoding = TEXT_ENCODINGS.get(text_encoding, "utf-8")
+        self.page_cache = PageCache(self.page_size, cache_pages, cache_bytes)
+
+    def page(self, page_idx: int) -> memoryview:
+        """
+        Returns a view over the page at the given 0-based index.
+        Offsets in the page header and cell pointer array are relative to its start.
+        """
+        if page_idx < 0 or page_idx >= self.page_count:
+            raise IndexError(
+                f"Page {page_idx} is out of bounds, database has {self.page_count} pages"
+            )
+
+        start = page_start(page_idx, self.page_size)
+        return self.buffer[start : start + self.page_size]
+
+    def prefetch(self, page_indices: Iterable[int]):
+        """
+        Hints the kernel to start reading the given pages in, so they are already in memory
+        by the time they are visited. Runs of contiguous pages are requested together.
+        """
+        if not hasattr(mmap, "MADV_WILLNEED"):
+            return
+
+        runs = []
+        for page_idx in sorted(page_indices):
+            if runs and runs[-1][1] == page_idx:
+                runs[-1][1] = page_idx + 1
+            else:
+                runs.append([page_idx, page_idx + 1])
+
+        for first_idx, end_idx in runs:
+            # madvise needs a start aligned on the OS page size
+            start = page_start(first_idx, self.page_size)
+            aligned_start = start - start % mmap.PAGESIZE
+            end = min(page_start(end_idx, self.page_size), len(self.buffer))
+            self._mmap.madvise(mmap.MADV_WILLNEED, aligned_start, end - aligned_start)
+
+    def is_stale(self) -> bool:
+        """
+        True if the database was written to since it was mapped.
+        The counter is read through the path, so a file replaced by another one is noticed too.
+        """
+        return read_file_change_counter(self.database_file_path) != self.file_change_counter
+
+    def close(self):
+        self.page_cache.clear()
+        self.buffer.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            # Pages still hold views over the map, it gets unmapped once they are collected
+            pass
+        self._file.close()
+
+    def __enter__(self) -> Pager:
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def read_file_change_counter(database_file_path: str) -> int:
+    """
+    Reads the header counter SQLite increments on every committed transaction,
+    see https://www.sqlite.org/fileformat.html#file_change_counter
+    """
+    with open(database_file_path, "rb") as database_file:
+        return int.from_bytes(
+            os.pread(database_file.fileno(), 4, FILE_CHANGE_COUNTER_OFFSET), "big"
+        )
@@ -2,18 +2,33 @@ from __future__ import annotations
 from enum import Enum
 from dataclasses import dataclass
 from collections import defaultdict
+from bisect import bisect_left
 
 from app.consts import (
+    DEFAULT_COLLATION,
     INTERIOR_PAGE_HEADER_SIZE,
     LEAF_PAGE_HEADER_SIZE,
     DB_FILE_HEADER_SIZE,
     SQLITE_SEQUENCE_TABLE_NAME,
 )
-from app.reading import read_varint, read_table_record, page_start
+from app.reading import read_varint, page_start
 from app.rows import Schema
-from app.filtering import ValueFilter
-
-from typing import List, BinaryIO, Dict, Optional
+from app.filtering import KeyRange, IndexOrder, SearchRange
+from app.pager import Pager
+from app.overflow import CellPayload, read_payload_record
+from app.profiling import active_profile, count_page_read, count_records_decoded
+
+from typing import (
+    List,
+    Optional,
+    Iterator,
+    Tuple,
+    Container,
+    Callable,
+    AbstractSet,
+    Mapping,
+    Sequence,
+)
 
 
 @dataclass
@@ -26,7 +41,9 @@ class InteriorPointer:
     """
 
     page_index: int  # index of the pointed leaf page
-    smallest_row_id: int  # varint representing the smallest row IF of the page
+    # varint key of the cell, the pointed page holds row ids <= to it
+    # (and > than the key of the previous cell)
+    smallest_row_id: int
 
 
 @dataclass
@@ -36,8 +53,9 @@ class IndexRecord:
     a specific key the index is responsible for.
     """
 
-    value: str
+    value: any
     row_id: int  # id of a row containing this value
+    key: Tuple[any, ...]  # full index key: the indexed columns, in order, then the row id
     left_pointer: Optional[
         int
     ]  # if it's an inner node, pointer to an indes leaf page contianing more about this row
@@ -62,74 +80,87 @@ class PageType(Enum):
     LEAF_TABLE = 0x0D
 
 
+# How page reads are reported by the query profile, see app.profiling
+PAGE_KINDS = {
+    PageType.INTERIOR_INDEX: "index interior",
+    PageType.INTERIOR_TABLE: "table interior",
+    PageType.LEAF_INDEX: "index leaf",
+    PageType.LEAF_TABLE: "table leaf",
+}
+
+
 class Page:
     start: int
+    data: memoryview
     page_type: PageType
     cell_count: int
     cell_area_start: int
     cell_pointer_array: List[int]
     right_most_pointer: Optional[int]  # Only present in inner page headers
 
+    # Decoded lazily and kept around, so cached pages don't get re-parsed
+    interior_pointers: Optional[List[InteriorPointer]] = None
+    interior_row_id_keys: Optional[List[int]] = None
+    # by cell position, each one decoded the first time it is needed
+    index_records: Optional[List[Optional[IndexRecord]]] = None
+
     @staticmethod
-    def from_file(
-        database_file: BinaryIO, start: int, is_first_page: bool = False
+    def from_buffer(
+        page_buffer: memoryview, start: int, is_first_page: bool = False
     ) -> Page:
         """
-        Loads the database page from located at the "start" offset.
+        Loads the database page held by "page_buffer", located at the "start" offset of the file.
         Parses the page header as described in https://www.sqlite.org/fileformat2.html#b_tree_pages
         and, based on that, loads the cell pointer array
         """
         instance = Page()
         instance.start = start
-
-        database_file.seek(start)
-        real_start = start
+        instance.data = page_buffer
 
         # For the first page, we must skip the 100 byte database header
-        if is_first_page:
-            database_file.seek(DB_FILE_HEADER_SIZE)
-            real_start = DB_FILE_HEADER_SIZE
+        header_start = DB_FILE_HEADER_SIZE if is_first_page else 0
 
-        page_type_int = int.from_bytes(database_file.read(1), "big")
+        page_type_int = page_buffer[header_start]
         try:
             instance.page_type = PageType(page_type_int)
         except ValueError:
             raise ValueError(f"Invalid page type: {page_type_int}")
 
-        database_file.seek(real_start + 3)
-        instance.cell_count = int.from_bytes(database_file.read(2), "big")
+        instance.cell_count = int.from_bytes(
+            page_buffer[header_start + 3 : header_start + 5], "big"
+        )
 
-        database_file.seek(real_start + 8)
         if (
             instance.page_type == PageType.INTERIOR_INDEX
             or instance.page_type == PageType.INTERIOR_TABLE
         ):
-            instance.right_most_pointer = int.from_bytes(database_file.read(4), "big")
+            instance.right_most_pointer = int.from_bytes(
+                page_buffer[header_start + 8 : header_start + 12], "big"
+            )
+            cell_pointers_start = header_start + INTERIOR_PAGE_HEADER_SIZE
         else:
             instance.right_most_pointer = None
+            cell_pointers_start = header_start + LEAF_PAGE_HEADER_SIZE
 
-        instance.cell_pointer_array = Page.__read_cell_pointers_from_file(
-            database_file, instance.cell_count
+        instance.cell_pointer_array = Page.__read_cell_pointers_from_buffer(
+            page_buffer, cell_pointers_start, instance.cell_count
         )
 
         return instance
 
-    def read_sqlite_schema(self, database_file: BinaryIO) -> List[Schema]:
+    def read_sqlite_schema(self, pager: Pager) -> List[Schema]:
         if self.page_type != PageType.LEAF_TABLE:
             raise TypeError("Cannot read sqlite schema if page isn't the first")
 
         schema_records = []
         for cell_pointer in self.cell_pointer_array:
-            # See https://saveriomiroddidatabase_file.github.io/SQLIte-database-file-format-diagrams/ for why the reads are done
-            database_file.seek(cell_pointer)
-
-            _header_size = read_varint(database_file)
-            row_id, _ = read_varint(database_file)
-            record = read_table_record(database_file)  # the number of columns is known
+            _row_id, payload = self.__read_table_cell_payload(pager, cell_pointer)
+            # the number of columns is known
+            record = read_payload_record(pager, payload)
             schema = Schema(
-                table_type=record[0].decode("utf-8"),
-                table_name=record[1].decode("utf-8"),
-                name=record[2].decode("utf-8"),
+                table_type=record[0],
+                name=record[1],
+                table_name=record[2],
                 rootpage=record[3],
                 sql=record[4],
             )
@@ -141,28 +172,29 @@ class Page:
 
         return schema_records
 
-    def load_table_leaf_pages(
-        self, database_file: BinaryIO, page_size: int, row_ids: List[int] = None
-    ) -> List[Page]:
+    def iter_table_leaf_pages(
+        self, pager: Pager, row_ids: List[int] = None
+    ) -> Iterator[Page]:
         """
-        Returns itself if it's a table leaf node already
-        or traverses the inner nodes to collect all leaf nodes.
+        Yields itself if it's a table leaf node already
+        or lazily traverses the inner nodes, yielding leaf nodes as they are reached.
 
         Args:
             row_ids (list(str)): list of row ids to filter by and only load those pages.
                 will load all pages in case nothing is provided
         """
         if self.page_type == PageType.LEAF_TABLE:
-            return [self]
+            yield self
+            return
 
         if self.page_type != PageType.INTERIOR_TABLE:
             raise TypeError(
                 f"Can only load table leaf pages if current page is an interior or leaf table page, but it is {self.page_type}"
             )
 
-        leaf_page_pointers = self.__read_interior_page_pointers(database_file)
-        pages = []
-        if not row_ids:
+        # copied as the cached pointers must not be mutated
+        leaf_page_pointers = list(self.__read_interior_page_pointers())
+        if row_ids is None:
             # Besides traversing all the nodes pointeb by this page, we must also traverse to itx
             # right side neighbour, which points row IDs > than any in this page
             leaf_page_pointers.append(InteriorPointer(self.right_most_pointer, -1))
@@ -170,59 +202,175 @@ class Page:
             # no row_ids means we didn't use an index, therefore we load all the data
             for pointer in leaf_page_pointers:
                 # We must make it recursive to handle tables which require multiple interior pages
-                pointed_page = load_page_at_location(
-                    database_file, pointer.page_index - 1, page_size
-                )
-                pages += pointed_page.load_table_leaf_pages(database_file, page_size)
+                pointed_page = load_page_at_location(pager, pointer.page_index - 1)
+                yield from pointed_page.iter_table_leaf_pages(pager)
         else:
-            # we used an index that already pointed us the row ids that fullfill this condition
-            # Therefore, we only need to load pages that contain any of those row_ids
-            # The strategy here is to check for each row_id if it falls inside the provided interval or not
+            # we used an index (or a row id predicate) that already pointed us the row ids that
+            # fullfill this condition. Therefore, we only need to load pages that contain any of those row_ids
+            # Each sorted row id is routed to its child by a binary search over the interior keys
+            # and row ids landing in the same child are grouped, keeping the children in order
             pages_idx_to_row_id = defaultdict(list)
-            i = 0
-            for pointer in leaf_page_pointers:
-                while i < len(row_ids):
-                    if row_ids[i] < pointer.smallest_row_id:
-                        pages_idx_to_row_id[pointer.page_index].append(row_ids[i])
-                        i += 1
-                    else:
-                        break
-            if i < len(row_ids):  # if there are row ids that do not fit inside
-                pages_idx_to_row_id[self.right_most_pointer] = row_ids[i:]
+            for row_id in row_ids:
+                pages_idx_to_row_id[self.__child_page_for_row_id(row_id)].append(row_id)
 
             for page_idx, row_ids in pages_idx_to_row_id.items():
-                pointed_page = pointed_page = load_page_at_location(
-                    database_file, page_idx - 1, page_size
-                )
-                pages += pointed_page.load_table_leaf_pages(
-                    database_file, page_size, row_ids
-                )
+                pointed_page = load_page_at_location(pager, page_idx - 1)
+                yield from pointed_page.iter_table_leaf_pages(pager, row_ids)
+
+    def iter_table_leaf_pages_in_range(
+        self, pager: Pager, key_range: KeyRange
+    ) -> Iterator[Page]:
+        """
+        Yields, in row id order, the leaf pages that may hold row ids inside the range.
+        Both bounds are located by binary search, so only the children overlapping
+        the range are visited. Leaves at the edges of the range also hold rows outside of it.
+        """
+        if self.page_type == PageType.LEAF_TABLE:
+            yield self
+            return
+
+        if self.page_type != PageType.INTERIOR_TABLE:
+            raise TypeError(
+                f"Can only load table leaf pages if current page is an interior or leaf table page, but it is {self.page_type}"
+            )
+
+        row_id_keys = self.__read_interior_row_id_keys()
+        first_child = (
+            0 if key_range.lower is None else bisect_left(row_id_keys, key_range.lower)
+        )
+        last_child = (
+            len(row_id_keys)
+            if key_range.upper is None
+            else bisect_left(row_id_keys, key_range.upper)
+        )
+
+        pointers = self.__read_interior_page_pointers()
+        for position in range(first_child, last_child + 1):
+            page_idx = (
+                pointers[position].page_index
+                if position < len(pointers)
+                else self.right_most_pointer
+            )
+            pointed_page = load_page_at_location(pager, page_idx - 1)
+            yield from pointed_page.iter_table_leaf_pages_in_range(pager, key_range)
+
+    def iter_table_leaf_page_indices(self, pager: Pager) -> Iterator[int]:
+        """
+        Yields the 0-based index of every table leaf page under this one, in row id order.
+        Only interior pages are parsed, leaves are recognized by their page type byte.
+        """
+        if self.page_type == PageType.LEAF_TABLE:
+            yield self.start // pager.page_size
+            return
+
+        if self.page_type != PageType.INTERIOR_TABLE:
+            raise TypeError(
+                f"Can only list table leaf pages if current page is an interior or leaf table page, but it is {self.page_type}"
+            )
 
-        return pages
-
-    # given a list of column names, reads the rows and returns the values as dicts
-    def read_records_with_schema(
-        self, database_file: BinaryIO, schema: List[str]
-    ) -> List[Dict[str, any]]:
-        records = self.__read_records(database_file)
-
-        res = []
-        for record in records:
-            if len(record) != len(schema):
-                raise TypeError(
-                    "Len of record does not match len of provided schema",
-                    len(record),
-                    len(schema),
-                    record,
-                    schema,
+        child_page_numbers = [
+            pointer.page_index for pointer in self.__read_interior_page_pointers()
+        ]
+        child_page_numbers.append(self.right_most_pointer)
+        pager.prefetch(page_number - 1 for page_number in child_page_numbers)
+
+        for page_number in child_page_numbers:
+            child_idx = page_number - 1
+            if pager.page(child_idx)[0] == PageType.LEAF_TABLE.value:
+                yield child_idx
+            else:
+                pointed_page = load_page_at_location(pager, child_idx)
+                yield from pointed_page.iter_table_leaf_page_indices(pager)
+
+    def iter_records_by_row_id(
+        self,
+        pager: Pager,
+        row_ids: Container[int],
+        columns: Optional[List[int]] = None,
+        real_columns: AbstractSet[int] = frozenset(),
+        defaults: Optional[Mapping[int, any]] = None,
+    ) -> Iterator[Tuple[int, Tuple[any, ...]]]:
+        """
+        Lazily reads the rows of this table leaf page whose row id is in "row_ids", along
+        with their row id. Other cells are skipped after reading their row id.
+        See iter_records for the arguments.
+        """
+        for cell_pointer in self.cell_pointer_array:
+            _, bytes_used = read_varint(self.data, cell_pointer)
+            row_id, _ = read_varint(self.data, cell_pointer + bytes_used)
+            if row_id in row_ids:
+                _, payload = self.__read_table_cell_payload(pager, cell_pointer)
+                count_records_decoded(1)
+                yield row_id, read_payload_record(
+                    pager, payload, row_id, columns, real_columns, defaults
                 )
-            res.append({key: value for (key, value) in zip(schema, record)})
 
-        return res
+    def count_table_rows(self, pager: Pager) -> int:
+        """
+        Counts the rows under this table page. Only interior pages are parsed,
+        the cell count of each leaf is read straight from its header.
+        """
+        return sum(
+            read_cell_count(pager, page_idx)
+            for page_idx in self.iter_table_leaf_page_indices(pager)
+        )
+
+    def iter_records(
+        self,
+        pager: Pager,
+        columns: Optional[List[int]] = None,
+        real_columns: AbstractSet[int] = frozenset(),
+        defaults: Optional[Mapping[int, any]] = None,
+    ) -> Iterator[List[any]]:
+        """
+        Lazily reads the rows of this table leaf page.
+
+        Args:
+            columns (list(int)): ordinals of the columns to decode, see read_table_record.
+                Rows are then compact tuples holding only those columns, in that order.
+            real_columns (set(int)): ordinals of the REAL affinity columns, whose
+                integers are read as floats (TableInfo.real_ordinals)
+            defaults (dict(int, any)): default value of the columns by ordinal, for
+                records written before they were added (TableInfo.default_ordinals)
+        """
+        is_profiled = active_profile() is not None
+        for cell_pointer in self.cell_pointer_array:
+            row_id, payload = self.__read_table_cell_payload(pager, cell_pointer)
+            if is_profiled:
+                count_records_decoded(1)
+            yield read_payload_record(
+                pager, payload, row_id, columns, real_columns, defaults
+            )
 
     def load_filter_compliant_row_ids(
-        self, database_file: BinaryIO, value_filter: ValueFilter, page_size: int
+        self,
+        pager: Pager,
+        key_ranges: List[KeyRange],
+        collations: Sequence[str] = (DEFAULT_COLLATION,),
     ) -> List[int]:
+        """
+        Returns the sorted row ids of the index entries in the key ranges (see
+        ValueFilter.key_ranges), by seeking to the lower bound of each range and
+        walking forward up to its upper bound.
+        """
+        row_ids = sorted(
+            key[-1]
+            for key in self.iter_filter_compliant_keys(pager, key_ranges, collations)
+        )
+        return list(dict.fromkeys(row_ids))
+
+    def iter_filter_compliant_keys(
+        self,
+        pager: Pager,
+        key_ranges: List[KeyRange],
+        collations: Sequence[str] = (DEFAULT_COLLATION,),
+    ) -> Iterator[Tuple[any, ...]]:
+        """
+        Lazily yields, in index order, the full keys (indexed columns then row id) of the
+        index entries in the key ranges, the indexed columns being sorted with the
+        "collations" collating sequences.
+        Queries only needing those columns can be answered without reading the table.
+        """
         if (
             self.page_type != PageType.INTERIOR_INDEX
             and self.page_type != PageType.LEAF_INDEX
@@ -232,110 +380,304 @@ class Page:
                 self.page_type,
             )
 
-        row_ids = []
-        index_records = self.__read_index_records(database_file)
-        if self.page_type == PageType.LEAF_INDEX:
-            row_ids = [
-                index_record.row_id
-                for index_record in index_records
-                if index_record.value == value_filter.value
-            ]
-        else:
-            # binary search now
-            # if first value in node is > than our value, fallback to first left pointer
-            # else, search for any match and follow those nodes
-            #   NOTE: a match can be an equality or our value falling between the values of two records
-            # else, traverse to the right_most pointer
-            page_indices_to_query = []
-            for i, record in enumerate(index_records):
-                if record.value == value_filter.value:
-                    row_ids.append(record.row_id)
-                    page_indices_to_query.append(record.left_pointer)
-                elif i >= 1:
-                    if (
-                        index_records[i - 1].value  # to handle NULLS
-                        and index_records[i - 1].value < value_filter.value
-                        and index_records[i].value
-                        and index_records[i].value > value_filter.value
-                    ):
-                        page_indices_to_query.append(index_records[i].left_pointer)
-
-            if not page_indices_to_query:
-                if index_records[0].value > value_filter.value:
-                    page_indices_to_query = [index_records[0].left_pointer]
-                else:
-                    page_indices_to_query = [self.right_most_pointer]
-
-            for page_idx in page_indices_to_query:
-                pointed_page = load_page_at_location(
-                    database_file, page_idx - 1, page_size
+        for record in self.iter_index_ranges(pager, key_ranges, collations):
+            yield record.key
+
+    def count_index_keys(
+        self,
+        pager: Pager,
+        key_ranges: List[KeyRange],
+        matches: Callable[[Tuple[any, ...]], bool],
+        collations: Sequence[str] = (DEFAULT_COLLATION,),
+    ) -> int:
+        """
+        Counts the index entries under this page whose key falls in the ranges and
+        satisfies the filter ("matches", bound to the index columns, see
+        RowFilter.bind), walking the same pages as iter_index_ranges.
+        """
+        index_order = IndexOrder(collations, pager.text_encoding)
+        return sum(
+            self.__count_search_range(
+                pager,
+                search_range,
+                index_order.key_prefix(search_range.width),
+                matches,
+            )
+            for search_range in index_order.search_ranges(key_ranges)
+        )
+
+    def iter_index_keys(self, pager: Pager) -> Iterator[Tuple[any, ...]]:
+        """
+        Lazily yields the full key of every entry under this index page, in index order
+        (NULLs first), by an in-order walk of the b-tree
+        """
+        is_interior = self.page_type == PageType.INTERIOR_INDEX
+        for record in self.__read_index_records(pager):
+            if is_interior:
+                pointed_page = load_page_at_location(pager, record.left_pointer - 1)
+                yield from pointed_page.iter_index_keys(pager)
+            yield record.key
+
+        if is_interior:
+            pointed_page = load_page_at_location(pager, self.right_most_pointer - 1)
+            yield from pointed_page.iter_index_keys(pager)
+
+    def first_index_record(self, pager: Pager) -> Optional[IndexRecord]:
+        """
+        Smallest non NULL entry under this index page (NULLs sort first in indexes)
+        """
+        every_key = KeyRange(None, False, None, False)
+        return next(self.iter_index_ranges(pager, [every_key]), None)
+
+    def last_index_record(self, pager: Pager) -> Optional[IndexRecord]:
+        """
+        Largest entry under this index page: the last cell of its right most leaf
+        """
+        page = self
+        while page.page_type == PageType.INTERIOR_INDEX:
+            page = load_page_at_location(pager, page.right_most_pointer - 1)
+
+        if not page.cell_count:
+            return None
+
+        return page.__read_index_record(pager, page.cell_pointer_array[-1])
+
+    def iter_index_ranges(
+        self,
+        pager: Pager,
+        key_ranges: List[KeyRange],
+        collations: Sequence[str] = (DEFAULT_COLLATION,),
+    ) -> Iterator[IndexRecord]:
+        """
+        Yields, in key order and each once, the index records under this page whose
+        leading values fall in one of the ranges. Keys are compared like the b-tree
+        sorts them, column by column with the collating sequence of each, see
+        IndexOrder.
+        """
+        index_order = IndexOrder(collations, pager.text_encoding)
+        for search_range in index_order.search_ranges(key_ranges):
+            yield from self.__iter_search_range(
+                pager, search_range, index_order.key_prefix(search_range.width)
+            )
+
+    def __iter_search_range(
+        self,
+        pager: Pager,
+        search_range: SearchRange,
+        key_prefix: Callable[[Tuple[any, ...]], Tuple[Tuple[int, any], ...]],
+    ) -> Iterator[IndexRecord]:
+        """
+        Index b-trees keep entries in interior cells too: the left child of a cell holds
+        keys <= the cell's key, and the right most pointer keys >= the last cell's key.
+        The walk starts at the first cell not below the range, found by binary search,
+        so children whose keys all sort outside the range are never loaded.
+        """
+        is_interior = self.page_type == PageType.INTERIOR_INDEX
+        start = self.__search_index_cells(pager, search_range, key_prefix)
+        for position in range(start, self.cell_count):
+            record = self.__index_record_at(pager, position)
+            if is_interior:
+                pointed_page = load_page_at_location(pager, record.left_pointer - 1)
+                yield from pointed_page.__iter_search_range(
+                    pager, search_range, key_prefix
                 )
-                row_ids += pointed_page.load_filter_compliant_row_ids(
-                    database_file, value_filter, page_size
+
+            if search_range.is_above(key_prefix(record.key)):
+                # every following cell and child sorts after the range
+                return
+
+            yield record
+
+        if is_interior:
+            pointed_page = load_page_at_location(pager, self.right_most_pointer - 1)
+            yield from pointed_page.__iter_search_range(pager, search_range, key_prefix)
+
+    def __count_search_range(
+        self,
+        pager: Pager,
+        search_range: SearchRange,
+        key_prefix: Callable[[Tuple[any, ...]], Tuple[Tuple[int, any], ...]],
+        matches: Callable[[Tuple[any, ...]], bool],
+    ) -> int:
+        """
+        Leaf pages whose first and last keys are inside the range, with numbers in every
+        column the range bounds, only hold such keys: they are counted from their
+        header without decoding the other keys.
+        """
+        if self.page_type == PageType.LEAF_INDEX and self.cell_count:
+            first_record = self.__index_record_at(pager, 0)
+            last_record = self.__index_record_at(pager, self.cell_count - 1)
+            first_key = key_prefix(first_record.key)
+            last_key = key_prefix(last_record.key)
+            if (
+                all(column_key[0] == 1 for column_key in first_key + last_key)
+                and not search_range.is_below(first_key)
+                and not search_range.is_above(last_key)
+            ):
+                return self.cell_count
+
+        is_interior = self.page_type == PageType.INTERIOR_INDEX
+        count = 0
+        start = self.__search_index_cells(pager, search_range, key_prefix)
+        for position in range(start, self.cell_count):
+            record = self.__index_record_at(pager, position)
+            if is_interior:
+                pointed_page = load_page_at_location(pager, record.left_pointer - 1)
+                count += pointed_page.__count_search_range(
+                    pager, search_range, key_prefix, matches
                 )
 
-        row_ids = sorted(row_ids)
-        return list(dict.fromkeys(row_ids))
+            if search_range.is_above(key_prefix(record.key)):
+                return count
 
-    #  The cell pointer array consists of K 2-byte integer offsets to the cell contents.
-    @staticmethod
-    def __read_cell_pointers_from_file(
-        database_file: BinaryIO, cell_count: int
-    ) -> List[int]:
-        return [int.from_bytes(database_file.read(2), "big") for _ in range(cell_count)]
+            if matches(record.key):
+                count += 1
 
-    def __read_records(self, database_file: BinaryIO) -> List[List[any]]:
-        records = []
-        for cell_pointer in self.cell_pointer_array:
-            database_file.seek(self.start + cell_pointer)
+        if is_interior:
+            pointed_page = load_page_at_location(pager, self.right_most_pointer - 1)
+            count += pointed_page.__count_search_range(
+                pager, search_range, key_prefix, matches
+            )
 
-            # See https://saveriomiroddi.github.io/SQLIte-database-file-format-diagrams/ for why the reads are done
-            _header_size, _ = read_varint(database_file)
-            row_id, count = read_varint(database_file)
-            record = read_table_record(database_file, row_id)
+        return count
 
-            records.append(record)
+    def __search_index_cells(
+        self,
+        pager: Pager,
+        search_range: SearchRange,
+        key_prefix: Callable[[Tuple[any, ...]], Tuple[Tuple[int, any], ...]],
+    ) -> int:
+        """
+        Position of the first cell of this index page whose key is not below the range,
+        by binary search over the cell pointer array: only the probed cells are decoded
+        """
+        low, high = 0, self.cell_count
+        while low < high:
+            middle = (low + high) // 2
+            record = self.__index_record_at(pager, middle)
+            if search_range.is_below(key_prefix(record.key)):
+                low = middle + 1
+            else:
+                high = middle
 
-        return records
+        return low
+
+    #  The cell pointer array consists of K 2-byte integer offsets to the cell contents.
+    @staticmethod
+    def __read_cell_pointers_from_buffer(
+        page_buffer: memoryview, start: int, cell_count: int
+    ) -> List[int]:
+        return [
+            int.from_bytes(page_buffer[offset : offset + 2], "big")
+            for offset in range(start, start + 2 * cell_count, 2)
+        ]
+
+    def __read_table_cell_payload(
+        self, pager: Pager, cell_pointer: int
+    ) -> Tuple[int, CellPayload]:
+        # See https://saveriomiroddi.github.io/SQLIte-database-file-format-diagrams/ for why the reads are done
+        payload_size, offset = read_varint(self.data, cell_pointer)
+        offset += cell_pointer
+        row_id, bytes_used = read_varint(self.data, offset)
+        offset += bytes_used
+
+        payload = CellPayload.from_cell(
+            pager, self.data, offset, payload_size, is_index=False
+        )
+        return row_id, payload
+
+    def __read_interior_page_pointers(self) -> List[InteriorPointer]:
+        if self.interior_pointers is not None:
+            return self.interior_pointers
 
-    def __read_interior_page_pointers(
-        self, database_file: BinaryIO
-    ) -> List[InteriorPointer]:
         pointers = []
         for cell_pointer in self.cell_pointer_array:
-            database_file.seek(self.start + cell_pointer)
-
             # See https://saveriomiroddi.github.io/SQLIte-database-file-format-diagrams/ for why the reads are done
-            page_index = int.from_bytes(database_file.read(4), byteorder="big")
-            row_id = read_varint(database_file)[0]
+            page_index = int.from_bytes(
+                self.data[cell_pointer : cell_pointer + 4], byteorder="big"
+            )
+            row_id = read_varint(self.data, cell_pointer + 4)[0]
             pointers.append(InteriorPointer(page_index, row_id))
         # return sorted(pointers, key=lambda cell: cell.smallest_row_id)
+        self.interior_pointers = pointers
         return pointers
 
-    def __read_index_records(self, database_file: BinaryIO) -> List[IndexRecord]:
-        records = []
-        for i, cell_pointer in enumerate(self.cell_pointer_array):
-            database_file.seek(self.start + cell_pointer)
-            # See https://saveriomiroddi.github.io/SQLIte-database-file-format-diagrams/ for why the reads are done
-            left_child_pointer = None
-            if self.page_type == PageType.INTERIOR_INDEX:
-                left_child_pointer = int.from_bytes(database_file.read(4), "big")
+    def __read_interior_row_id_keys(self) -> List[int]:
+        if self.interior_row_id_keys is None:
+            self.interior_row_id_keys = [
+                pointer.smallest_row_id
+                for pointer in self.__read_interior_page_pointers()
+            ]
 
-            _payload_bytes_size = read_varint(database_file)
-            record = read_table_record(database_file)
-            value = record[0]
-            if isinstance(value, bytes):
-                value = value.decode("utf-8")
+        return self.interior_row_id_keys
+
+    def __child_page_for_row_id(self, row_id: int) -> int:
+        """
+        Page number of the child responsible for the row id, found by binary search
+        """
+        row_id_keys = self.__read_interior_row_id_keys()
+        position = bisect_left(row_id_keys, row_id)
+        if position == len(row_id_keys):
+            return self.right_most_pointer
+
+        return self.__read_interior_page_pointers()[position].page_index
+
+    def __read_index_records(self, pager: Pager) -> List[IndexRecord]:
+        if self.index_records is None or None in self.index_records:
+            for position in range(self.cell_count):
+                self.__index_record_at(pager, position)
+
+        return self.index_records
+
+    def __index_record_at(self, pager: Pager, position: int) -> IndexRecord:
+        if self.index_records is None:
+            self.index_records = [None] * self.cell_count
+
+        record = self.index_records[position]
+        if record is None:
+            record = self.__read_index_record(pager, self.cell_pointer_array[position])
+            self.index_records[position] = record
+            count_records_decoded(1)
+
+        return record
+
+    def __read_index_record(self, pager: Pager, cell_pointer: int) -> IndexRecord:
+        offset = cell_pointer
+        # See https://saveriomiroddi.github.io/SQLIte-database-file-format-diagrams/ for why the reads are done
+        left_child_pointer = None
+        if self.page_type == PageType.INTERIOR_INDEX:
+            left_child_pointer = int.from_bytes(self.data[offset : offset + 4], "big")
+            offset += 4
+
+        payload_size, bytes_used = read_varint(self.data, offset)
+        payload = CellPayload.from_cell(
+            pager, self.data, offset + bytes_used, payload_size, is_index=True
+        )
+        record = read_payload_record(pager, payload)
+        # the row id is the last column of the key, after every indexed column
+        return IndexRecord(record[0], record[-1], tuple(record), left_child_pointer)
 
-            records.append(IndexRecord(value, record[1], left_child_pointer))
 
-        return records
+def load_page_at_location(pager: Pager, page_idx: int) -> Page:
+    page = pager.page_cache.get(page_idx)
+    if page is None:
+        page_location = page_start(page_idx, pager.page_size)
+        page = Page.from_buffer(
+            pager.page(page_idx), page_location, is_first_page=page_idx == 0
+        )
+        pager.page_cache.put(page_idx, page)
 
+    count_page_read(PAGE_KINDS[page.page_type], pager.page_size)
+    return page
 
-def load_page_at_location(database_file, page_idx: int, page_size: int) -> [Page]:
-    page_location = page_start(page_idx, page_size)
 
-    database_file.seek(page_location)
-    # page_bytes = bytearray(database_file.read(page_size))
+def read_cell_count(pager: Pager, page_idx: int) -> int:
+    """
+    Number of cells of a b-tree page, read from its header without parsing the page
+    """
+    header_start = page_start(page_idx, pager.page_size)
+    if page_idx == 0:
+        header_start += DB_FILE_HEADER_SIZE
 
-    return Page.from_file(database_file, page_location)
+    count_page_read("page header", LEAF_PAGE_HEADER_SIZE)
+    return int.from_bytes(pager.buffer[header_start + 3 : header_start + 5], "big")
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+from app.consts import PARALLEL_CHUNKS_PER_WORKER
+from app.filtering import RowFilter
+from app.pager import Pager
+from app.pages import load_page_at_location, read_cell_count
+
+from typing import List, Optional, Iterator, Tuple, Dict, FrozenSet, Mapping
+
+# Each worker process maps the database itself, see _open_worker_pager
+_worker_pager: Optional[Pager] = None
+
+
+def _open_worker_pager(database_file_path: str):
+    global _worker_pager
+    _worker_pager = Pager(database_file_path)
+
+
+def _scan_chunk(
+    task: Tuple[
+        List[int],
+        List[int],
+        FrozenSet[int],
+        Mapping[int, any],
+        Optional[RowFilter],
+        Optional[Dict[str, int]],
+    ]
+) -> List[Tuple[any, ...]]:
+    (
+        leaf_page_indices,
+        column_ordinals,
+        real_columns,
+        defaults,
+        value_filter,
+        filter_positions,
+    ) = task
+    # the filter is bound here, functions can't be sent to the workers
+    row_filter = value_filter.bind(filter_positions.__getitem__) if value_filter else None
+
+    rows = []
+    for page_idx in leaf_page_indices:
+        page = load_page_at_location(_worker_pager, page_idx)
+        for row in page.iter_records(
+            _worker_pager, column_ordinals, real_columns, defaults
+        ):
+            if row_filter is None or row_filter(row):
+                rows.append(row)
+
+    return rows
+
+
+def _count_chunk(leaf_page_indices: List[int]) -> int:
+    return sum(read_cell_count(_worker_pager, page_idx) for page_idx in leaf_page_indices)
+
+
+def split_into_chunks(items: List[int], workers: int) -> List[List[int]]:
+    """
+    Splits the items into contiguous chunks, a few per worker so a slow chunk
+    doesn't leave the other workers idle. Chunk order preserves item order.
+    """
+    chunk_count = max(1, min(len(items), workers * PARALLEL_CHUNKS_PER_WORKER))
+    chunk_size = -(-len(items) // chunk_count)  # ceil division
+
+    return [items[i : i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+
+def parallel_scan(
+    database_file_path: str,
+    leaf_page_indices: List[int],
+    column_ordinals: List[int],
+    real_columns: FrozenSet[int],
+    defaults: Mapping[int, any],
+    value_filter: Optional[RowFilter],
+    filter_positions: Optional[Dict[str, int]],
+    workers: int,
+) -> Iterator[Tuple[any, ...]]:
+    """
+    Decodes and filters the given table leaf pages in a pool of "workers" processes,
+    the columns of the filter being found in rows at "filter_positions".
+    See Page.iter_records for "column_ordinals", "real_columns" and "defaults".
+
+    The leaf pages must be in row id order: chunks are contiguous runs of them and
+    results are yielded chunk by chunk in submission order, so rows come out in row id order.
+    """
+    chunks = split_into_chunks(leaf_page_indices, workers)
+    tasks = [
+        (chunk, column_ordinals, real_columns, defaults, value_filter, filter_positions)
+        for chunk in chunks
+    ]
+
+    # multiprocessing is slow to import, it is only loaded by queries using workers
+    from multiprocessing import Pool
+
+    # Leaving the pool terminates the workers, including when the consumer stops early
+    with Pool(workers, _open_worker_pager, (database_file_path,)) as pool:
+        for rows in pool.imap(_scan_chunk, tasks):
+            yield from rows
+
+
+def parallel_count(
+    database_file_path: str, leaf_page_indices: List[int], workers: int
+) -> int:
+    """
+    Adds up the cell counts of the given table leaf pages in a pool of "workers" processes.
+    """
+    from multiprocessing import Pool
+
+    chunks = split_into_chunks(leaf_page_indices, workers)
+    with Pool(workers, _open_worker_pager, (database_file_path,)) as pool:
+        return sum(pool.imap_unordered(_count_chunk, chunks))
@@ -0,0 +1,327 @@
+"""
+Recursive descent parser for the supported SELECT grammar:
+
+    SELECT <item>, ... FROM <table> [[AS] <alias>]
+        [[INNER | LEFT [OUTER]] JOIN <table> [[AS] <alias>] ON <column> = <column>]
+        [WHERE <condition>]
+        [GROUP BY <column>, ...]
+        [ORDER BY <column> | <aggregate> | <position> [ASC | DESC], ...]
+        [LIMIT <integer>]
+
+where an item is a column, "qualifier.column", "*" or an aggregate like COUNT(*),
+and a condition combines comparisons with AND, OR, NOT and parentheses:
+
+    <column> <operator> <literal> | <column> [NOT] BETWEEN <literal> AND <literal>
+    | <column> [NOT] IN (<literal>, ...) | <column> [NOT] LIKE '<pattern>'
+    | <column> IS [NOT] NULL
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+
+from app.aggregation import Aggregate, SUPPORTED_AGGREGATES
+from app.filtering import RowFilter, ValueFilter, AndFilter, OrFilter, NotFilter
+from app.joins import Join, JOIN_KINDS
+from app.sorting import OrderTerm
+from app.tokenizer import TokenStream
+
+from typing import List, Optional, Union
+
+# Words ending a select item or a table name, which can't be read as an alias
+CLAUSE_KEYWORDS = {
+    "FROM",
+    "WHERE",
+    "GROUP",
+    "ORDER",
+    "LIMIT",
+    "JOIN",
+    "INNER",
+    "LEFT",
+    "OUTER",
+    "CROSS",
+    "NATURAL",
+    "ON",
+    "USING",
+    "AS",
+    "ASC",
+    "DESC",
+    "AND",
+    "BETWEEN",
+    "IN",
+    "OR",
+    "NOT",
+    "IS",
+    "LIKE",
+}
+
+
+@dataclass
+class SelectStatement:
+    # output columns, in order. "*" stands for every column, see Query.expand_star
+    select_list: List[Union[str, Aggregate]]
+    table_name: str
+    table_alias: Optional[str]
+    join: Optional[Join]
+    value_filter: Optional[RowFilter]
+    group_by: List[str]
+    order_by: List[OrderTerm]
+    limit: Optional[int]
+
+
+def parse_select(sql: str) -> SelectStatement:
+    tokens = TokenStream(sql)
+    if not tokens.accept_keyword("SELECT"):
+        raise TypeError("Only SELECT queries are supported")
+
+    select_list = _parse_select_list(tokens)
+    tokens.expect_keyword("FROM")
+    table_name = tokens.expect_identifier()
+    table_alias = _parse_alias(tokens)
+    join = _parse_join(tokens)
+
+    value_filter = None
+    if tokens.accept_keyword("WHERE"):
+        value_filter = _parse_or(tokens)
+
+    group_by = []
+    if tokens.accept_keyword("GROUP", "BY"):
+        group_by.append(_parse_column_reference(tokens))
+        while tokens.accept(","):
+            group_by.append(_parse_column_reference(tokens))
+
+    order_by = []
+    if tokens.accept_keyword("ORDER", "BY"):
+        order_by.append(_parse_order_term(tokens, select_list))
+        while tokens.accept(","):
+            order_by.append(_parse_order_term(tokens, select_list))
+
+    limit = None
+    if tokens.accept_keyword("LIMIT"):
+        token = tokens.next()
+        if token.kind != "number" or not token.value.isdigit():
+            raise RuntimeError(f"Failed to extract limit from query {sql!r}")
+        limit = int(token.value)
+
+    tokens.accept(";")
+    if not tokens.at_end():
+        raise tokens.error("Unsupported clause")
+
+    return SelectStatement(
+        select_list, table_name, table_alias, join, value_filter, group_by, order_by, limit
+    )
+
+
+def _parse_select_list(tokens: TokenStream) -> List[Union[str, Aggregate]]:
+    select_list = []
+    while True:
+        if tokens.accept("*"):
+            select_list.append("*")
+        else:
+            select_list.append(_parse_select_item(tokens))
+            _parse_alias(tokens)  # output names aren't used
+        if not tokens.accept(","):
+            return select_list
+
+
+def _parse_select_item(tokens: TokenStream) -> Union[str, Aggregate]:
+    next_token = tokens.peek(1)
+    if (
+        next_token is not None
+        and next_token.kind == "punctuation"
+        and next_token.value == "("
+    ):
+        return _parse_aggregate(tokens)
+
+    return _parse_column_reference(tokens)
+
+
+def _parse_aggregate(tokens: TokenStream) -> Aggregate:
+    """
+    COUNT(*), COUNT(<column>), SUM(<column>), AVG(<column>), MIN(<column>) or MAX(<column>)
+    """
+    name = tokens.expect_identifier().upper()
+    if name not in SUPPORTED_AGGREGATES:
+        raise TypeError(f"Function '{name}' is not yet supported")
+
+    tokens.expect("(")
+    if name == "COUNT" and tokens.accept("*"):
+        column = None
+    elif tokens.accept(")"):
+        raise TypeError(f"Expected a column in {name}()")
+    else:
+        column = _parse_column_reference(tokens)
+    tokens.expect(")")
+
+    return Aggregate(name, column)
+
+
+def _parse_column_reference(tokens: TokenStream) -> str:
+    """
+    "column", or "qualifier.column" when qualified by a table name or alias
+    """
+    name = tokens.expect_identifier()
+    if tokens.accept("."):
+        return f"{name}.{tokens.expect_identifier()}"
+
+    return name
+
+
+def _parse_alias(tokens: TokenStream) -> Optional[str]:
+    if tokens.accept_keyword("AS"):
+        return tokens.expect_identifier()
+
+    token = tokens.peek()
+    if token is not None and token.is_identifier and token.upper not in CLAUSE_KEYWORDS:
+        tokens.next()
+        return token.value
+
+    return None
+
+
+def _parse_join(tokens: TokenStream) -> Optional[Join]:
+    for words in sorted(JOIN_KINDS, key=len, reverse=True):
+        if tokens.accept_keyword(*words.split()):
+            kind = JOIN_KINDS[words]
+            break
+    else:
+        if tokens.at_keyword("CROSS") or tokens.at_keyword("NATURAL") or tokens.accept(","):
+            raise tokens.error(
+                "Only <table> JOIN <table> ON <column> = <column> joins are supported"
+            )
+        return None
+
+    table_name = tokens.expect_identifier()
+    alias = _parse_alias(tokens)
+    tokens.expect_keyword("ON")
+    left = _parse_column_reference(tokens)
+    tokens.expect("=")
+    right = _parse_column_reference(tokens)
+
+    return Join(kind, table_name, alias, (left, right))
+
+
+def _parse_or(tokens: TokenStream) -> RowFilter:
+    operands = [_parse_and(tokens)]
+    while tokens.accept_keyword("OR"):
+        operands.append(_parse_and(tokens))
+
+    return operands[0] if len(operands) == 1 else OrFilter(operands)
+
+
+def _parse_and(tokens: TokenStream) -> RowFilter:
+    operands = [_parse_not(tokens)]
+    while tokens.accept_keyword("AND"):
+        operands.append(_parse_not(tokens))
+
+    return operands[0] if len(operands) == 1 else AndFilter(operands)
+
+
+def _parse_not(tokens: TokenStream) -> RowFilter:
+    if tokens.accept_keyword("NOT"):
+        return NotFilter(_parse_not(tokens))
+
+    if tokens.accept("("):
+        condition = _parse_or(tokens)
+        tokens.expect(")")
+        return condition
+
+    return _parse_comparison(tokens)
+
+
+def _parse_comparison(tokens: TokenStream) -> RowFilter:
+    column = _parse_column_reference(tokens)
+
+    if tokens.accept_keyword("IS"):
+        is_negated = tokens.accept_keyword("NOT")
+        tokens.expect_keyword("NULL")
+        return ValueFilter(column, "IS NOT NULL" if is_negated else "IS NULL", None)
+
+    if tokens.accept_keyword("NOT"):
+        if not (
+            tokens.at_keyword("BETWEEN")
+            or tokens.at_keyword("IN")
+            or tokens.at_keyword("LIKE")
+        ):
+            raise tokens.error("Expected BETWEEN, IN or LIKE")
+        return NotFilter(_parse_predicate(tokens, column))
+
+    return _parse_predicate(tokens, column)
+
+
+def _parse_predicate(tokens: TokenStream, column: str) -> ValueFilter:
+    """
+    The part of a comparison following its column
+    """
+    if tokens.accept_keyword("LIKE"):
+        pattern = _parse_literal(tokens)
+        if not isinstance(pattern, str):
+            raise tokens.error("Expected a 'pattern' after LIKE")
+        return ValueFilter(column, "LIKE", pattern)
+
+    if tokens.accept_keyword("BETWEEN"):
+        lower = _parse_literal(tokens)
+        tokens.expect_keyword("AND")
+        return ValueFilter(column, "BETWEEN", (lower, _parse_literal(tokens)))
+
+    if tokens.accept_keyword("IN"):
+        tokens.expect("(")
+        candidates = [_parse_literal(tokens)]
+        while tokens.accept(","):
+            candidates.append(_parse_literal(tokens))
+        tokens.expect(")")
+        return ValueFilter(column, "IN", tuple(candidates))
+
+    token = tokens.next()
+    if token.kind != "operator":
+        raise tokens.error("Expected a comparison")
+
+    return ValueFilter(column, token.value, _parse_literal(tokens))
+
+
+def _parse_literal(tokens: TokenStream) -> any:
+    """
+    A number, a 'string' or NULL. Double-quoted words are read as strings, like
+    SQLite does when they don't name a column.
+    """
+    sign = -1 if tokens.accept("-") else 1
+    if sign == 1:
+        tokens.accept("+")
+
+    token = tokens.next()
+    if token.kind == "number":
+        is_integer = token.value.isdigit()
+        return sign * (int(token.value) if is_integer else float(token.value))
+    if sign == 1 and token.kind in ("string", "quoted"):
+        return token.value
+    if sign == 1 and token.upper == "NULL":
+        return None
+
+    tokens.position -= 1
+    raise tokens.error("Expected a literal")
+
+
+def _parse_order_term(
+    tokens: TokenStream, select_list: List[Union[str, Aggregate]]
+) -> OrderTerm:
+    """
+    A column, an aggregate or the 1-based position of a selected item, then ASC or DESC
+    """
+    token = tokens.peek()
+    if token is not None and token.kind == "number":
+        tokens.next()
+        position = int(token.value) if token.value.isdigit() else 0
+        if "*" in select_list[:position]:
+            # the columns "*" stands for are only known once the table is
+            raise ValueError(f"ORDER BY term {token.value} can't follow a '*' item")
+        if not 1 <= position <= len(select_list):
+            raise ValueError(f"ORDER BY term {token.value} is not in the select list")
+        item = select_list[position - 1]
+    else:
+        item = _parse_select_item(tokens)
+        if isinstance(item, Aggregate) and item not in select_list:
+            raise ValueError(f"ORDER BY {item} must also be selected")
+
+    descending = tokens.accept_keyword("DESC")
+    if not descending:
+        tokens.accept_keyword("ASC")
+
+    return OrderTerm(item, descending)
@@ -0,0 +1,221 @@
+"""
+Per-stage counters of a query run, for EXPLAIN and .profile.
+
+Stages are the steps of the generator pipeline (scan, filter, join, sort, ...),
+registered with profile_stage(). While a stage produces a row it is the active one,
+and the pages read and records decoded meanwhile are accounted to it. Counters are
+only collected inside a QueryProfile block, everywhere else the hooks cost a
+context variable lookup:
+
+    with QueryProfile() as profile:
+        rows = list(query.iter_results(pager, catalog))
+    profile.to_dict()
+
+Pages read by --workers processes are not seen by the profile.
+"""
+from __future__ import annotations
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from typing import Dict, List, Optional, Iterable, Iterator
+
+# Profile collecting the counters of the running query, if any. A context variable
+# keeps queries running concurrently in the server threads apart.
+_active_profile: ContextVar[Optional[QueryProfile]] = ContextVar(
+    "active_profile", default=None
+)
+
+
+@dataclass
+class StageStats:
+    name: str
+    is_filter: bool = False  # rows in minus rows out were filtered out
+    parent: Optional[StageStats] = None  # stage consuming the rows of this one
+    children: List[StageStats] = field(default_factory=list)
+    pages_read: Counter = field(default_factory=Counter)  # by page kind
+    bytes_read: int = 0
+    records_decoded: int = 0  # table rows and index keys
+    rows_out: int = 0
+    seconds: float = 0.0  # including the time spent in the stages feeding this one
+    is_pulled: bool = False
+
+    @property
+    def rows_in(self) -> int:
+        return sum(child.rows_out for child in self.children)
+
+    @property
+    def self_seconds(self) -> float:
+        return self.seconds - sum(child.seconds for child in self.children)
+
+    def to_dict(self) -> Dict[str, any]:
+        stats = {
+            "stage": self.name,
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            "rows_filtered_out": self.rows_in - self.rows_out if self.is_filter else 0,
+            "records_decoded": self.records_decoded,
+            "pages_read": dict(self.pages_read),
+            "bytes_read": self.bytes_read,
+            "seconds": self.seconds,
+            "self_seconds": self.self_seconds,
+        }
+        stats["children"] = [child.to_dict() for child in self.children]
+        return stats
+
+
+class QueryProfile:
+    """
+    Counters of the stages run while the profile is active (inside a "with" block).
+    Stages form a tree rooted at the stages no other stage consumes.
+    """
+
+    stages: List[StageStats]
+    active_stages: List[StageStats]  # stack of the stages producing a row right now
+    seconds: float
+
+    def __init__(self):
+        self.stages = []
+        self.active_stages = []
+        self.seconds = 0.0
+        self._token = None
+        self._start = None
+
+    def __enter__(self) -> QueryProfile:
+        self._token = _active_profile.set(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds += time.perf_counter() - self._start
+        _active_profile.reset(self._token)
+
+    @property
+    def roots(self) -> List[StageStats]:
+        return [stage for stage in self.stages if stage.parent is None]
+
+    def current_stage(self) -> Optional[StageStats]:
+        return self.active_stages[-1] if self.active_stages else None
+
+    def to_dict(self) -> Dict[str, any]:
+        return {
+            "seconds": self.seconds,
+            "stages": [stage.to_dict() for stage in self.roots],
+        }
+
+    def format(self) -> List[str]:
+        """
+        The stage tree, one line per stage, consumers above the stages feeding them
+        """
+        lines = [f"total: {self.seconds * 1000:.2f}ms"]
+        for root in self.roots:
+            lines += _format_stage(root, 0)
+        return lines
+
+
+def _format_stage(stage: StageStats, depth: int) -> List[str]:
+    details = [f"rows out={stage.rows_out}"]
+    if stage.is_filter:
+        details.append(f"filtered out={stage.rows_in - stage.rows_out}")
+    if stage.records_decoded:
+        details.append(f"decoded={stage.records_decoded}")
+    if stage.pages_read:
+        pages = ", ".join(f"{kind}={count}" for kind, count in stage.pages_read.items())
+        details.append(f"pages: {pages} ({stage.bytes_read} bytes)")
+    details.append(
+        f"{stage.seconds * 1000:.2f}ms (self {stage.self_seconds * 1000:.2f}ms)"
+    )
+
+    lines = [f"{'  ' * depth}{stage.name}: {'; '.join(details)}"]
+    for child in stage.children:
+        lines += _format_stage(child, depth + 1)
+    return lines
+
+
+def active_profile() -> Optional[QueryProfile]:
+    return _active_profile.get()
+
+
+def profile_stage(
+    name: str, rows: Iterable[any], is_filter: bool = False
+) -> Iterable[any]:
+    """
+    Registers the rows as produced by a stage of the running profile. Returns the
+    rows untouched when no profile is active.
+    """
+    profile = _active_profile.get()
+    if profile is None:
+        return rows
+
+    stage = StageStats(name, is_filter)
+    profile.stages.append(stage)
+    return _iter_stage_rows(profile, stage, iter(rows))
+
+
+def _iter_stage_rows(
+    profile: QueryProfile, stage: StageStats, rows: Iterator[any]
+) -> Iterator[any]:
+    active_stages = profile.active_stages
+    while True:
+        if not stage.is_pulled:
+            # whichever stage pulls the first row consumes this one
+            stage.is_pulled = True
+            stage.parent = profile.current_stage()
+            if stage.parent is not None:
+                stage.parent.children.append(stage)
+
+        start = time.perf_counter()
+        active_stages.append(stage)
+        try:
+            row = next(rows)
+        except StopIteration:
+            return
+        finally:
+            active_stages.pop()
+            stage.seconds += time.perf_counter() - start
+
+        stage.rows_out += 1
+        yield row
+
+
+@contextmanager
+def profile_step(name: str) -> Iterator[Optional[StageStats]]:
+    """
+    Registers the block as a stage computing a single result (e.g. a count), for the
+    steps of a plan that don't produce rows one by one
+    """
+    profile = _active_profile.get()
+    if profile is None:
+        yield None
+        return
+
+    stage = StageStats(name, is_pulled=True, parent=profile.current_stage())
+    if stage.parent is not None:
+        stage.parent.children.append(stage)
+    profile.stages.append(stage)
+
+    start = time.perf_counter()
+    profile.active_stages.append(stage)
+    try:
+        yield stage
+    finally:
+        profile.active_stages.pop()
+        stage.seconds += time.perf_counter() - start
+    stage.rows_out = 1
+
+
+def count_page_read(kind: str, size: int):
+    profile = _active_profile.get()
+    stage = profile and profile.current_stage()
+    if stage is not None:
+        stage.pages_read[kind] += 1
+        stage.bytes_read += size
+
+
+def count_records_decoded(count: int):
+    profile = _active_profile.get()
+    stage = profile and profile.current_stage()
+    if stage is not None:
+        stage.records_decoded += count
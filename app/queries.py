@@ -1,288 +1,1461 @@
 from __future__ import annotations
-import re
-
-import sqlparse
-from sqlparse.sql import (
-    IdentifierList,
-    Identifier,
-    Where,
-    Statement,
-    Parenthesis,
-    Comparison,
-)
-from sqlparse.tokens import Keyword, Wildcard, Whitespace
+import copy
+import heapq
+import importlib.util
+from bisect import bisect_left
+from dataclasses import dataclass, field, replace
+from functools import lru_cache, partial
+from itertools import islice
 
 from app.pages import Page, load_page_at_location
-from app.filtering import ValueFilter
-from app.rows import Schema
-from app.consts import TABLE_CREATION_REGEX
+from app.reading import apply_real_affinity
+from app.pager import Pager
+from app.parallel import parallel_scan, parallel_count
+from app.filtering import (
+    RowFilter,
+    ValueFilter,
+    AndFilter,
+    OrFilter,
+    KeyRange,
+    ColumnType,
+    apply_affinity,
+    combine_conjuncts,
+    operand_affinity,
+    real_to_text,
+    sqlite_order_key,
+)
+from app.catalog import Catalog, TableInfo, IndexInfo
+from app.joins import (
+    Join,
+    JoinSide,
+    can_probe,
+    hash_join,
+    index_nested_loop_join,
+    split_column_reference,
+)
+from app.aggregation import Aggregate, AggregateOutput, aggregate_rows
+from app.sorting import OrderTerm, make_sort_key, sort_rows
+from app.parser import parse_select
+from app.profiling import profile_stage, profile_step
+from app.consts import (
+    BUILTIN_COLLATIONS,
+    DEFAULT_COLLATION,
+    ROW_FETCH_BATCH,
+    QUERY_CACHE_SIZE,
+    COLUMNAR_MIN_LEAF_PAGES,
+    SORT_MAX_ROWS,
+)
 
-from typing import List, Optional, BinaryIO
+from typing import (
+    List,
+    Optional,
+    Iterator,
+    Iterable,
+    Tuple,
+    Sequence,
+    Union,
+    Callable,
+    FrozenSet,
+)
 
 
 class Query:
-    query_components: List[str]
-    parsed_query: Statement
-
     table_name: str
-    value_filter: Optional[ValueFilter]
-    requested_column_names: List[str]
+    value_filter: Optional[RowFilter]
+    requested_column_names: List[str]  # plain columns of the select list
+    limit: Optional[int]
+    select_list: List[Union[str, Aggregate]]  # output columns, in order
+    group_by: List[str]
+    table_alias: Optional[str]
+    join: Optional[Join]
+    order_by: List[OrderTerm]
 
     def __init__(
         self,
-        query_components: List[str],
-        parsed_query: Statement,
         table_name: str,
-        value_filter: Optional[ValueFilter],
+        value_filter: Optional[RowFilter],
         requested_column_names: List[str],
+        limit: Optional[int] = None,
+        select_list: Optional[List[Union[str, Aggregate]]] = None,
+        group_by: Optional[List[str]] = None,
+        table_alias: Optional[str] = None,
+        join: Optional[Join] = None,
+        order_by: Optional[List[OrderTerm]] = None,
     ):
-        self.query_components = query_components
-        self.parsed_query = parsed_query
         self.table_name = table_name
         self.value_filter = value_filter
         self.requested_column_names = requested_column_names
+        self.limit = limit
+        self.select_list = (
+            select_list if select_list is not None else list(requested_column_names)
+        )
+        self.group_by = group_by or []
+        self.table_alias = table_alias
+        self.join = join
+        self.order_by = order_by or []
 
     @staticmethod
+    @lru_cache(maxsize=QUERY_CACHE_SIZE)
     def parse_query(query_str: str) -> Query:
-        query_components = query_str.split(" ")
+        """
+        Parses a SELECT query. Queries are cached by their text, a query sent again
+        (e.g. to the server) is not parsed twice: the returned Query must not be mutated.
+        """
+        statement = parse_select(query_str)
+        query = Query(
+            statement.table_name,
+            statement.value_filter,
+            [
+                item
+                for item in statement.select_list
+                if isinstance(item, str) and item != "*"
+            ],
+            statement.limit,
+            statement.select_list,
+            statement.group_by,
+            statement.table_alias,
+            statement.join,
+            statement.order_by,
+        )
+        if statement.join is None:
+            # a single table is involved, "table.column" simply means "column"
+            query._unqualify_column_references()
+
+        return query
+
+    def execute(self, pager: Pager, catalog: Catalog, workers: int = 1):
+        """
+        Args:
+            workers (int): when above 1, full table scans are split across
+                a pool of that many processes
+        """
+        for row in self.iter_results(pager, catalog, workers):
+            print(format_row(row))
+
+    def iter_results(
+        self, pager: Pager, catalog: Catalog, workers: int = 1
+    ) -> Iterator[List[any]]:
+        """
+        Runs the query as a pipeline of lazy generators
+        (leaf pages -> rows -> filter -> limit -> projection -> output),
+        so memory stays flat and rows are handed out as soon as they are decoded.
+        """
+        query = self.prepare(catalog, pager.text_encoding)
+        if query.join is not None:
+            yield from query._iter_join_results(pager, catalog, workers)
+        elif query.is_count():
+            yield [query._count_rows(pager, catalog, workers)]
+        elif query.is_aggregate():
+            yield from query._iter_aggregated_rows(pager, catalog, workers)
+        else:
+            yield from query._iter_projected_rows(pager, catalog, workers)
+
+    def prepare(self, catalog: Catalog, text_encoding: str) -> Query:
+        """
+        The query as run against the database: "*" expanded (see expand_star) and the
+        filter comparing each column like SQLite does, with its affinity and collating
+        sequence (see ColumnType)
+        """
+        query = self.expand_star(catalog)
+        if query.value_filter is None:
+            return query
+
+        query = copy.copy(query)
+        query.value_filter = query.value_filter.with_column_types(
+            partial(query.column_type, catalog, text_encoding)
+        )
+        return query
+
+    def column_type(
+        self, catalog: Catalog, text_encoding: str, reference: str
+    ) -> ColumnType:
+        """
+        How the column a reference of the query reads compares its values, with its
+        affinity and collating sequence
+        """
+        found = self.find_column(catalog, reference)
+        if found is None:
+            # reported as unknown when the rows are decoded
+            return ColumnType(text_encoding=text_encoding)
+        table, column = found
+        return ColumnType(
+            table.affinities.get(column, "BLOB"),
+            table.collations.get(column, DEFAULT_COLLATION),
+            text_encoding,
+        )
+
+    def find_column(
+        self, catalog: Catalog, reference: str
+    ) -> Optional[Tuple[TableInfo, str]]:
+        """
+        The table and column a column reference ("column" or "qualifier.column") of
+        the query reads, None if no table of the query has it
+        """
+        qualifier, column = split_column_reference(reference)
+        tables = [(self.table_name, self.table_alias)]
+        if self.join is not None:
+            tables.append((self.join.table_name, self.join.alias))
+        for table_name, alias in tables:
+            table = catalog.table(table_name)
+            if qualifier in (None, table_name, alias) and column in table.columns:
+                return table, column
 
-        if query_components[0].lower() != "select":
-            raise TypeError("Only SELECT queries are supported")
+        return None
 
-        statement = sqlparse.parse(query_str)[0]
-        table_name = Query._extract_table_name_from_query(statement)
-        value_filter = Query._extract_value_filter_from_query(statement)
-        requested_column_names = Query._extract_columns_names_from_query(statement)
+    def expand_star(self, catalog: Catalog) -> Query:
+        """
+        The query with each "*" of its select list replaced by every column of the FROM
+        table then of the joined one, in table order. Columns of joined tables are
+        qualified by their table alias or name.
+        """
+        if "*" not in self.select_list:
+            return self
+
+        tables = [(self.table_name, self.table_alias)]
+        if self.join is not None:
+            tables.append((self.join.table_name, self.join.alias))
+        every_column = [
+            f"{alias or table_name}.{column}" if self.join is not None else column
+            for table_name, alias in tables
+            for column in catalog.table(table_name).columns
+        ]
+
+        select_list = []
+        for item in self.select_list:
+            select_list += every_column if item == "*" else [item]
 
         return Query(
-            query_components,
-            statement,
-            table_name,
-            value_filter,
-            requested_column_names,
+            self.table_name,
+            self.value_filter,
+            [item for item in select_list if isinstance(item, str)],
+            self.limit,
+            select_list,
+            self.group_by,
+            self.table_alias,
+            self.join,
+            self.order_by,
         )
 
-    @staticmethod
-    def _extract_table_name_from_query(statement: Statement) -> str:
-        found_from = False
-        for token in statement.tokens:
-            if token.ttype == Keyword and token.value.upper() == "FROM":
-                found_from = True
-            elif found_from and isinstance(token, Identifier):
-                return token.get_real_name()
+    @property
+    def aggregates(self) -> List[Aggregate]:
+        return [item for item in self.select_list if isinstance(item, Aggregate)]
 
-        raise RuntimeError(f"Failed to extract table name from query {statement}")
+    def is_count(self) -> bool:
+        return self.select_list == [Aggregate("COUNT", None)] and not self.group_by
 
-    @staticmethod
-    def _extract_value_filter_from_query(statement: Statement) -> Optional[ValueFilter]:
-        where_clause = None
-        for token in statement.tokens:
-            if isinstance(token, Where):
-                where_clause = token
-                break
+    def is_aggregate(self) -> bool:
+        return bool(self.aggregates or self.group_by)
 
-        if not where_clause:
-            return None
+    def decoded_column_names(self) -> List[str]:
+        """
+        The columns rows are decoded with: the projected ones, then the grouping ones,
+        the aggregated ones and the filtered ones
+        """
+        decoded_columns = list(self.requested_column_names)
+        decoded_columns += self.group_by
+        decoded_columns += [aggregate.column for aggregate in self.aggregates]
+        if not self.is_aggregate():
+            decoded_columns += [term.item for term in self.order_by]
+        if self.value_filter:
+            decoded_columns += self.value_filter.columns
 
-        for token in where_clause.tokens:
-            if isinstance(token, Comparison):
-                comparison_parts = [
-                    t.value.strip() for t in token.tokens if t.ttype != Whitespace
-                ]
-                column = comparison_parts[0]
-                operator = comparison_parts[1]  # Operator (=, >, <, etc.)
-                value = comparison_parts[2].strip("'")
+        return [
+            column for column in dict.fromkeys(decoded_columns) if column is not None
+        ]
 
-                return ValueFilter(column, operator, value)
+    def is_full_table_scan(self, catalog: Catalog) -> bool:
+        """
+        True if answering the query means decoding every row of its table
+        """
+        if self.is_aggregate() or self.join is not None or self.order_by:
+            return False
 
-    @staticmethod
-    def _extract_columns_names_from_query(statement: Statement) -> List[str]:
-        column_names = []
-
-        for token in statement.tokens:
-            if isinstance(token, IdentifierList):
-                for identifier in token.get_identifiers():
-                    if identifier.ttype is not Wildcard:
-                        column_names.append(identifier.get_real_name())
-            elif isinstance(token, Identifier):
-                column_names.append(token.get_real_name())
-            elif token.ttype is Keyword and token.value.upper() == "FROM":
-                break
+        table = catalog.table(self.table_name)
+        return plan_access(catalog, table, self.value_filter).is_scan
 
-        return column_names
+    def _count_rows(self, pager: Pager, catalog: Catalog, workers: int = 1) -> int:
+        """
+        COUNT(*) without a filter only reads the cell count in the header of each leaf.
+        With a filter on an indexed column the index entries are counted, the table is never read.
+        """
+        table = catalog.table(self.table_name)
+        value_filter = self.value_filter
+        if value_filter is None:
+            if workers > 1:
+                leaf_page_indices = get_table_leaf_page_indices(
+                    pager, catalog, self.table_name
+                )
+                with profile_step(f"COUNT {table.name} WITH {workers} WORKERS"):
+                    return parallel_count(
+                        pager.database_file_path, leaf_page_indices, workers
+                    )
 
-    def execute(
-        self, database_file: BinaryIO, sqlite_schema: List[Schema], page_size: int
-    ):
-        if self.query_components[1].lower() == "count(*)":
-            table_pages = get_table_leaf_pages(
-                database_file, sqlite_schema, self.table_name, None, page_size
+            with profile_step(f"COUNT {table.name} FROM LEAF PAGE HEADERS"):
+                page = load_page_at_location(pager, table.rootpage - 1)
+                return page.count_table_rows(pager)
+
+        access = plan_access(catalog, table, value_filter)
+        index = access.index
+        if index and len(access.index_filters) == len(value_filter.conjuncts()):
+            # every condition is on an index column, index keys are enough
+            with profile_step(
+                f"COUNT {table.name} USING INDEX {index.name} ({value_filter})"
+            ):
+                page = load_page_at_location(pager, index.rootpage - 1)
+                return page.count_index_keys(
+                    pager,
+                    access.index_key_ranges(),
+                    value_filter.bind(index.columns.index),
+                    index.collations,
+                )
+
+        counts = self._aggregate_columnar(pager, catalog, workers)
+        if counts is not None:
+            return counts[0]
+
+        with profile_step(f"COUNT {table.name} USING {access.describe(table.name)}"):
+            filter_columns = value_filter.columns
+            column_ordinals = table.resolve_column_ordinals(filter_columns)
+            rows = iter_table_rows(pager, catalog, table, access, column_ordinals)
+            return sum(map(value_filter.bind(filter_columns.index), rows))
+
+    def _unqualify_column_references(self):
+        def unqualify(item: Union[str, Aggregate]) -> Union[str, Aggregate]:
+            if isinstance(item, Aggregate):
+                return Aggregate(
+                    item.function, item.column and split_column_reference(item.column)[1]
+                )
+            return split_column_reference(item)[1]
+
+        self.select_list = [unqualify(item) for item in self.select_list]
+        self.requested_column_names = [
+            split_column_reference(column)[1] for column in self.requested_column_names
+        ]
+        self.group_by = [split_column_reference(column)[1] for column in self.group_by]
+        if self.value_filter:
+            self.value_filter = self.value_filter.rename_columns(
+                lambda column: split_column_reference(column)[1]
             )
-            print(sum([table_page.cell_count for table_page in table_pages]))
-        else:
-            self._execute_query(database_file, sqlite_schema, page_size)
+        self.order_by = [
+            OrderTerm(unqualify(term.item), term.descending) for term in self.order_by
+        ]
 
-    def _execute_query(
-        self, database_file: BinaryIO, sqlite_schema: List[Schema], page_size: int
-    ):
-        desired_table_schema = next(
-            (schema for schema in sqlite_schema if schema.name == self.table_name), None
+    def _iter_projected_rows(
+        self, pager: Pager, catalog: Catalog, workers: int = 1
+    ) -> Iterator[List[any]]:
+        # Rows are decoded as tuples holding only the projected, filtered and sorted
+        # columns, laid out as "decoded_columns"
+        decoded_columns = self.decoded_column_names()
+        column_type = partial(self.column_type, catalog, pager.text_encoding)
+        rows = self._iter_rows_in_order(pager, catalog, decoded_columns)
+        if rows is not None:
+            yield from self._project(
+                rows, decoded_columns.index, column_type, is_ordered=True
+            )
+            return
+
+        rows = iter_filtered_rows(
+            pager, catalog, self.table_name, self.value_filter, decoded_columns, workers
         )
+        yield from self._project(rows, decoded_columns.index, column_type)
 
-        creation_query = desired_table_schema.sql.split(b"\r")[0].decode("utf-8")
-        schema = get_column_names_from_creation_query(creation_query)
+    def _iter_rows_in_order(
+        self, pager: Pager, catalog: Catalog, decoded_columns: List[str]
+    ) -> Optional[Iterator[Tuple[any, ...]]]:
+        """
+        Reads the filtered rows already in ORDER BY order when the table b-tree or an
+        index is sorted like it, or returns None if the rows must be sorted.
 
-        pages = get_table_leaf_pages(
-            database_file,
-            sqlite_schema,
-            self.table_name,
-            self.value_filter,
-            page_size,
+        An index is walked when it holds every decoded column, when it also answers the
+        filter, or when there is a LIMIT: the first rows are then found without reading
+        the others. Rows not covered by the index are fetched by row id in batches.
+        """
+        if not self.order_by or any(term.descending for term in self.order_by):
+            return None
+
+        table = catalog.table(self.table_name)
+        value_filter = self.value_filter
+        order_columns = [term.item for term in self.order_by]
+        access = plan_access(catalog, table, value_filter)
+        if order_columns == [table.row_id_alias] and not (
+            access.index
+            and resolve_index_key_positions(table, access.index, decoded_columns)
+        ):
+            # every access path but a covering index yields rows in row id order
+            return iter_filtered_rows(
+                pager, catalog, self.table_name, value_filter, decoded_columns
+            )
+
+        index = find_index_for_order(catalog, table, order_columns)
+        if index is None:
+            return None
+
+        key_positions = resolve_index_key_positions(table, index, decoded_columns)
+        answers_filter = access.index is not None and walks_like(
+            index, access.index, len(access.index_filters)
         )
+        if not answers_filter and not access.is_scan:
+            # the filter narrows the rows down through another access path
+            return None
+        if not answers_filter and key_positions is None and self.limit is None:
+            # looking every row up by row id costs more than scanning and sorting
+            return None
 
-        rows = [
-            row
-            for page in pages
-            for row in page.read_records_with_schema(database_file, schema)
+        page = load_page_at_location(pager, index.rootpage - 1)
+        if answers_filter:
+            keys = page.iter_filter_compliant_keys(
+                pager, access.index_key_ranges(), index.collations
+            )
+            stage_name = (
+                f"SEARCH {table.name} USING INDEX {index.name} ({access.access_filter})"
+            )
+        else:
+            keys = page.iter_index_keys(pager)
+            stage_name = f"SCAN {table.name} USING INDEX {index.name}"
+
+        if key_positions is not None:
+            real_keys = table.real_key_positions(index)
+            rows = (
+                apply_real_affinity(
+                    tuple(key[position] for position in key_positions),
+                    key_positions,
+                    real_keys,
+                )
+                for key in keys
+            )
+        else:
+            rows = iter_rows_by_row_id(
+                pager,
+                table,
+                (key[-1] for key in keys),
+                table.resolve_column_ordinals(decoded_columns),
+                self.limit,
+            )
+        rows = profile_stage(f"{stage_name} FOR ORDER BY", rows)
+
+        if value_filter:
+            rows = profile_stage(
+                f"FILTER {value_filter}",
+                filter(value_filter.bind(decoded_columns.index), rows),
+                is_filter=True,
+            )
+
+        return rows
+
+    def _project(
+        self,
+        rows: Iterator[Tuple[any, ...]],
+        position_of: Callable[[str], int],
+        column_type: Callable[[str], ColumnType],
+        is_ordered: bool = False,
+    ) -> Iterator[List[any]]:
+        """
+        Sorts the rows unless they are already ordered, applies the LIMIT and picks
+        the selected columns, found in rows by "position_of". Text is sorted with the
+        collating sequence "column_type" gives.
+        """
+        if self.order_by and not is_ordered:
+            sort_key = make_sort_key(
+                [position_of(term.item) for term in self.order_by],
+                [term.descending for term in self.order_by],
+                [column_type(term.item).key_order.order_key for term in self.order_by],
+            )
+            rows = profile_stage(
+                describe_sort(self.limit), sort_rows(rows, sort_key, self.limit)
+            )
+
+        # islice stops pulling from the scan once enough rows were produced
+        if self.limit is not None:
+            rows = islice(rows, self.limit)
+
+        projected_positions = [
+            position_of(column) for column in self.requested_column_names
         ]
+        for row in rows:
+            yield project_row(row, projected_positions)
+
+    def _iter_aggregated_rows(
+        self, pager: Pager, catalog: Catalog, workers: int = 1
+    ) -> Iterator[List[any]]:
+        """
+        Streams the filtered rows through a hash aggregation, one output row per group
+        """
+        extrema = self._read_extrema_from_indexes(pager, catalog)
+        if extrema is not None:
+            yield extrema
+            return
 
+        aggregated_row = self._aggregate_columnar(pager, catalog, workers)
+        if aggregated_row is not None:
+            if self.limit != 0:
+                yield aggregated_row
+            return
+
+        decoded_columns = self.decoded_column_names()
+        rows = iter_filtered_rows(
+            pager, catalog, self.table_name, self.value_filter, decoded_columns, workers
+        )
+
+        yield from self._aggregate(
+            rows,
+            decoded_columns.index,
+            partial(self.column_type, catalog, pager.text_encoding),
+        )
+
+    def _aggregate_columnar(
+        self, pager: Pager, catalog: Catalog, workers: int = 1
+    ) -> Optional[List[any]]:
+        """
+        Aggregates a full table scan on NumPy arrays, decoded a batch of leaf pages at
+        a time (see app.columnar). Returns None when the query doesn't qualify: numpy
+        must be installed, every output must be an aggregate without GROUP BY, and the
+        table must be big enough for the batches to pay for importing numpy.
+        """
+        table = catalog.table(self.table_name)
+        if (
+            self.group_by
+            or workers > 1
+            or not all(isinstance(item, Aggregate) for item in self.select_list)
+            or not plan_access(catalog, table, self.value_filter).is_scan
+        ):
+            return None
+
+        leaf_page_indices = get_table_leaf_page_indices(pager, catalog, self.table_name)
+        if len(leaf_page_indices) < COLUMNAR_MIN_LEAF_PAGES or not is_numpy_installed():
+            return None
+
+        from app.columnar import aggregate_batches, iter_column_batches
+
+        decoded_columns = self.decoded_column_names()
+        batches = iter_column_batches(
+            pager,
+            leaf_page_indices,
+            table.resolve_column_ordinals(decoded_columns),
+            table.real_ordinals,
+            table.default_ordinals,
+        )
+        filter_positions = (
+            self.value_filter.locate(decoded_columns.index) if self.value_filter else None
+        )
+
+        stage_name = f"COLUMNAR AGGREGATE SCAN {table.name}"
         if self.value_filter:
-            rows = filter(self.value_filter, rows)
+            stage_name += f" ({self.value_filter})"
+        with profile_step(stage_name):
+            return aggregate_batches(
+                batches,
+                self._aggregate_outputs(
+                    decoded_columns.index,
+                    partial(self.column_type, catalog, pager.text_encoding),
+                ),
+                filter_positions,
+                self.value_filter,
+            )
 
-        column_values_per_row = [
-            [
-                row[column_name].decode("utf8")
-                if type(row[column_name]) is bytes
-                else row[column_name]
-                for column_name in self.requested_column_names
+    def _aggregate(
+        self,
+        rows: Iterator[Tuple[any, ...]],
+        position_of: Callable[[str], int],
+        column_type: Callable[[str], ColumnType],
+    ) -> Iterator[List[any]]:
+        """
+        Groups and aggregates the rows, whose columns are found by "position_of",
+        then sorts the groups and applies the LIMIT to them. Grouped columns, MIN and
+        MAX compare text with the collating sequence "column_type" gives.
+        """
+        outputs = self._aggregate_outputs(position_of, column_type)
+        group_positions = [position_of(column) for column in self.group_by]
+        group_types = [column_type(column) for column in self.group_by]
+
+        stage_name = "HASH AGGREGATE"
+        if self.group_by:
+            stage_name += f" GROUP BY {', '.join(self.group_by)}"
+        groups = profile_stage(
+            stage_name, aggregate_rows(rows, group_positions, outputs, group_types)
+        )
+        if self.order_by:
+            sort_key = make_sort_key(
+                [self._select_list_position(term.item) for term in self.order_by],
+                [term.descending for term in self.order_by],
+                # aggregates have no collating sequence, they sort in binary order
+                [
+                    column_type(term.item).key_order.order_key
+                    if isinstance(term.item, str)
+                    else sqlite_order_key
+                    for term in self.order_by
+                ],
+            )
+            groups = profile_stage(
+                describe_sort(self.limit), sort_rows(groups, sort_key, self.limit)
+            )
+        if self.limit is not None:
+            groups = islice(groups, self.limit)
+
+        output_positions = range(len(outputs))
+        for group in groups:
+            yield project_row(group, output_positions)
+
+    def _aggregate_outputs(
+        self,
+        position_of: Callable[[str], int],
+        column_type: Callable[[str], ColumnType],
+    ) -> List[AggregateOutput]:
+        outputs = []
+        for item in self.select_list:
+            if not isinstance(item, Aggregate):
+                outputs.append(AggregateOutput(None, position_of(item)))
+            elif item.column is None:
+                outputs.append(AggregateOutput(item.function, -1))
+            else:
+                outputs.append(
+                    AggregateOutput(
+                        item.function,
+                        position_of(item.column),
+                        column_type(item.column),
+                    )
+                )
+
+        return outputs
+
+    def _select_list_position(self, item: Union[str, Aggregate]) -> int:
+        if item not in self.select_list:
+            raise ValueError(
+                f"ORDER BY {item} must also be selected when aggregating"
+            )
+
+        return self.select_list.index(item)
+
+    def _iter_join_results(
+        self, pager: Pager, catalog: Catalog, workers: int = 1
+    ) -> Iterator[List[any]]:
+        """
+        Joined rows are laid out as the decoded columns of the FROM table followed by
+        the ones of the joined table. The filter is applied to the rows of its table
+        before joining, except for a filter on the right table of a LEFT JOIN which must
+        see the rows the join completed with NULLs.
+
+        The joined table is looked up through its row id b-tree or an index on its join
+        column when possible (for an INNER JOIN, the FROM table can be looked up instead).
+        Otherwise the smaller table is loaded in a hash table, the right one for a LEFT JOIN.
+        """
+        join = self.join
+        tables = [catalog.table(self.table_name), catalog.table(join.table_name)]
+        qualifiers = [
+            {self.table_name, self.table_alias} - {None},
+            {join.table_name, join.alias} - {None},
+        ]
+
+        def resolve(reference: str) -> Tuple[int, str]:
+            qualifier, column = split_column_reference(reference)
+            sides = [
+                side
+                for side in (0, 1)
+                if (qualifier is None or qualifier in qualifiers[side])
+                and column in tables[side].columns
             ]
-            for row in rows
+            if len(sides) != 1:
+                problem = "Ambiguous" if sides else "Unknown"
+                raise ValueError(f"{problem} column '{reference}'")
+            return sides[0], column
+
+        side_columns: List[List[str]] = [[], []]
+        for reference in self.decoded_column_names() + list(join.on_columns):
+            side, column = resolve(reference)
+            if column not in side_columns[side]:
+                side_columns[side].append(column)
+
+        join_columns = dict(resolve(reference) for reference in join.on_columns)
+        if len(join_columns) != 2:
+            raise ValueError(f"JOIN must compare a column of each table, got {join.on_columns}")
+
+        # conjuncts reading a single table filter its rows before the join
+        side_conjuncts: List[List[RowFilter]] = [[], []]
+        post_join_conjuncts = []
+        for conjunct in self.value_filter.conjuncts() if self.value_filter else []:
+            conjunct_sides = {resolve(column)[0] for column in conjunct.columns}
+            side = conjunct_sides.pop() if len(conjunct_sides) == 1 else None
+            if side == 0 or (side == 1 and join.kind == "INNER"):
+                side_conjuncts[side].append(
+                    conjunct.rename_columns(lambda reference: resolve(reference)[1])
+                )
+            else:
+                post_join_conjuncts.append(conjunct)
+        side_filters = [combine_conjuncts(conjuncts) for conjuncts in side_conjuncts]
+        post_join_filter = combine_conjuncts(post_join_conjuncts)
+
+        # the ON comparison converts the values of each side by the affinity of the
+        # other one and compares text with the collation of its left operand
+        left_side, _ = resolve(join.on_columns[0])
+        collation = tables[left_side].collations.get(
+            join_columns[left_side], DEFAULT_COLLATION
+        )
+        affinities = [
+            tables[side].affinities.get(join_columns[side], "BLOB") for side in (0, 1)
         ]
-        print(
-            "\n".join(
-                [
-                    "|".join([str(entry) for entry in row])
-                    for row in column_values_per_row
+        sides = [
+            JoinSide(
+                tables[side],
+                side_columns[side],
+                join_columns[side],
+                side_filters[side],
+                ColumnType(
+                    operand_affinity(affinities[side], affinities[1 - side]),
+                    collation,
+                    pager.text_encoding,
+                ),
+            )
+            for side in (0, 1)
+        ]
+
+        def iter_side_rows(side: JoinSide) -> Iterator[Tuple[any, ...]]:
+            return iter_filtered_rows(
+                pager, catalog, side.table.name, side.value_filter, side.columns, workers
+            )
+
+        keep_unmatched = join.kind == "LEFT"
+        outer, inner = 0, 1
+        if (
+            not can_probe(catalog, sides[1])
+            and join.kind == "INNER"
+            and can_probe(catalog, sides[0])
+        ):
+            outer, inner = 1, 0
+
+        if can_probe(catalog, sides[inner]):
+            pairs = index_nested_loop_join(
+                pager,
+                catalog,
+                iter_side_rows(sides[outer]),
+                sides[outer],
+                sides[inner],
+                keep_unmatched,
+            )
+            stage_name = (
+                f"{join.kind} INDEX NESTED LOOP JOIN {sides[outer].table.name}"
+                f" PROBING {sides[inner].table.name}.{sides[inner].join_column}"
+            )
+        else:
+            build = 1
+            if join.kind == "INNER":
+                row_counts = [
+                    load_page_at_location(pager, table.rootpage - 1).count_table_rows(pager)
+                    for table in tables
                 ]
+                build = 0 if row_counts[0] < row_counts[1] else 1
+            outer, inner = 1 - build, build
+            pairs = hash_join(
+                iter_side_rows(sides[outer]),
+                sides[outer].join_keys(),
+                iter_side_rows(sides[inner]),
+                sides[inner].join_keys(),
+                keep_unmatched,
+            )
+            stage_name = (
+                f"{join.kind} HASH JOIN {sides[outer].table.name}"
+                f" WITH {sides[inner].table.name} HASHED"
+            )
+        pairs = profile_stage(stage_name, pairs)
+
+        missing_inner_row = (None,) * len(sides[inner].columns)
+        if outer == 0:
+            rows = (left + (right or missing_inner_row) for left, right in pairs)
+        else:
+            rows = (left + right for right, left in pairs)
+
+        joined_columns = [(0, column) for column in side_columns[0]]
+        joined_columns += [(1, column) for column in side_columns[1]]
+
+        def position_of(reference: str) -> int:
+            return joined_columns.index(resolve(reference))
+
+        if post_join_filter:
+            rows = profile_stage(
+                f"FILTER {post_join_filter}",
+                filter(post_join_filter.bind(position_of), rows),
+                is_filter=True,
+            )
+
+        if self.is_aggregate():
+            yield from self._aggregate(
+                rows,
+                position_of,
+                partial(self.column_type, catalog, pager.text_encoding),
+            )
+        else:
+            yield from self._project(
+                rows,
+                position_of,
+                partial(self.column_type, catalog, pager.text_encoding),
+            )
+
+    def _read_extrema_from_indexes(
+        self, pager: Pager, catalog: Catalog
+    ) -> Optional[List[any]]:
+        """
+        Answers queries only selecting MIN and MAX of indexed columns from the first or
+        last entry of each index, or returns None if the query doesn't allow it
+        """
+        if self.value_filter or self.group_by:
+            return None
+
+        table = catalog.table(self.table_name)
+        indexes = []
+        for item in self.select_list:
+            if not isinstance(item, Aggregate) or item.function not in ("MIN", "MAX"):
+                return None
+            collation = item.column and table.collations.get(
+                item.column, DEFAULT_COLLATION
+            )
+            index = item.column and catalog.find_index(
+                self.table_name, item.column, collation
+            )
+            if not index or not index.sorts_in_order([collation]):
+                # extrema compare text with the collating sequence of the column
+                return None
+            indexes.append(index)
+
+        extrema = []
+        index_names = ", ".join(index.name for index in indexes)
+        with profile_step(f"MIN/MAX FROM FIRST/LAST ENTRY OF INDEX {index_names}"):
+            for aggregate, index in zip(self.select_list, indexes):
+                page = load_page_at_location(pager, index.rootpage - 1)
+                if aggregate.function == "MIN":
+                    record = page.first_index_record(pager)
+                else:
+                    record = page.last_index_record(pager)
+                value = record.value if record else None
+                if type(value) is int and table.affinities[aggregate.column] == "REAL":
+                    value = float(value)  # see apply_real_affinity
+                extrema.append(value)
+
+        return extrema
+
+
+@lru_cache(maxsize=None)
+def is_numpy_installed() -> bool:
+    """
+    NumPy is optional, it is only needed by the columnar reader (app.columnar)
+    """
+    return importlib.util.find_spec("numpy") is not None
+
+
+def iter_filtered_rows(
+    pager: Pager,
+    catalog: Catalog,
+    table_name: str,
+    value_filter: Optional[RowFilter],
+    decoded_columns: List[str],
+    workers: int = 1,
+) -> Iterator[Tuple[any, ...]]:
+    """
+    Yields the rows of the table satisfying the filter, decoded as tuples laid out as
+    "decoded_columns". Picks the cheapest access path (see plan_access): a covering
+    index, an index range, row id lookups or a full scan, parallel when "workers" is
+    above 1. The whole filter is then applied to the rows the access path found.
+    """
+    table = catalog.table(table_name)
+    column_ordinals = table.resolve_column_ordinals(decoded_columns)
+
+    access = plan_access(catalog, table, value_filter)
+    key_positions = (
+        resolve_index_key_positions(table, access.index, decoded_columns)
+        if access.index
+        else None
+    )
+    is_parallel_scan = workers > 1 and access.is_scan
+    rows: Iterator[Tuple[any, ...]]
+    if key_positions is not None:
+        # Covering index: every decoded column is part of the index key,
+        # rows are read from the index pages alone, in index order
+        rows = iter_rows_via_covering_index(
+            pager,
+            access.index,
+            access.index_key_ranges(),
+            key_positions,
+            table.real_key_positions(access.index),
+        )
+        stage_name = (
+            f"SEARCH {table_name} USING COVERING INDEX {access.index.name}"
+            f" ({access.access_filter})"
+        )
+    elif is_parallel_scan:
+        # Full scan, leaf pages are independent so they are decoded and filtered in parallel
+        rows = parallel_scan(
+            pager.database_file_path,
+            get_table_leaf_page_indices(pager, catalog, table_name),
+            column_ordinals,
+            table.real_ordinals,
+            table.default_ordinals,
+            value_filter,
+            value_filter.locate(decoded_columns.index) if value_filter else None,
+            workers,
+        )
+        stage_name = f"SCAN {table_name} WITH {workers} WORKERS"
+        if value_filter:
+            stage_name += f" FILTERING {value_filter}"
+    else:
+        rows = iter_table_rows(pager, catalog, table, access, column_ordinals)
+        stage_name = access.describe(table_name)
+    rows = profile_stage(stage_name, rows)
+
+    if value_filter and not is_parallel_scan:
+        rows = profile_stage(
+            f"FILTER {value_filter}",
+            filter(value_filter.bind(decoded_columns.index), rows),
+            is_filter=True,
+        )
+
+    return rows
+
+
+@dataclass
+class AccessPath:
+    """
+    How the rows a filter may select are found, before the filter is applied to them:
+    by descending the table b-tree over row id ranges, by walking one index, by looking
+    up the row ids indexes give for several conditions, or by a full scan when none of
+    them is set
+    """
+
+    access_filter: Optional[RowFilter] = None  # answered by the ranges or the index
+    row_id_ranges: Optional[List[KeyRange]] = None
+    index: Optional[IndexInfo] = None
+    # comparisons bounding the index walk, one per leading index column, see
+    # index_key_ranges. access_filter is their conjunction.
+    index_filters: List[ValueFilter] = field(default_factory=list)
+    # conditions whose row ids, found through indexes, are intersected
+    row_id_filters: List[RowFilter] = field(default_factory=list)
+
+    def index_key_ranges(self) -> List[KeyRange]:
+        return index_key_ranges(self.index_filters)
+
+    @property
+    def is_scan(self) -> bool:
+        return (
+            self.row_id_ranges is None and self.index is None and not self.row_id_filters
+        )
+
+    def describe(self, table_name: str) -> str:
+        if self.row_id_ranges is not None:
+            return f"SEARCH {table_name} USING INTEGER PRIMARY KEY ({self.access_filter})"
+        if self.index is not None:
+            return f"SEARCH {table_name} USING INDEX {self.index.name} ({self.access_filter})"
+        if self.row_id_filters:
+            row_id_filter = combine_conjuncts(self.row_id_filters)
+            return f"SEARCH {table_name} USING MULTI-INDEX ({row_id_filter})"
+
+        return f"SCAN {table_name}"
+
+
+def plan_access(
+    catalog: Catalog, table: TableInfo, value_filter: Optional[RowFilter]
+) -> AccessPath:
+    """
+    Picks how the rows of the filter are found, from the conditions it ANDs together:
+    a condition on the row id alias first, then an index several conditions bound
+    together (see find_index_for_conjuncts), then the only condition an index answers.
+    When several can be answered through indexes (each may be an OR of indexed
+    conditions), their row ids are intersected. The other conditions are only
+    checked against the rows found.
+    """
+    conjuncts = value_filter.conjuncts() if value_filter else []
+    for conjunct in conjuncts:
+        row_id_ranges = get_row_id_key_ranges(table, conjunct)
+        if row_id_ranges is not None:
+            return AccessPath(conjunct, row_id_ranges=row_id_ranges)
+
+    index, index_filters = find_index_for_conjuncts(table, conjuncts)
+    if index is not None:
+        return AccessPath(
+            combine_conjuncts(index_filters), index=index, index_filters=index_filters
+        )
+
+    indexed = [
+        conjunct for conjunct in conjuncts if can_load_row_ids(catalog, table, conjunct)
+    ]
+    if len(indexed) == 1 and isinstance(indexed[0], ValueFilter):
+        index = find_index_for_filter(catalog, table.name, indexed[0])
+        return AccessPath(indexed[0], index=index, index_filters=indexed)
+
+    return AccessPath(row_id_filters=indexed)
+
+
+def find_index_for_conjuncts(
+    table: TableInfo, conjuncts: List[RowFilter]
+) -> Tuple[Optional[IndexInfo], List[ValueFilter]]:
+    """
+    The index whose keys the most conjuncts bound together, with those conjuncts in
+    index column order: "=" comparisons on its leading columns, then possibly a
+    comparison an index can narrow down on the next column (see
+    ValueFilter.key_ranges), each comparing text with the collating sequence of its
+    index column. (None, []) unless at least two conjuncts are used, a single one
+    being planned with find_index_for_filter.
+    """
+    comparisons = [
+        conjunct
+        for conjunct in conjuncts
+        if isinstance(conjunct, ValueFilter) and conjunct.key_ranges() is not None
+    ]
+    best_index, best_filters = None, []
+    for index in table.indexes:
+        if index.is_partial:
+            continue
+        index_filters = []
+        for column, collation, is_descending in zip(
+            index.columns, index.collations, index.descending
+        ):
+            if is_descending or collation not in BUILTIN_COLLATIONS:
+                break
+            candidates = [
+                comparison
+                for comparison in comparisons
+                if comparison.column == column
+                and comparison.column_type.collation == collation
+            ]
+            if not candidates:
+                break
+            equality = next(
+                (candidate for candidate in candidates if candidate.is_equality), None
+            )
+            index_filters.append(equality or candidates[0])
+            if equality is None:
+                break
+
+        # narrower indexes are preferred as more of their keys fit in a page
+        if len(index_filters) > len(best_filters) or (
+            index_filters
+            and len(index_filters) == len(best_filters)
+            and len(index.columns) < len(best_index.columns)
+        ):
+            best_index, best_filters = index, index_filters
+
+    if len(best_filters) < 2:
+        return None, []
+
+    return best_index, best_filters
+
+
+def index_key_ranges(index_filters: List[ValueFilter]) -> List[KeyRange]:
+    """
+    The key ranges of an index walk bounded by comparisons on its leading columns, in
+    index column order: every comparison but the last one is an equality, whose
+    constants prefix the key ranges of the last one
+    """
+    prefix = tuple(index_filter.compared_value for index_filter in index_filters[:-1])
+    return [
+        replace(key_range, prefix=prefix) for key_range in index_filters[-1].key_ranges()
+    ]
+
+
+def can_load_row_ids(catalog: Catalog, table: TableInfo, value_filter: RowFilter) -> bool:
+    """
+    True if load_row_ids can find the rows that may satisfy the condition without
+    scanning the table: comparisons answered by an index or naming row ids, ANDs
+    with one such operand and ORs of such operands
+    """
+    if isinstance(value_filter, AndFilter):
+        return any(
+            can_load_row_ids(catalog, table, operand) for operand in value_filter.operands
+        )
+    if isinstance(value_filter, OrFilter):
+        return all(
+            can_load_row_ids(catalog, table, operand) for operand in value_filter.operands
+        )
+    if isinstance(value_filter, ValueFilter):
+        return (
+            find_index_for_filter(catalog, table.name, value_filter) is not None
+            or get_row_id_points(table, value_filter) is not None
+        )
+
+    return False
+
+
+def load_row_ids(
+    pager: Pager, catalog: Catalog, table: TableInfo, value_filter: RowFilter
+) -> List[int]:
+    """
+    Sorted row ids of the rows that may satisfy a condition can_load_row_ids accepts:
+    the row ids of the operands of an AND are intersected, the ones of an OR merged
+    """
+    if isinstance(value_filter, AndFilter):
+        row_ids = None
+        for operand in value_filter.operands:
+            if not can_load_row_ids(catalog, table, operand):
+                continue
+            operand_row_ids = load_row_ids(pager, catalog, table, operand)
+            row_ids = (
+                operand_row_ids
+                if row_ids is None
+                else intersect_sorted_row_ids(row_ids, operand_row_ids)
             )
+            if not row_ids:
+                break
+        return row_ids
+
+    if isinstance(value_filter, OrFilter):
+        return union_sorted_row_ids(
+            [
+                load_row_ids(pager, catalog, table, operand)
+                for operand in value_filter.operands
+            ]
         )
 
+    row_ids = get_row_id_points(table, value_filter)
+    if row_ids is not None:
+        return row_ids
+
+    index = find_index_for_filter(catalog, table.name, value_filter)
+    return load_filter_compliant_row_ids_via_index(
+        pager, index, value_filter.key_ranges()
+    )
+
+
+def intersect_sorted_row_ids(left: List[int], right: List[int]) -> List[int]:
+    """
+    Row ids of both sorted lists. Each row id of the shorter list is binary searched
+    in the longer one, from where the previous search stopped.
+    """
+    if len(left) > len(right):
+        left, right = right, left
+
+    row_ids = []
+    position = 0
+    for row_id in left:
+        position = bisect_left(right, row_id, position)
+        if position == len(right):
+            break
+        if right[position] == row_id:
+            row_ids.append(row_id)
+
+    return row_ids
+
+
+def union_sorted_row_ids(row_id_lists: List[List[int]]) -> List[int]:
+    """
+    Row ids of any of the sorted lists, merged in order without duplicates
+    """
+    return list(dict.fromkeys(heapq.merge(*row_id_lists)))
+
+
+def load_access_row_ids(
+    pager: Pager, catalog: Catalog, table: TableInfo, access: AccessPath
+) -> Optional[List[int]]:
+    """
+    The sorted row ids the access path looks up, or None when it reads whole leaf
+    pages (full scans and row id ranges)
+    """
+    if access.row_id_ranges is not None:
+        return get_row_id_points(table, access.access_filter)
+    if access.index is not None:
+        return load_filter_compliant_row_ids_via_index(
+            pager, access.index, access.index_key_ranges()
+        )
+    if access.row_id_filters:
+        return load_row_ids(
+            pager, catalog, table, combine_conjuncts(access.row_id_filters)
+        )
+
+    return None
+
+
+def iter_table_rows(
+    pager: Pager,
+    catalog: Catalog,
+    table: TableInfo,
+    access: AccessPath,
+    column_ordinals: List[int],
+) -> Iterator[Tuple[any, ...]]:
+    """
+    Decodes the rows the access path finds, which the filter still has to be applied
+    to. When it gives row ids, the other rows of their leaf pages are skipped
+    without being decoded.
+    """
+    row_ids = load_access_row_ids(pager, catalog, table, access)
+    real_columns = table.real_ordinals
+    defaults = table.default_ordinals
+    if row_ids is None:
+        for page in get_table_leaf_pages(pager, catalog, table.name, access):
+            yield from page.iter_records(
+                pager, column_ordinals, real_columns, defaults
+            )
+        return
+
+    wanted = set(row_ids)
+    page = load_page_at_location(pager, table.rootpage - 1)
+    for leaf_page in page.iter_table_leaf_pages(pager, row_ids):
+        for _, row in leaf_page.iter_records_by_row_id(
+            pager, wanted, column_ordinals, real_columns, defaults
+        ):
+            yield row
+
+
+def describe_sort(limit: Optional[int]) -> str:
+    if limit is not None:
+        return f"SORT TOP {limit} IN A HEAP"
+
+    return f"SORT IN RUNS OF {SORT_MAX_ROWS} ROWS MERGED FROM DISK"
+
 
 def get_table_leaf_pages(
-    database_file: BinaryIO,
-    sqlite_schema: List[Schema],
+    pager: Pager,
+    catalog: Catalog,
     table_name: str,
-    value_filter: Optional[ValueFilter],
-    page_size: int,
-) -> List[Page]:
+    access: Optional[AccessPath],
+) -> Iterator[Page]:
     """
-    Given a table name, return all the pages contianing rows for the table.
+    Given a table name, lazily yield all the pages contianing rows for the table,
+    or only the ones holding the rows the access path looks up.
 
     If the table is small and fits in a single page, just return that leaf page.
     Else, read the interior node representing the table and, for each pointer,
     collect the pointed page.
     """
+    table = catalog.table(table_name)
+    page = load_page_at_location(pager, table.rootpage - 1)
+    if access is None:
+        return page.iter_table_leaf_pages(pager)
 
-    # If there's a WHERE clause, search if there's an index we should use
-    row_ids = None
-    if value_filter:
-        index_name = generate_index_name(table_name, value_filter.column)
-        index_schema = next(
-            (schema for schema in sqlite_schema if schema.table_name == index_name),
-            None,
-        )
+    # A filter on the row id alias is answered by descending the table b-tree itself
+    row_id_ranges = access.row_id_ranges
+    if row_id_ranges is not None and get_row_id_points(table, access.access_filter) is None:
+        return iter_table_leaf_pages_in_ranges(pager, page, row_id_ranges)
 
-        if index_schema:
-            row_ids = load_filter_compliant_row_ids_via_index(
-                database_file, index_schema, value_filter, page_size
-            )
+    row_ids = load_access_row_ids(pager, catalog, table, access)
+    return page.iter_table_leaf_pages(pager, row_ids)
 
-    table_schema = next(
-        (schema for schema in sqlite_schema if schema.table_name == table_name),
-        None,
-    )
 
-    desired_table_rootpage = table_schema.rootpage - 1
-    page = load_page_at_location(database_file, desired_table_rootpage, page_size)
+def iter_table_leaf_pages_in_ranges(
+    pager: Pager, root_page: Page, key_ranges: List[KeyRange]
+) -> Iterator[Page]:
+    """
+    Yields the leaf pages overlapping any of the sorted row id ranges, each page once.
+    """
+    last_page_start = None
+    for key_range in key_ranges:
+        for page in root_page.iter_table_leaf_pages_in_range(pager, key_range):
+            if page.start != last_page_start:
+                last_page_start = page.start
+                yield page
+
+
+def get_row_id_key_ranges(
+    table: TableInfo, value_filter: Optional[RowFilter]
+) -> Optional[List[KeyRange]]:
+    """
+    If the filter is a comparison of the column aliasing the row id of the table,
+    return the row id ranges it selects. Returns None when the table b-tree can't be used.
+    """
+    if (
+        not isinstance(value_filter, ValueFilter)
+        or value_filter.column != table.row_id_alias
+    ):
+        return None
+
+    key_ranges = value_filter.key_ranges()
+    if key_ranges is None:
+        return None
+
+    # row ids are integers, bounds that aren't numbers can't be searched for
+    for key_range in key_ranges:
+        for bound in ("lower", "upper"):
+            value = apply_affinity(getattr(key_range, bound), "INTEGER")
+            if value is not None and not isinstance(value, (int, float)):
+                return None
+            setattr(key_range, bound, value)
+
+    return key_ranges
+
 
-    return page.load_table_leaf_pages(database_file, page_size, row_ids)
+def get_row_id_points(table: TableInfo, value_filter: RowFilter) -> Optional[List[int]]:
+    """
+    The sorted row ids a "=" or "IN" filter on the row id alias names, None for
+    other filters
+    """
+    key_ranges = get_row_id_key_ranges(table, value_filter)
+    if key_ranges is None or any(
+        key_range.lower != key_range.upper for key_range in key_ranges
+    ):
+        return None
+
+    # point ranges are already sorted
+    return [key_range.lower for key_range in key_ranges]
+
+
+def get_table_leaf_page_indices(
+    pager: Pager, catalog: Catalog, table_name: str
+) -> List[int]:
+    """
+    Given a table name, return the 0-based indices of all its leaf pages, in row id order.
+    """
+    page = load_page_at_location(pager, catalog.table(table_name).rootpage - 1)
+
+    return list(page.iter_table_leaf_page_indices(pager))
 
 
 def load_filter_compliant_row_ids_via_index(
-    database_file: BinaryIO,
-    index_schema: Schema,
-    value_filter: ValueFilter,
-    page_size: int,
+    pager: Pager,
+    index: IndexInfo,
+    key_ranges: List[KeyRange],
 ) -> List[int]:
     """
-    Given an index and a value filter representing a WHERE condition,
-    return row IDs for payloads satisfying the condition.
+    Given an index and the key ranges a WHERE condition bounds it with (see
+    AccessPath.index_key_ranges), return row IDs for payloads in those ranges.
     """
-    desired_table_rootpage = index_schema.rootpage - 1
+    page = load_page_at_location(pager, index.rootpage - 1)
+
+    return page.load_filter_compliant_row_ids(pager, key_ranges, index.collations)
+
 
-    page = load_page_at_location(database_file, desired_table_rootpage, page_size)
+def resolve_index_key_positions(
+    table: TableInfo, index: IndexInfo, column_names: List[str]
+) -> Optional[List[int]]:
+    """
+    Positions of the columns in the keys of the index (indexed columns then row id),
+    or None if the index does not cover all of them
+    """
+    positions = []
+    for column_name in column_names:
+        if column_name == table.row_id_alias:
+            positions.append(len(index.columns))
+        elif column_name in index.columns:
+            positions.append(index.columns.index(column_name))
+        else:
+            return None
 
-    return page.load_filter_compliant_row_ids(database_file, value_filter, page_size)
+    return positions
 
 
-def get_column_names_from_creation_query(sql_creation_query: str) -> List[str]:
+def iter_rows_via_covering_index(
+    pager: Pager,
+    index: IndexInfo,
+    key_ranges: List[KeyRange],
+    key_positions: List[int],
+    real_key_positions: FrozenSet[int] = frozenset(),
+) -> Iterator[Tuple[any, ...]]:
+    """
+    Yields the rows of the index entries in the key ranges as tuples of the given index
+    key positions, without ever reading the table b-tree. See apply_real_affinity for
+    "real_key_positions".
     """
-    Creation query will look like
+    page = load_page_at_location(pager, index.rootpage - 1)
 
-    b'''CREATE TABLE apples
-    (
-        id integer primary key autoincrement,
-        name text,
-        color text
-    )'''
+    for key in page.iter_filter_compliant_keys(pager, key_ranges, index.collations):
+        yield apply_real_affinity(
+            tuple(key[position] for position in key_positions),
+            key_positions,
+            real_key_positions,
+        )
 
-    We must extract the inner tokens form the last token to access the names
 
-    SQLparse is not well fit for parsing the creation query. As such,
-    we opt for a more manual choice of regex matching the column description and
-    stripping all sqlite keywords to just keep the column names
+def find_index_for_order(
+    catalog: Catalog, table: TableInfo, order_columns: List[str]
+) -> Optional[IndexInfo]:
+    """
+    Returns an index whose keys (indexed columns then row id) sort like the given
+    ascending ORDER BY columns, text with the collating sequence of each column, if
+    any. Narrower indexes are preferred.
     """
-    reserved_sqlite_keywords = [
-        "autoincrement",
-        "primary key",
-        "not null",
-        "text",
-        "integer",
-        ",",
+    collations = [
+        table.collations.get(column, DEFAULT_COLLATION) for column in order_columns
+    ]
+    candidates = [
+        index
+        for index in table.indexes
+        if not index.is_partial
+        and (index.columns + [table.row_id_alias])[: len(order_columns)] == order_columns
+        and index.sorts_in_order(collations)
     ]
 
-    sql_creation_query = sql_creation_query.replace("\n", "")
-    sql_creation_query = sql_creation_query.replace("\t", "")
+    return min(candidates, key=lambda index: len(index.columns), default=None)
 
-    # find the content inside parenthesis
-    match = re.search(TABLE_CREATION_REGEX, sql_creation_query)
-    if match:
-        sql_creation_query = match.group(1)
-    else:
-        raise ValueError(
-            "Could not regex match sql creation query.", sql_creation_query
-        )
 
-    for keyword in reserved_sqlite_keywords:
-        sql_creation_query = sql_creation_query.replace(keyword, "")
+def walks_like(index: IndexInfo, other: IndexInfo, width: int) -> bool:
+    """
+    Whether the first "width" columns of both indexes are the same, sorted the same
+    way, so that key ranges bounding them in one can walk the other
+    """
+    return (
+        index.columns[:width] == other.columns[:width]
+        and index.collations[:width] == other.collations[:width]
+        and index.descending[:width] == other.descending[:width]
+    )
 
-    sql_creation_query = re.sub(r"\s+", " ", sql_creation_query).strip()
 
-    # return all words or quoted strings
-    return re.findall(r'"[^"]*"|\S+', sql_creation_query)
+def iter_rows_by_row_id(
+    pager: Pager,
+    table: TableInfo,
+    row_ids: Iterable[int],
+    column_ordinals: List[int],
+    limit: Optional[int] = None,
+) -> Iterator[Tuple[any, ...]]:
+    """
+    Yields the rows of the given row ids, in the order of "row_ids". Row ids are looked
+    up in batches, each one descending the table b-tree once in row id order.
+    Batches start at "limit" row ids and double up to ROW_FETCH_BATCH, so a small LIMIT
+    doesn't fetch more rows than it needs to.
+    """
+    page = load_page_at_location(pager, table.rootpage - 1)
+    real_columns = table.real_ordinals
+    defaults = table.default_ordinals
+    batch_size = min(limit or ROW_FETCH_BATCH, ROW_FETCH_BATCH)
+    row_ids = iter(row_ids)
+    while batch := list(islice(row_ids, batch_size)):
+        wanted = set(batch)
+        rows_by_row_id = {}
+        for leaf_page in page.iter_table_leaf_pages(pager, sorted(wanted)):
+            rows_by_row_id.update(
+                leaf_page.iter_records_by_row_id(
+                    pager, wanted, column_ordinals, real_columns, defaults
+                )
+            )
 
+        for row_id in batch:
+            yield rows_by_row_id[row_id]
 
-def generate_index_name(table_name: str, column_name: str) -> str:
-    return f"idx_{table_name}_{column_name}"
+        batch_size = min(batch_size * 2, ROW_FETCH_BATCH)
 
 
-def get_index_on_column_if_exists(
-    table_name: str, sqlite_schema: List[Schema], value_filter: ValueFilter
-) -> Optional[Schema]:
-    if value_filter:
-        index_name = generate_index_name(table_name, value_filter.column)
+def find_index_for_filter(
+    catalog: Catalog, table_name: str, value_filter: Optional[RowFilter]
+) -> Optional[IndexInfo]:
+    """
+    Returns an index led by the column a comparison filters, if any and if it can narrow
+    down the rows. Operators like "!=" can't narrow down an index walk, they are better
+    served by a scan
+    """
+    if not isinstance(value_filter, ValueFilter) or value_filter.key_ranges() is None:
+        return None
+
+    # an index sorted with another collating sequence would find other rows
+    return catalog.find_index(
+        table_name, value_filter.column, value_filter.column_type.collation
+    )
+
+
+def project_row(row: Tuple[any, ...], positions: Sequence[int]) -> List[any]:
+    """
+    Picks the given positions of a decoded row
+    """
+    return [row[position] for position in positions]
+
+
+def format_row(row: Sequence[any]) -> str:
+    """
+    Columns separated by "|", rendered like the sqlite3 shell does
+    """
+    return "|".join([format_value(entry) for entry in row])
+
+
+def format_value(value: any) -> str:
+    if value is None:
+        return ""
+
+    if type(value) is bytes:
+        # blobs are printed as is, like the sqlite3 shell does
+        return value.decode("utf-8", errors="replace")
+
+    if type(value) is float:
+        return real_to_text(value)
+
+    return str(value)
 
-        return next(
-            (schema for schema in sqlite_schema if schema.table_name == index_name),
-            None,
-        )
@@ -1,21 +1,28 @@
-from app.consts import LAST_SEVEN_BITS_MASK
-from typing import BinaryIO, Tuple, List
+import struct
+
+from app.consts import LAST_SEVEN_BITS_MASK, ROW_ID_ORDINAL
+from typing import Tuple, List, Optional, Sequence, AbstractSet, Mapping
 
 
 def page_start(page_index, page_size):
     return page_index * page_size
 
 
-def read_varint(stream: BinaryIO) -> Tuple[int, int]:
+def read_varint(buffer: memoryview, offset: int) -> Tuple[int, int]:
     # https://www.sqlite.org/fileformat.html#varint
 
+    # Fast path, most varints (serial types, small row ids) fit in a single byte
+    byte = buffer[offset]
+    if byte < 0b_1000_0000:
+        return byte, 1
+
     value = 0
     byte_count = 0
     for c in range(9):
         byte_count += 1
         value <<= 7 if c < 8 else 8
 
-        byte = stream.read(1)[0]
+        byte = buffer[offset + c]
         # Continue extracting the 7 least significant bits until the most significant bit is 0
         value += byte & (LAST_SEVEN_BITS_MASK if c < 8 else 0b_1111_1111)
         if (byte & 0b_1000_0000) == 0:
@@ -24,57 +31,220 @@ def read_varint(stream: BinaryIO) -> Tuple[int, int]:
     return value, byte_count
 
 
-def read_table_record(stream: BinaryIO, row_id: int = None) -> List[any]:
+def read_record_header(buffer: memoryview, offset: int) -> Tuple[List[int], int]:
+    """
+    Reads the serial types of a record starting at "offset".
+    Returns them along with the header size, i.e. where the body starts relative to "offset"
+    """
     # Reference record format in https://saveriomiroddi.github.io/SQLIte-database-file-format-diagrams/
-    header_size, num_header_bytes = read_varint(stream)
+    header_size, num_header_bytes = read_varint(buffer, offset)
 
     i = num_header_bytes
     # read all the other bytes past the bytes used to declare the header size
     serial_types = []
     while i < header_size:
-        serial_type, bytes_used = read_varint(stream)
-        i += bytes_used
+        serial_type = buffer[offset + i]
+        if serial_type < 0b_1000_0000:
+            i += 1
+        else:
+            serial_type, bytes_used = read_varint(buffer, offset + i)
+            i += bytes_used
         serial_types.append(serial_type)
 
-    record_columns = [
-        read_column_value(stream, serial_type) for serial_type in serial_types
-    ]
-
-    # According to SQLite docs
-    # When an SQL table includes an INTEGER PRIMARY KEY column (which aliases the rowid)
-    # then that column appears in the record as a NULL value. SQLite will always use the
-    # table b-tree key rather than the NULL value when referencing the INTEGER PRIMARY KEY column.
-    if row_id:
-        record_columns[0] = row_id
+    return serial_types, header_size
+
+
+def read_table_record(
+    buffer: memoryview,
+    offset: int,
+    row_id: int = None,
+    columns: Optional[Sequence[int]] = None,
+    text_encoding: str = "utf-8",
+    defaults: Optional[Mapping[int, any]] = None,
+) -> List[any]:
+    """
+    Decodes the record starting at "offset", text with "text_encoding".
+
+    Args:
+        columns (list(int)): ordinals of the columns to decode. When provided, only those
+            are decoded and returned as a tuple in the same order, every other column
+            is skipped by adding up the sizes declared by its serial type.
+            ROW_ID_ORDINAL is decoded as "row_id".
+            All columns are decoded in case nothing is provided
+        defaults (dict(int, any)): see apply_column_defaults
+
+    According to SQLite docs
+    When an SQL table includes an INTEGER PRIMARY KEY column (which aliases the rowid)
+    then that column appears in the record as a NULL value. SQLite will always use the
+    table b-tree key rather than the NULL value when referencing the INTEGER PRIMARY KEY column.
+    Such columns must be requested as ROW_ID_ORDINAL, see TableInfo.resolve_column_ordinals.
+    """
+    serial_types, header_size = read_record_header(buffer, offset)
+
+    if columns is not None:
+        values = tuple(
+            row_id
+            if ordinal == ROW_ID_ORDINAL
+            else read_column_value(buffer, column_offset, serial_type, text_encoding)
+            for ordinal, (column_offset, serial_type) in zip(
+                columns, locate_record_columns(serial_types, offset + header_size, columns)
+            )
+        )
+        return apply_column_defaults(values, columns, len(serial_types), defaults)
+
+    # the body starts right after the header, each column is laid out back to back
+    column_offset = offset + header_size
+    record_columns = []
+    for serial_type in serial_types:
+        record_columns.append(
+            read_column_value(buffer, column_offset, serial_type, text_encoding)
+        )
+        column_offset += serial_type_size(serial_type)
 
     return record_columns
 
 
-def read_column_value(stream, serial_type):
+def apply_real_affinity(
+    values: Sequence[any], columns: Optional[Sequence[int]], real_columns: AbstractSet[int]
+) -> Sequence[any]:
+    """
+    Converts the integers decoded from REAL affinity columns to floats: SQLite stores
+    their integral values as integers to save space, but reads them back as reals.
+
+    Args:
+        columns (list(int)): ordinals of the decoded values, see read_table_record
+        real_columns (set(int)): ordinals of the REAL affinity columns
+    """
+    if not real_columns:
+        return values
+    if columns is None:
+        columns = range(len(values))
+
+    return type(values)(
+        float(value) if type(value) is int and ordinal in real_columns else value
+        for ordinal, value in zip(columns, values)
+    )
+
+
+def apply_column_defaults(
+    values: Tuple[any, ...],
+    columns: Sequence[int],
+    record_length: int,
+    defaults: Optional[Mapping[int, any]],
+) -> Tuple[any, ...]:
+    """
+    Replaces the values of the columns past the end of a record, read as NULLs, by
+    their default: records written before ALTER TABLE ADD COLUMN hold fewer columns.
+
+    Args:
+        columns (list(int)): ordinals of the decoded values, see read_table_record
+        record_length (int): number of columns in the record
+        defaults (dict(int, any)): default value by ordinal, see TableInfo.default_ordinals
+    """
+    if not defaults or max(columns, default=-1) < record_length:
+        return values
+
+    return tuple(
+        defaults.get(ordinal) if ordinal >= record_length else value
+        for ordinal, value in zip(columns, values)
+    )
+
+
+def locate_record_columns(
+    serial_types: List[int], body_offset: int, columns: Sequence[int]
+) -> List[Tuple[int, int]]:
+    """
+    Returns the (offset, serial type) of each of the given column ordinals, without
+    decoding anything. Ordinals past the end of the record (e.g. columns added with
+    ALTER TABLE after the row was written, see apply_column_defaults) and
+    ROW_ID_ORDINAL are reported as NULLs.
+    """
+    last_ordinal = min(max(columns, default=-1), len(serial_types) - 1)
+
+    offsets = []
+    column_offset = body_offset
+    for ordinal in range(last_ordinal + 1):
+        offsets.append(column_offset)
+        column_offset += serial_type_size(serial_types[ordinal])
+
+    return [
+        (offsets[ordinal], serial_types[ordinal])
+        if 0 <= ordinal <= last_ordinal
+        else (0, 0)
+        for ordinal in columns
+    ]
+
+
+def local_payload_size(payload_size: int, usable_size: int, is_index: bool) -> int:
+    """
+    Number of payload bytes stored in the cell itself, the rest spills to overflow pages.
+    See https://www.sqlite.org/fileformat.html#b_tree_pages
+    """
+    if is_index:
+        max_local = ((usable_size - 12) * 64 // 255) - 23
+    else:
+        max_local = usable_size - 35
+
+    if payload_size <= max_local:
+        return payload_size
+
+    min_local = ((usable_size - 12) * 32 // 255) - 23
+    local_size = min_local + ((payload_size - min_local) % (usable_size - 4))
+
+    return local_size if local_size <= max_local else min_local
+
+
+# Size of the values of serial types 0 to 11 (8 and 9 stand for the constants 0 and 1,
+# 10 and 11 are reserved), larger ones are blobs (even) and text (odd)
+SERIAL_TYPE_SIZES = (0, 1, 2, 3, 4, 6, 8, 8, 0, 0, 0, 0)
+# Unpackers of the fixed-width serial types, indexed by serial type: big-endian two's
+# complement integers and big-endian IEEE 754 doubles. struct has no 24 and 48 bit
+# formats, those are read with int.from_bytes.
+SERIAL_TYPE_UNPACKERS = (
+    None,
+    struct.Struct(">b").unpack_from,
+    struct.Struct(">h").unpack_from,
+    None,
+    struct.Struct(">i").unpack_from,
+    None,
+    struct.Struct(">q").unpack_from,
+    struct.Struct(">d").unpack_from,
+)
+SERIAL_TYPE_CONSTANTS = {8: 0, 9: 1}
+
+
+def serial_type_size(serial_type: int) -> int:
+    # https://www.sqlite.org/fileformat.html#record_format
+    if serial_type < 12:
+        return SERIAL_TYPE_SIZES[serial_type]
+
+    return (serial_type - 12) // 2
+
+
+def read_column_value(
+    buffer: memoryview, offset: int, serial_type: int, text_encoding: str = "utf-8"
+) -> any:
+    """
+    Decodes a value of the given serial type: None, an int, a float, a str for text
+    (decoded with the database text encoding) or bytes for blobs
+    """
     if serial_type == 0:
         return None
-    elif serial_type == 1:
-        return int.from_bytes(stream.read(1), "big")
-    elif serial_type == 2:
-        return int.from_bytes(stream.read(2), "big")
-    elif serial_type == 3:
-        return int.from_bytes(stream.read(3), "big")
-    elif serial_type == 4:
-        return int.from_bytes(stream.read(4), "big")
-    elif serial_type == 5:
-        return int.from_bytes(stream.read(6), "big")
-    elif serial_type == 6:
-        return int.from_bytes(stream.read(), "big")
-    elif serial_type == 8:
-        return 0
-    elif serial_type == 9:
-        return 1
-    elif (serial_type >= 13) and (serial_type % 2 == 1):
-        n_bytes = (serial_type - 13) // 2
-        return stream.read(n_bytes)
-    elif (serial_type >= 12) and (serial_type % 2 == 0):
-        n_bytes = (serial_type - 12) // 2
-        return stream.read(n_bytes)
 
-    else:
-        raise Exception(f"Unknown serial_type {serial_type}")
+    if serial_type < 8:
+        unpack = SERIAL_TYPE_UNPACKERS[serial_type]
+        if unpack is not None:
+            return unpack(buffer, offset)[0]
+        end = offset + SERIAL_TYPE_SIZES[serial_type]
+        return int.from_bytes(buffer[offset:end], "big", signed=True)
+
+    if serial_type >= 12:
+        end = offset + (serial_type - 12) // 2
+        if serial_type & 1:
+            return str(buffer[offset:end], text_encoding)
+        return bytes(buffer[offset:end])
+
+    if serial_type in SERIAL_TYPE_CONSTANTS:
+        return SERIAL_TYPE_CONSTANTS[serial_type]
+
+    raise ValueError(f"Unknown serial_type {serial_type}")
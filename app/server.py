@@ -0,0 +1,171 @@
+"""
+Long running query server: keeps the database mapped, with its catalog and parsed
+pages cached, and answers commands read one per line from stdin or a unix socket.
+
+    python3 -m app.server databases/companies.db
+    python3 -m app.server databases/companies.db --socket /tmp/viewer.sock
+
+Each command (".dbinfo", ".tables" or a SELECT query) is answered with its output
+lines followed by an empty line. Failures are answered with a single "Error: ..." line.
+Commands run concurrently in a thread pool, responses are sent back in request order.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app.catalog import Catalog
+from app.commands import iter_command_output
+from app.consts import DEFAULT_PAGE_CACHE_PAGES, SERVER_PENDING_PER_THREAD
+from app.pager import Pager
+from app.pages import load_page_at_location
+
+from typing import Awaitable, Callable, Tuple
+
+
+class Database:
+    """
+    The open database and its catalog, shared by every query the server runs.
+
+    Before each command the file change counter is checked, and the file is mapped
+    again with a fresh catalog and page cache if another process wrote to it.
+    """
+
+    database_file_path: str
+    cache_pages: int
+    pager: Pager
+    catalog: Catalog
+
+    def __init__(self, database_file_path: str, cache_pages: int):
+        self.database_file_path = database_file_path
+        self.cache_pages = cache_pages
+        self._lock = threading.Lock()
+        self._open()
+
+    def _open(self):
+        pager = Pager(self.database_file_path, self.cache_pages)
+        catalog = Catalog.from_schema(
+            load_page_at_location(pager, 0).read_sqlite_schema(pager)
+        )
+        # The previous pager is not closed, queries still running keep reading it
+        # and its map is released once they are done with it
+        self.pager, self.catalog = pager, catalog
+
+    def snapshot(self) -> Tuple[Pager, Catalog]:
+        """
+        Returns an up to date pager and catalog, to be used together for a whole command
+        """
+        with self._lock:
+            if self.pager.is_stale():
+                print("Database changed on disk, reloading", file=sys.stderr)
+                self._open()
+
+            return self.pager, self.catalog
+
+    def answer(self, command: str) -> bytes:
+        try:
+            pager, catalog = self.snapshot()
+            lines = list(iter_command_output(pager, catalog, command))
+        except Exception as error:
+            lines = [f"Error: {error}"]
+
+        return "".join(f"{line}\n" for line in lines + [""]).encode("utf-8")
+
+
+async def serve_lines(
+    database: Database,
+    executor: ThreadPoolExecutor,
+    reader: asyncio.StreamReader,
+    send: Callable[[bytes], Awaitable[None]],
+    max_pending: int,
+):
+    """
+    Answers every command read from "reader" until it is exhausted. Up to "max_pending"
+    commands run at once, their responses are sent in the order they were received.
+    """
+    loop = asyncio.get_running_loop()
+    pending: asyncio.Queue = asyncio.Queue(max_pending)
+
+    async def respond():
+        while (response := await pending.get()) is not None:
+            await send(await response)
+
+    responder = asyncio.create_task(respond())
+    while line := await reader.readline():
+        command = line.decode("utf-8").strip()
+        if command:
+            await pending.put(loop.run_in_executor(executor, database.answer, command))
+
+    await pending.put(None)
+    await responder
+
+
+async def serve_stdin(database: Database, executor: ThreadPoolExecutor, max_pending: int):
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), sys.stdin
+    )
+
+    async def send(response: bytes):
+        sys.stdout.buffer.write(response)
+        sys.stdout.buffer.flush()
+
+    await serve_lines(database, executor, reader, send, max_pending)
+
+
+async def serve_socket(
+    database: Database, executor: ThreadPoolExecutor, max_pending: int, path: str
+):
+    async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        async def send(response: bytes):
+            writer.write(response)
+            await writer.drain()
+
+        try:
+            await serve_lines(database, executor, reader, send, max_pending)
+        finally:
+            writer.close()
+
+    server = await asyncio.start_unix_server(handle_client, path)
+    print(f"Listening on {path}", file=sys.stderr)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("database_file_path")
+    parser.add_argument(
+        "--socket", help="unix socket path to listen on, stdin is read otherwise"
+    )
+    parser.add_argument(
+        "--threads", type=int, default=4, help="number of commands run at once"
+    )
+    parser.add_argument("--cache-pages", type=int, default=DEFAULT_PAGE_CACHE_PAGES)
+    parser.add_argument(
+        "--stats", action="store_true", help="print page cache statistics to stderr"
+    )
+    args = parser.parse_args()
+
+    database = Database(args.database_file_path, args.cache_pages)
+    max_pending = args.threads * SERVER_PENDING_PER_THREAD
+    with ThreadPoolExecutor(args.threads) as executor:
+        if args.socket:
+            serve = serve_socket(database, executor, max_pending, args.socket)
+        else:
+            serve = serve_stdin(database, executor, max_pending)
+
+        try:
+            asyncio.run(serve)
+        except KeyboardInterrupt:
+            pass
+
+    if args.stats:
+        print(f"Page cache: {database.pager.page_cache.stats}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
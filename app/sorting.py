@@ -0,0 +1,110 @@
+from __future__ import annotations
+import heapq
+from dataclasses import dataclass
+from itertools import islice
+
+from app.aggregation import Aggregate, read_pickled
+from app.consts import SORT_MAX_ROWS
+from app.filtering import sqlite_order_key
+
+from typing import List, Optional, Iterator, Iterable, Tuple, Union, Callable
+
+
+@dataclass(frozen=True)
+class OrderTerm:
+    """
+    One ORDER BY term: a column, or an aggregate of the select list
+    """
+
+    item: Union[str, Aggregate]
+    descending: bool = False
+
+
+class Descending:
+    """
+    Wraps a sort key so it sorts in reverse, keys of different
+    types can't be negated
+    """
+
+    __slots__ = ("key",)
+
+    def __init__(self, key: any):
+        self.key = key
+
+    def __lt__(self, other: Descending) -> bool:
+        return other.key < self.key
+
+    def __eq__(self, other: Descending) -> bool:
+        return self.key == other.key
+
+
+def make_sort_key(
+    positions: List[int],
+    descending: List[bool],
+    order_keys: Optional[List[Callable[[any], Tuple[int, any]]]] = None,
+) -> Callable[[Tuple[any, ...]], Tuple[any, ...]]:
+    """
+    Sort key of rows ordered by the values at "positions", NULLs first when ascending
+    and values compared across storage classes like SQLite. "order_keys" gives the key
+    of each term's values, comparing text with the collating sequence of its column
+    (see IndexKeyOrder.order_key), sqlite_order_key (BINARY) by default.
+    """
+    order_keys = order_keys or [sqlite_order_key] * len(positions)
+    terms = list(zip(positions, descending, order_keys))
+
+    def sort_key(row: Tuple[any, ...]) -> Tuple[any, ...]:
+        return tuple(
+            Descending(order_key(row[position]))
+            if is_descending
+            else order_key(row[position])
+            for position, is_descending, order_key in terms
+        )
+
+    return sort_key
+
+
+def sort_rows(
+    rows: Iterable[Tuple[any, ...]],
+    sort_key: Callable[[Tuple[any, ...]], Tuple[any, ...]],
+    limit: Optional[int] = None,
+    max_rows: int = SORT_MAX_ROWS,
+) -> Iterator[Tuple[any, ...]]:
+    """
+    Yields the rows in "sort_key" order, rows with equal keys keeping their input order.
+
+    With a LIMIT, only the first "limit" rows are kept in a bounded heap while the
+    input streams through. Otherwise rows are sorted in runs of at most "max_rows",
+    each run past the first being spilled to a temporary file, and the runs are merged.
+    """
+    if limit is not None and limit <= max_rows:
+        # heapq.nsmallest keeps a heap of "limit" rows and is stable
+        yield from heapq.nsmallest(limit, rows, key=sort_key)
+        return
+
+    rows = iter(rows)
+    run = sorted(islice(rows, max_rows), key=sort_key)
+    if len(run) < max_rows:
+        yield from run if limit is None else run[:limit]
+        return
+
+    # pickle and tempfile are slow to import, they are only loaded once spilling
+    import pickle
+    import tempfile
+
+    run_files = []
+    try:
+        while run:
+            run_file = tempfile.TemporaryFile()
+            for row in run:
+                pickle.dump(row, run_file, pickle.HIGHEST_PROTOCOL)
+            run_file.seek(0)
+            run_files.append(run_file)
+            run = sorted(islice(rows, max_rows), key=sort_key)
+
+        # merge keeps rows of earlier runs first among equal keys
+        merged = heapq.merge(*map(read_pickled, run_files), key=sort_key)
+        yield from merged if limit is None else islice(merged, limit)
+    finally:
+        for run_file in run_files:
+            run_file.close()
+
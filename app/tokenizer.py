@@ -0,0 +1,143 @@
+from __future__ import annotations
+import re
+from dataclasses import dataclass
+
+from typing import List, Optional
+
+# One alternative per token kind, whitespace and comments are matched without a group
+TOKEN_REGEX = re.compile(
+    r"""
+    \s+ | --[^\n]* | /\*.*?(?:\*/|$)
+    | (?P<number>(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?)
+    | (?P<string>'(?:[^']|'')*')
+    | (?P<quoted>"(?:[^"]|"")*"|`(?:[^`]|``)*`|\[[^\]]*\])
+    | (?P<name>[A-Za-z_][A-Za-z0-9_$]*)
+    | (?P<operator><=|>=|==|!=|<>|[=<>])
+    | (?P<punctuation>[(),.*;+-])
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+
+@dataclass
+class Token:
+    kind: str  # "number", "string", "quoted", "name", "operator" or "punctuation"
+    value: str  # text of the token, quotes removed for strings and quoted identifiers
+    position: int  # offset of the token in the SQL text
+
+    @property
+    def upper(self) -> str:
+        """
+        Upper-cased text of unquoted names, to compare against keywords.
+        Quoted identifiers never match a keyword.
+        """
+        return self.value.upper() if self.kind == "name" else ""
+
+    @property
+    def is_identifier(self) -> bool:
+        return self.kind in ("name", "quoted")
+
+
+def tokenize(sql: str) -> List[Token]:
+    tokens = []
+    position = 0
+    while position < len(sql):
+        match = TOKEN_REGEX.match(sql, position)
+        if match is None:
+            raise RuntimeError(f"Unexpected character {sql[position]!r} in {sql!r}")
+
+        kind = match.lastgroup
+        if kind is not None:
+            value = match.group(kind)
+            if kind == "string":
+                value = value[1:-1].replace("''", "'")
+            elif kind == "quoted":
+                value = unquote(value)
+            tokens.append(Token(kind, value, position))
+        position = match.end()
+
+    return tokens
+
+
+def unquote(identifier: str) -> str:
+    quote = identifier[0]
+    if quote == "[":
+        return identifier[1:-1]
+
+    return identifier[1:-1].replace(quote * 2, quote)
+
+
+class TokenStream:
+    """
+    Cursor over the tokens of a statement, for recursive descent parsers
+    """
+
+    sql: str
+    tokens: List[Token]
+    position: int
+
+    def __init__(self, sql: str):
+        self.sql = sql
+        self.tokens = tokenize(sql)
+        self.position = 0
+
+    def peek(self, offset: int = 0) -> Optional[Token]:
+        position = self.position + offset
+        return self.tokens[position] if position < len(self.tokens) else None
+
+    def next(self) -> Token:
+        token = self.peek()
+        if token is None:
+            raise self.error("Unexpected end of statement")
+        self.position += 1
+        return token
+
+    def at_end(self) -> bool:
+        return self.position >= len(self.tokens)
+
+    def at_keyword(self, *keywords: str) -> bool:
+        """
+        True if the next tokens are the given keywords, in order
+        """
+        for offset, keyword in enumerate(keywords):
+            token = self.peek(offset)
+            if token is None or token.upper != keyword:
+                return False
+
+        return True
+
+    def accept_keyword(self, *keywords: str) -> bool:
+        if not self.at_keyword(*keywords):
+            return False
+        self.position += len(keywords)
+        return True
+
+    def expect_keyword(self, *keywords: str):
+        if not self.accept_keyword(*keywords):
+            raise self.error(f"Expected {' '.join(keywords)}")
+
+    def accept(self, value: str) -> bool:
+        """
+        Consumes the next token if it is the given punctuation or operator
+        """
+        token = self.peek()
+        if token is None or token.kind not in ("punctuation", "operator") or token.value != value:
+            return False
+        self.position += 1
+        return True
+
+    def expect(self, value: str):
+        if not self.accept(value):
+            raise self.error(f"Expected '{value}'")
+
+    def expect_identifier(self) -> str:
+        token = self.peek()
+        if token is None or not token.is_identifier:
+            raise self.error("Expected a name")
+        self.position += 1
+        return token.value
+
+    def error(self, message: str) -> RuntimeError:
+        token = self.peek()
+        near = f"near {self.sql[token.position:token.position + 20]!r}" if token else "at end"
+        return RuntimeError(f"{message} {near} in {self.sql!r}")
@@ -0,0 +1,150 @@
+"""
+Runs queries on a generated database both with the app and with the sqlite3 module,
+and reports the ones whose rows differ.
+
+    python3 -m benchmarks.conformance [--rows 5000] [--encoding UTF-16le]
+
+The "items" table mixes what comparisons and decoding get wrong most easily: a REAL
+column holding integral values (read back as reals), a column declared without a type
+holding integers, reals, numeric text, words, blobs and NULLs, mixed-case text under
+the BINARY and NOCASE collations, and indexes on each of them so that both index
+searches and scans are checked. Rows are compared in any order, values with their
+type (3 and 3.0 differ). The exit status is 1 when some query differs.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+
+from app.catalog import Catalog
+from app.pager import Pager
+from app.pages import load_page_at_location
+from app.queries import Query
+
+from typing import Iterator, List, Tuple
+
+WORDS = ["alpha", "Alpha", "ALPHA", "bravo", "Bravo", "charlie", "delta ", "Delta"]
+MIXED_VALUES = [1, 2, 2.0, 2.5, "2", "2.0", " 3", "10", "abc", "Abc", b"2", b"abc"]
+
+QUERIES = [
+    # REAL column holding integral values
+    "SELECT id, price FROM items WHERE price = 3",
+    "SELECT id, price FROM items WHERE price > 2.5 AND price < '5'",
+    "SELECT id, price FROM items WHERE price IN (1, '2', 3.5)",
+    "SELECT COUNT(*) FROM items WHERE price BETWEEN 2 AND 4",
+    "SELECT MIN(price), MAX(price) FROM items",
+    "SELECT id, price, quantity FROM items WHERE quantity = 7",
+    # column declared without a type
+    "SELECT id, mixed FROM items WHERE mixed = 2",
+    "SELECT id, mixed FROM items WHERE mixed = '2'",
+    "SELECT COUNT(*) FROM items WHERE mixed > 5",
+    "SELECT COUNT(*) FROM items WHERE mixed < 'b'",
+    "SELECT COUNT(*) FROM items WHERE mixed >= 2 AND mixed <= '2'",
+    "SELECT id, mixed FROM items WHERE mixed IN (1, '10', 'abc')",
+    "SELECT COUNT(*) FROM items WHERE mixed NOT IN (2, 'abc')",
+    "SELECT COUNT(*) FROM items WHERE mixed != 2",
+    # mixed-case text, BINARY and NOCASE collations
+    "SELECT id, label FROM items WHERE label = 'Alpha'",
+    "SELECT COUNT(*) FROM items WHERE label NOT IN ('alpha', 'Bravo')",
+    "SELECT COUNT(*) FROM items WHERE NOT (label = 'alpha' OR price = 3)",
+    "SELECT COUNT(*) FROM items WHERE label > 'Bravo'",
+    "SELECT COUNT(*) FROM items WHERE label IN ('delta', 'delta ', NULL)",
+    "SELECT COUNT(*) FROM items WHERE NOT label IN ('delta', NULL)",
+    "SELECT COUNT(*) FROM items WHERE label LIKE 'AL%'",
+    "SELECT id, code FROM items WHERE code = 'ALPHA'",
+    "SELECT COUNT(*) FROM items WHERE code NOT IN ('alpha', 'BRAVO')",
+    "SELECT COUNT(*) FROM items WHERE code >= 'bravo' AND code < 'Delta'",
+    "SELECT COUNT(*) FROM items WHERE NOT (code = 'charlie' OR mixed = 2)",
+]
+
+
+def iter_generated_rows(rows: int, seed: int) -> Iterator[Tuple[any, ...]]:
+    generator = random.Random(seed)
+    for row_id in range(1, rows + 1):
+        yield (
+            row_id,
+            generator.choice(
+                [None, generator.randrange(6), generator.randrange(12) / 2]
+            ),
+            generator.choice([None, generator.randrange(10)]),
+            generator.choice([None, *MIXED_VALUES]),
+            generator.choice([None, *WORDS]),
+            generator.choice(WORDS),
+        )
+
+
+def generate_database(database_file_path: str, rows: int, seed: int, encoding: str):
+    connection = sqlite3.connect(database_file_path)
+    try:
+        connection.execute(f"PRAGMA encoding = '{encoding}'")
+        connection.execute(
+            "CREATE TABLE items (id INTEGER PRIMARY KEY, price REAL, quantity NUMERIC,"
+            " mixed, label TEXT, code TEXT COLLATE NOCASE)"
+        )
+        connection.executemany(
+            "INSERT INTO items VALUES (?, ?, ?, ?, ?, ?)",
+            iter_generated_rows(rows, seed),
+        )
+        for column in ("price", "mixed", "label", "code"):
+            connection.execute(f"CREATE INDEX idx_items_{column} ON items ({column})")
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def typed_rows(rows: List[Tuple[any, ...]]) -> List[Tuple[Tuple[str, any], ...]]:
+    """
+    Rows with each value paired with its type name, in a fixed order
+    """
+    return sorted(
+        (tuple((type(value).__name__, value) for value in row) for row in rows),
+        key=repr,
+    )
+
+
+def run_query(database_file_path: str, query: str) -> List[Tuple[any, ...]]:
+    with Pager(database_file_path) as pager:
+        catalog = Catalog.from_schema(
+            load_page_at_location(pager, 0).read_sqlite_schema(pager)
+        )
+        results = Query.parse_query(query).iter_results(pager, catalog)
+        return [tuple(row) for row in results]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--encoding", choices=["UTF-8", "UTF-16le", "UTF-16be"], default="UTF-8"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        database_file_path = os.path.join(data_dir, "conformance.db")
+        generate_database(database_file_path, args.rows, args.seed, args.encoding)
+        connection = sqlite3.connect(database_file_path)
+        try:
+            differing = 0
+            for query in QUERIES:
+                expected = typed_rows(connection.execute(query).fetchall())
+                actual = typed_rows(run_query(database_file_path, query))
+                if actual != expected:
+                    differing += 1
+                    print(f"DIFF {query}")
+                    print(f"  sqlite3: {len(expected)} rows, {expected[:5]}")
+                    print(f"  app:     {len(actual)} rows, {actual[:5]}")
+        finally:
+            connection.close()
+
+    print(f"{len(QUERIES) - differing}/{len(QUERIES)} queries return the same rows")
+    if differing:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+Exports a generated table with app.export and reads the files back, checking that
+every value survives the trip.
+
+    python3 -m benchmarks.export_check [--rows 2000]
+
+The "items" table holds integers past 2**53, reals, text with non ASCII characters,
+blobs that aren't valid UTF-8 and NULLs. CSV and JSON lines files are checked
+against the values read with the sqlite3 module, blobs being written as hexadecimal.
+Arrow and Parquet files (skipped when pyarrow isn't installed) must hold the same
+values with their types, and the "mixed" table (a real then an integer past 2**53,
+in a column without a declared type) must fail the export as float64 and leave no
+file. The exit status is 1 when a check fails.
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+from functools import partial
+
+from app.catalog import Catalog
+from app.export import (
+    ArrowExportWriter,
+    CsvExportWriter,
+    JsonLinesExportWriter,
+    export_query,
+    get_column_affinities,
+    get_column_names,
+    parse_export_source,
+)
+from app.pager import Pager
+from app.pages import load_page_at_location
+
+from typing import Callable, Iterator, List, Tuple
+
+WORDS = ["alpha", "Ünïcödé", "tab\tand\nnewline", "quote \" and , comma", ""]
+
+
+def iter_generated_rows(rows: int, seed: int) -> Iterator[Tuple[any, ...]]:
+    generator = random.Random(seed)
+    for row_id in range(1, rows + 1):
+        yield (
+            row_id,
+            generator.choice([None, generator.randrange(-(2**63), 2**63)]),
+            generator.choice([None, generator.uniform(-1e6, 1e6)]),
+            generator.choice([None, *WORDS]),
+            generator.choice([None, generator.randbytes(generator.randrange(8))]),
+        )
+
+
+def generate_database(database_file_path: str, rows: int, seed: int):
+    connection = sqlite3.connect(database_file_path)
+    try:
+        connection.execute(
+            "CREATE TABLE items (id INTEGER PRIMARY KEY, big INTEGER, ratio REAL,"
+            " label TEXT, data BLOB)"
+        )
+        connection.executemany(
+            "INSERT INTO items VALUES (?, ?, ?, ?, ?)", iter_generated_rows(rows, seed)
+        )
+        connection.execute("CREATE TABLE mixed (value)")
+        connection.executemany("INSERT INTO mixed VALUES (?)", [(0.5,), (2**53 + 1,)])
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def export(database_file_path: str, source: str, make_writer: Callable) -> int:
+    with Pager(database_file_path) as pager:
+        catalog = Catalog.from_schema(
+            load_page_at_location(pager, 0).read_sqlite_schema(pager)
+        )
+        query = parse_export_source(catalog, source)
+        writer = make_writer(
+            get_column_names(query), get_column_affinities(catalog, query)
+        )
+        return export_query(pager, catalog, query, writer, batch_size=500)
+
+
+def export_text(database_file_path: str, output_path: str, writer_class):
+    with open(output_path, "w", newline="") as output_file:
+        export(
+            database_file_path,
+            "items",
+            lambda names, _: writer_class(output_file, names, output_path),
+        )
+
+
+def as_hex(blob: bytes) -> str:
+    return blob.hex().upper()
+
+
+def as_text(value: any) -> str:
+    """
+    A value as the CSV file holds it
+    """
+    if value is None:
+        return ""
+    if isinstance(value, bytes):
+        return as_hex(value)
+
+    return str(value)
+
+
+def check_csv(database_file_path: str, output_path: str, expected: List) -> bool:
+    export_text(database_file_path, output_path, CsvExportWriter)
+    with open(output_path, newline="") as output_file:
+        actual = list(csv.reader(output_file))[1:]
+
+    return actual == [[as_text(value) for value in row] for row in expected]
+
+
+def check_json_lines(database_file_path: str, output_path: str, expected: List) -> bool:
+    export_text(database_file_path, output_path, JsonLinesExportWriter)
+    with open(output_path) as output_file:
+        actual = [tuple(json.loads(line).values()) for line in output_file]
+
+    return actual == [
+        tuple(as_hex(value) if isinstance(value, bytes) else value for value in row)
+        for row in expected
+    ]
+
+
+def check_arrow(
+    database_file_path: str, output_path: str, export_format: str, expected: List
+) -> bool:
+    import pyarrow.ipc
+    import pyarrow.parquet
+
+    export(
+        database_file_path,
+        "items",
+        lambda names, affinities: ArrowExportWriter(
+            output_path, names, export_format, affinities
+        ),
+    )
+    if export_format == "parquet":
+        table = pyarrow.parquet.read_table(output_path)
+    else:
+        with pyarrow.ipc.open_file(output_path) as reader:
+            table = reader.read_all()
+
+    actual = [tuple(row.values()) for row in table.to_pylist()]
+    return actual == expected
+
+
+def check_lossy_float_fails(database_file_path: str, output_path: str) -> bool:
+    """
+    An integer that isn't exactly a float64, in a column typed float64 by a real of
+    the same batch, must fail the export and leave no file
+    """
+    try:
+        export(
+            database_file_path,
+            "mixed",
+            lambda names, affinities: ArrowExportWriter(
+                output_path, names, "arrow", affinities
+            ),
+        )
+    except ValueError:
+        return not os.path.exists(output_path)
+
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    try:
+        import pyarrow
+    except ImportError:
+        pyarrow = None
+        print("pyarrow is not installed, the arrow and parquet checks are skipped")
+
+    failed = []
+    with tempfile.TemporaryDirectory() as data_dir:
+        database_file_path = os.path.join(data_dir, "export.db")
+        generate_database(database_file_path, args.rows, args.seed)
+        connection = sqlite3.connect(database_file_path)
+        try:
+            expected = connection.execute("SELECT * FROM items ORDER BY id").fetchall()
+        finally:
+            connection.close()
+
+        checks = {
+            "csv": partial(
+                check_csv,
+                database_file_path,
+                os.path.join(data_dir, "items.csv"),
+                expected,
+            ),
+            "jsonl": partial(
+                check_json_lines,
+                database_file_path,
+                os.path.join(data_dir, "items.jsonl"),
+                expected,
+            ),
+        }
+        if pyarrow is not None:
+            for export_format in ("arrow", "parquet"):
+                checks[export_format] = partial(
+                    check_arrow,
+                    database_file_path,
+                    os.path.join(data_dir, f"items.{export_format}"),
+                    export_format,
+                    expected,
+                )
+            checks["lossy float64"] = partial(
+                check_lossy_float_fails,
+                database_file_path,
+                os.path.join(data_dir, "mixed.arrow"),
+            )
+
+        for name, check in checks.items():
+            is_passing = check()
+            print(f"{'OK  ' if is_passing else 'FAIL'} {name}")
+            if not is_passing:
+                failed.append(name)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Times a query with an increasing number of scan workers, to show how the
+parallel full table scan scales.
+
+    python3 -m benchmarks.parallel_scan databases/companies.db \
+        "SELECT id, name FROM companies WHERE name = 'company 5'" --workers 1 2 4 8
+"""
+import argparse
+import contextlib
+import io
+import os
+import time
+
+from app.catalog import Catalog
+from app.pager import Pager
+from app.pages import load_page_at_location
+from app.queries import Query
+
+
+def time_query(database_file_path: str, query_str: str, workers: int, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        with Pager(database_file_path) as pager:
+            catalog = Catalog.from_schema(
+                load_page_at_location(pager, 0).read_sqlite_schema(pager)
+            )
+            query = Query.parse_query(query_str)
+
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                query.execute(pager, catalog, workers)
+            timings.append(time.perf_counter() - start)
+
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("database_file_path")
+    parser.add_argument("query")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"cpus: {os.cpu_count()}")
+    baseline = None
+    for workers in args.workers:
+        elapsed = time_query(args.database_file_path, args.query, workers, args.repeat)
+        baseline = baseline or elapsed
+        print(
+            f"workers={workers:<3} best of {args.repeat}: {elapsed:.3f}s"
+            f" speedup x{baseline / elapsed:.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Compares the compiled row filters (RowFilter.bind) against evaluating the filter
+tree for every row, as queries did before, on synthetic rows.
+
+    python3 -m benchmarks.predicates [--rows 200000]
+
+Both select the same rows, which is checked before timing them. Filters are typed with
+the affinity and collation of their column, the compiled ones compare values of the
+storage class of their constant directly, the interpreted ones go through order keys
+on every comparison.
+"""
+import argparse
+import random
+import timeit
+
+from app.filtering import ColumnType, RowFilter, ValueFilter
+from app.parser import parse_select
+
+from typing import Callable, List, Sequence
+
+COLUMNS = ["id", "amount", "score", "name", "tag", "rank", "label"]
+COLUMN_TYPES = {
+    "id": ColumnType("INTEGER"),
+    "amount": ColumnType("INTEGER"),
+    "score": ColumnType("REAL"),
+    "name": ColumnType("TEXT"),
+    "tag": ColumnType("TEXT"),
+    "rank": ColumnType("INTEGER"),
+    "label": ColumnType("TEXT", "NOCASE"),
+}
+WORDS = ["alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel"]
+
+# name -> WHERE clause on COLUMNS
+PREDICATES = {
+    "int =": "amount = 500",
+    "int <": "amount < 500",
+    "int BETWEEN": "amount BETWEEN 250 AND 750",
+    "int IN": "amount IN (1, 10, 100, 1000)",
+    "real >=": "score >= 50.5",
+    "text =": "tag = 'delta'",
+    "text IN": "tag IN ('alpha', 'golf')",
+    "text LIKE": "name LIKE 'name 1%'",
+    "NOCASE =": "label = 'Delta'",
+    "NOCASE <": "label < 'Delta'",
+    "IS NULL": "rank IS NULL",
+    "AND": "amount < 500 AND tag = 'delta'",
+    "OR": "amount < 100 OR tag = 'delta'",
+    "NOT": "NOT (amount < 500)",
+}
+
+
+def generate_rows(count: int) -> List[tuple]:
+    return [
+        (
+            row_id,
+            random.randrange(1000),
+            round(random.uniform(0, 100), 3),
+            f"name {random.randrange(count)}",
+            random.choice(WORDS),
+            random.choice([None, random.randrange(100)]),
+            random.choice([word, word.upper(), word.title()]),
+        )
+        for row_id, word in zip(range(1, count + 1), random.choices(WORDS, k=count))
+    ]
+
+
+def parse_filter(predicate: str) -> RowFilter:
+    row_filter = parse_select(f"SELECT id FROM t WHERE {predicate}").value_filter
+    return row_filter.with_column_types(COLUMN_TYPES.__getitem__)
+
+
+def bind_interpreted(row_filter: RowFilter) -> Callable[[Sequence[any]], bool]:
+    """
+    The row matcher queries used before filters were compiled
+    """
+    if isinstance(row_filter, ValueFilter):
+        position = COLUMNS.index(row_filter.column)
+        return lambda row: row_filter.matches(row[position])
+
+    positions = row_filter.locate(COLUMNS.index)
+    return lambda row: row_filter.evaluate(row, positions) is True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=200_000)
+    args = parser.parse_args()
+    random.seed(0)
+    rows = generate_rows(args.rows)
+
+    print(f"{'predicate':<12} {'compiled':>10} {'tree':>10}   per row   selected")
+    for name, predicate in PREDICATES.items():
+        row_filter = parse_filter(predicate)
+        compiled = row_filter.bind(COLUMNS.index)
+        interpreted = bind_interpreted(row_filter)
+        selected = sum(map(compiled, rows))
+        assert selected == sum(map(interpreted, rows)), name
+
+        new = min(timeit.repeat(lambda: sum(map(compiled, rows)), number=1, repeat=5))
+        old = min(
+            timeit.repeat(lambda: sum(map(interpreted, rows)), number=1, repeat=5)
+        )
+        print(
+            f"{name:<12} {new / args.rows * 1e9:8.1f}ns {old / args.rows * 1e9:8.1f}ns"
+            f"   x{old / new:.2f}   {selected}"
+        )
+
+
+if __name__ == "__main__":
+    main()
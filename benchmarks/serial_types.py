@@ -0,0 +1,111 @@
+"""
+Compares the table-driven column value decoder (app.reading.read_column_value) against
+the if/elif chain it replaced, value by value for each serial type.
+
+    python3 -m benchmarks.serial_types [--values 100000]
+
+The chain is kept here as it was, only the serial types it could read are timed
+for it: it had no branch for reals, read integers as unsigned (signed 24 and 48 bit
+integers now cost a bit more) and returned text undecoded.
+"""
+import argparse
+import random
+import struct
+import timeit
+
+from app.reading import read_column_value, serial_type_size
+
+
+def read_column_value_chain(buffer: memoryview, offset: int, serial_type: int):
+    if serial_type == 0:
+        return None
+    elif serial_type == 1:
+        return int.from_bytes(buffer[offset : offset + 1], "big")
+    elif serial_type == 2:
+        return int.from_bytes(buffer[offset : offset + 2], "big")
+    elif serial_type == 3:
+        return int.from_bytes(buffer[offset : offset + 3], "big")
+    elif serial_type == 4:
+        return int.from_bytes(buffer[offset : offset + 4], "big")
+    elif serial_type == 5:
+        return int.from_bytes(buffer[offset : offset + 6], "big")
+    elif serial_type == 6:
+        return int.from_bytes(buffer[offset : offset + 8], "big")
+    elif serial_type == 8:
+        return 0
+    elif serial_type == 9:
+        return 1
+    elif (serial_type >= 13) and (serial_type % 2 == 1):
+        n_bytes = (serial_type - 13) // 2
+        return bytes(buffer[offset : offset + n_bytes])
+    elif (serial_type >= 12) and (serial_type % 2 == 0):
+        n_bytes = (serial_type - 12) // 2
+        return bytes(buffer[offset : offset + n_bytes])
+
+    else:
+        raise Exception(f"Unknown serial_type {serial_type}")
+
+
+def random_int(size: int) -> bytes:
+    bits = 8 * size
+    value = random.randint(-(2 ** (bits - 1)), 2 ** (bits - 1) - 1)
+    return value.to_bytes(size, "big", signed=True)
+
+
+# name -> (serial type, encoder of a random value)
+SAMPLES = {
+    "NULL (0)": (0, lambda: b""),
+    "int8 (1)": (1, lambda: random_int(1)),
+    "int16 (2)": (2, lambda: random_int(2)),
+    "int24 (3)": (3, lambda: random_int(3)),
+    "int32 (4)": (4, lambda: random_int(4)),
+    "int48 (5)": (5, lambda: random_int(6)),
+    "int64 (6)": (6, lambda: random_int(8)),
+    "float64 (7)": (7, lambda: struct.pack(">d", random.uniform(-1e9, 1e9))),
+    "zero (8)": (8, lambda: b""),
+    "text (13+)": (13 + 2 * 12, lambda: b"hello world!"),
+    "blob (12+)": (12 + 2 * 12, lambda: bytes(range(12))),
+}
+
+
+def build_values(serial_type: int, encode, count: int):
+    """
+    Encodes "count" values back to back, returns the buffer and their offsets
+    """
+    encoded = [encode() for _ in range(count)]
+    size = serial_type_size(serial_type)
+    buffer = memoryview(b"".join(encoded))
+
+    return buffer, range(0, size * count, size) if size else [0] * count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--values", type=int, default=100_000)
+    args = parser.parse_args()
+    random.seed(0)
+
+    print(f"{'serial type':<14} {'table':>10} {'if/elif':>10}   per value")
+    for name, (serial_type, encode) in SAMPLES.items():
+        buffer, offsets = build_values(serial_type, encode, args.values)
+
+        def decode_table():
+            for offset in offsets:
+                read_column_value(buffer, offset, serial_type)
+
+        def decode_chain():
+            for offset in offsets:
+                read_column_value_chain(buffer, offset, serial_type)
+
+        table = min(timeit.repeat(decode_table, number=1, repeat=5)) / args.values
+        line = f"{name:<14} {table * 1e9:8.1f}ns"
+        if serial_type != 7:
+            chain = min(timeit.repeat(decode_chain, number=1, repeat=5)) / args.values
+            line += f" {chain * 1e9:8.1f}ns   x{chain / table:.2f}"
+        else:
+            line += f" {'n/a':>10}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
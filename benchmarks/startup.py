@@ -0,0 +1,89 @@
+"""
+Compares the cost of parsing queries with the hand-written parser against sqlparse,
+which the query parser used to be built on.
+
+    python3 -m benchmarks.startup databases/companies.db \
+        "SELECT id, name FROM companies WHERE country = 'eritrea'"
+
+Cold timings run a fresh interpreter for each sample (import and first parse, on top
+of the app modules both need),
+warm timings parse the query repeatedly in this process. sqlparse timings are
+skipped when it isn't installed.
+"""
+import argparse
+import subprocess
+import sys
+import time
+import timeit
+
+from app.parser import parse_select
+from app.queries import Query
+
+
+def time_subprocess(code: str, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-c", code], check=True, stdout=subprocess.DEVNULL
+        )
+        timings.append(time.perf_counter() - start)
+
+    return min(timings)
+
+
+def time_call(function, number: int) -> float:
+    return min(timeit.repeat(function, number=number, repeat=5)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("database_file_path")
+    parser.add_argument("query")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    try:
+        import sqlparse
+    except ImportError:
+        sqlparse = None
+        print("sqlparse is not installed, its timings are skipped")
+
+    query = args.query
+    print(f"best of {args.repeat} fresh interpreters:")
+    # modules the parser builds its result from, the query parser needs them either way
+    shared_imports = "import app.aggregation, app.filtering, app.joins, app.sorting"
+    baseline = time_subprocess(shared_imports, args.repeat)
+    print(f"  {'shared app modules':<28} {baseline * 1000:8.2f}ms")
+    cold = {
+        "hand-written parser": f"{shared_imports}; import app.parser; app.parser.parse_select({query!r})",
+        "sqlparse": f"{shared_imports}; import sqlparse; sqlparse.parse({query!r})",
+    }
+    for name, code in cold.items():
+        if name == "sqlparse" and sqlparse is None:
+            continue
+        elapsed = time_subprocess(code, args.repeat)
+        print(f"  {name:<28} {elapsed * 1000:8.2f}ms (+{(elapsed - baseline) * 1000:.2f}ms)")
+    elapsed = time_subprocess(
+        "import runpy, sys; "
+        f"sys.argv = ['app.main', {args.database_file_path!r}, {query!r}]; "
+        "runpy.run_module('app.main', run_name='__main__')",
+        args.repeat,
+    )
+    print(f"  {'whole query (app.main)':<28} {elapsed * 1000:8.2f}ms")
+
+    print("warm, per parse:")
+    warm = {
+        "hand-written parser": lambda: parse_select(query),
+        "cached plan (Query)": lambda: Query.parse_query(query),
+    }
+    if sqlparse is not None:
+        warm["sqlparse"] = lambda: sqlparse.parse(query)
+    for name, function in warm.items():
+        elapsed = time_call(function, args.number)
+        print(f"  {name:<28} {elapsed * 1_000_000:8.2f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""
+Times the main workloads on a large synthetic database and saves the timings as JSON,
+so that runs can be compared for regressions.
+
+    python3 -m benchmarks.suite --rows 2000000 --output results.json
+    python3 -m benchmarks.suite --rows 2000000 --compare results.json
+
+The database is generated with the sqlite3 module from a seeded random generator, so
+the same --rows and --seed always give the same rows. It is kept in --data-dir and
+reused by later runs. Its "events" table has wide rows, a few of them with payloads
+spilling to overflow pages, an index on "category" and "amount", and enough rows
+for its b-trees to have several levels.
+
+Every workload goes through Query.execute (or the command runner for .dbinfo) with
+its output discarded, on a freshly opened database for each repetition, and the best
+time is kept. With --compare, workloads more than --threshold slower than in the
+given results are reported, and the exit status is 1.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+from app.catalog import Catalog
+from app.commands import iter_command_output
+from app.pager import Pager
+from app.pages import load_page_at_location
+from app.queries import Query
+
+from typing import Dict, Iterator, List, Tuple
+
+CATEGORIES = 200
+MAX_AMOUNT = 1_000_000
+# One row in OVERFLOW_EVERY gets a payload bigger than a page
+OVERFLOW_EVERY = 500
+OVERFLOW_PAYLOAD_SIZE = 6000
+WORDS = ["alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel"]
+
+# name -> command, ".dbinfo" or a SELECT query on the generated database
+WORKLOADS = {
+    "dbinfo": ".dbinfo",
+    "count": "SELECT COUNT(*) FROM events",
+    "full scan": "SELECT id, name, amount FROM events WHERE name = 'missing'",
+    "index lookup": "SELECT id, name, amount FROM events WHERE category = 'category 42'",
+    "index range": (
+        "SELECT id, category, score FROM events WHERE amount BETWEEN 500000 AND 502000"
+    ),
+    "row id range": "SELECT id, name FROM events WHERE id BETWEEN 100000 AND 110000",
+}
+
+
+def iter_generated_rows(rows: int, seed: int) -> Iterator[Tuple[any, ...]]:
+    generator = random.Random(seed)
+    for row_id in range(1, rows + 1):
+        if row_id % OVERFLOW_EVERY == 0:
+            payload = "".join(generator.choices(WORDS, k=OVERFLOW_PAYLOAD_SIZE // 5))
+        else:
+            payload = " ".join(generator.choices(WORDS, k=generator.randint(4, 16)))
+        yield (
+            row_id,
+            f"category {generator.randrange(CATEGORIES)}",
+            generator.randrange(MAX_AMOUNT),
+            round(generator.uniform(0, 100), 3),
+            f"name {generator.randrange(rows)}",
+            generator.choice(WORDS),
+            generator.randrange(2**40) - 2**39,
+            generator.choice([None, generator.randrange(100)]),
+            payload,
+        )
+
+
+def generate_database(database_file_path: str, rows: int, seed: int):
+    """
+    Writes the "events" table and its indexes, indexes being created after the rows
+    are inserted, as bulk loads usually do
+    """
+    connection = sqlite3.connect(database_file_path)
+    try:
+        connection.execute("PRAGMA journal_mode = OFF")
+        connection.execute("PRAGMA synchronous = OFF")
+        connection.execute(
+            "CREATE TABLE events (id INTEGER PRIMARY KEY, category TEXT, amount INTEGER,"
+            " score REAL, name TEXT, tag TEXT, big INTEGER, rank INTEGER, payload TEXT)"
+        )
+        connection.executemany(
+            "INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            iter_generated_rows(rows, seed),
+        )
+        connection.execute("CREATE INDEX idx_events_category ON events (category)")
+        connection.execute("CREATE INDEX idx_events_amount ON events (amount)")
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def get_database(data_dir: str, rows: int, seed: int) -> str:
+    """
+    Path of the generated database for these parameters, generating it if needed
+    """
+    database_file_path = os.path.join(data_dir, f"benchmark_{rows}_{seed}.db")
+    if not os.path.exists(database_file_path):
+        print(f"Generating {rows} rows in {database_file_path}", file=sys.stderr)
+        os.makedirs(data_dir, exist_ok=True)
+        # generated under another name first, an interrupted run leaves no partial file
+        partial_path = database_file_path + ".partial"
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        start = time.perf_counter()
+        generate_database(partial_path, rows, seed)
+        os.replace(partial_path, database_file_path)
+        print(f"Generated in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    return database_file_path
+
+
+def run_command(database_file_path: str, command: str):
+    with Pager(database_file_path) as pager:
+        catalog = Catalog.from_schema(
+            load_page_at_location(pager, 0).read_sqlite_schema(pager)
+        )
+        if command.startswith("."):
+            for _ in iter_command_output(pager, catalog, command):
+                pass
+        else:
+            Query.parse_query(command).execute(pager, catalog)
+
+
+def time_workload(database_file_path: str, command: str, repeat: int) -> List[float]:
+    timings = []
+    with open(os.devnull, "w") as devnull:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(devnull):
+                run_command(database_file_path, command)
+            timings.append(time.perf_counter() - start)
+
+    return timings
+
+
+def find_regressions(
+    results: Dict[str, any], baseline: Dict[str, any], threshold: float
+) -> List[str]:
+    """
+    Workloads whose best time is more than "threshold" (a fraction) above the
+    baseline one
+    """
+    regressions = []
+    for name, timings in results["workloads"].items():
+        if name not in baseline["workloads"]:
+            continue
+        ratio = timings["best"] / baseline["workloads"][name]["best"]
+        if ratio > 1 + threshold:
+            regressions.append(f"{name}: x{ratio:.2f}")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", default=tempfile.gettempdir())
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--workloads", nargs="+", choices=list(WORKLOADS), default=list(WORKLOADS)
+    )
+    parser.add_argument("--output", help="JSON file the results are written to")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    database_file_path = get_database(args.data_dir, args.rows, args.seed)
+    results = {
+        "rows": args.rows,
+        "seed": args.seed,
+        "database_size": os.path.getsize(database_file_path),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "workloads": {},
+    }
+    for name in args.workloads:
+        timings = time_workload(database_file_path, WORKLOADS[name], args.repeat)
+        results["workloads"][name] = {
+            "command": WORKLOADS[name],
+            "best": min(timings),
+            "median": statistics.median(timings),
+            "timings": timings,
+        }
+        print(f"{name:<14} best of {args.repeat}: {min(timings):.3f}s")
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if (baseline["rows"], baseline["seed"]) != (args.rows, args.seed):
+            print("warning: the baseline ran on another database", file=sys.stderr)
+        regressions = find_regressions(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"regression {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()